@@ -0,0 +1,155 @@
+# Chris Tang
+# aggregate.py
+
+import os
+import json
+import numpy as np
+
+import fileio
+import catalog
+import bulkLoad
+
+# Out-of-core averaging of repeated trials (the _xxx suffix of fileio.trialPath) at each point
+# (pumpFreq, pumpAmp, transverseField, probeDeltaFreq). Trials are streamed one file at a time
+# and folded into a running count, mean and M2 (sum of squared deviations) of their per-column
+# means with Welford's update. The folded trial numbers are kept as ranges, so memory is bounded
+# by the number of points, not of trials:
+#	state = aggregate.updateAggregate()		# folds in only the trials not seen before
+#	summary = aggregate.summaryTable(state)
+# Trials are assumed not to change once written; files still empty (reserved by trialPath but not
+# yet written) are left for a later update
+
+##################################################################################################
+# Aggregation Parameters
+
+# Name of the running state inside fileio.PROCESSED_DATA_FOLDER
+STATE_FILENAME = "aggregate.json"
+# Name of the summary table inside fileio.PROCESSED_DATA_FOLDER
+SUMMARY_FILENAME = "summary.csv"
+##################################################################################################
+def statePath():
+	"""Returns the path of the running state"""
+
+	return os.path.join(fileio.PROCESSED_DATA_FOLDER, STATE_FILENAME)
+
+def loadState(path=None):
+	"""Returns the saved running state, or an empty one
+
+	Return Values:
+		state: dict with "points", mapping point keys (ffff_AAAA_HHHH/dddd) to their running statistics
+			{"numTrials", "numPts", "mean", "M2", "folded" (ranges [first, last] of the folded trial numbers)}
+	"""
+
+	if path is None: path = statePath()
+	if not os.path.exists(path): return {"points": {}}
+	with open(path) as stateFile:
+		return json.load(stateFile)
+
+def saveState(state, path=None):
+	"""Atomically replaces the saved running state"""
+
+	if path is None: path = statePath()
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path + ".tmp", "w") as stateFile:
+		json.dump(state, stateFile)
+	os.replace(path + ".tmp", path)
+
+def isFolded(point, trialNum):
+	"""Returns True if the trial number has been folded into the point"""
+
+	return any(first <= trialNum <= last for first, last in point.get("folded", []))
+
+def foldTrial(point, trialNum, arr):
+	"""Welford update of a point's running statistics with one trial
+
+	Arguments:
+		point: running statistics of the point, updated in place ({} for a new point)
+		trialNum: trial number
+		arr: (rows, columns) array of the trial
+	"""
+
+	trialMean = arr.mean(axis=0)
+	if not point:
+		point.update({"numTrials": 0, "numPts": 0, "mean": np.zeros(len(trialMean)).tolist(), "M2": np.zeros(len(trialMean)).tolist(), "folded": []})
+	if len(point["mean"]) != len(trialMean): raise ValueError("Trial with %d columns folded into a point with %d" % (len(trialMean), len(point["mean"])))
+
+	mean, M2 = np.array(point["mean"]), np.array(point["M2"])
+	point["numTrials"] += 1
+	point["numPts"] += len(arr)
+	delta = trialMean - mean
+	mean += delta / point["numTrials"]
+	M2 += delta * (trialMean - mean)
+	point["mean"], point["M2"] = mean.tolist(), M2.tolist()
+
+	# Merge the trial number into the sorted ranges
+	ranges = sorted(point["folded"] + [[trialNum, trialNum]])
+	point["folded"] = [ranges[0]]
+	for first, last in ranges[1:]:
+		if first <= point["folded"][-1][1] + 1:
+			point["folded"][-1][1] = max(point["folded"][-1][1], last)
+		else:
+			point["folded"].append([first, last])
+##################################################################################################
+def updateAggregate(path=None, printSwitch=True, **parameters):
+	"""Folds every catalogued trial not yet in the running state into it, and saves the state
+
+	Arguments:
+		path: path of the running state, defaults to statePath()
+		printSwitch: prints the number of folded trials if True
+		parameters: restricts the trials as in catalog.queryTrials(), e.g. transverseField=0.4
+	Return Values:
+		state: the updated running state
+	"""
+
+	state = loadState(path)
+
+	numFolded = 0
+	for trialPath in catalog.queryTrials(**parameters):
+		parameterDir, fileName = os.path.split(trialPath)
+		point = state["points"].setdefault(os.path.basename(parameterDir) + "/" + fileName.split("_")[0], {})
+		trialNum = fileio.strToTrialNum(fileName)
+		if isFolded(point, trialNum) or os.path.getsize(trialPath) == 0: continue
+		arr = bulkLoad.parseTrialFile(trialPath)
+		if len(arr):
+			foldTrial(point, trialNum, arr)
+			numFolded += 1
+	state["points"] = {key: point for key, point in state["points"].items() if point}
+
+	if numFolded: saveState(state, path)
+	if printSwitch: print("Aggregate: Folded in %d new trials, %d points" % (numFolded, len(state["points"])))
+	return state
+
+def summaryTable(state):
+	"""Returns the running statistics as a structured array, one record per point
+
+	Return Values:
+		summary: structured array with the fields pumpFreq (Hz), pumpAmp (Tesla), transverseField (Tesla),
+			probeDeltaFreq (Hz), numTrials, numPts, and per column the mean, std (between trials) and
+			sem (standard error of the mean); std and sem are NaN for a single trial
+	"""
+
+	numCols = max([len(point["mean"]) for point in state["points"].values()], default=0)
+	dtype = [("pumpFreq", "f8"), ("pumpAmp", "f8"), ("transverseField", "f8"), ("probeDeltaFreq", "f8"), ("numTrials", "i4"), ("numPts", "i8"),
+		("mean", "f8", (numCols,)), ("std", "f8", (numCols,)), ("sem", "f8", (numCols,))]
+	summary = np.zeros(len(state["points"]), dtype=dtype)
+	for record, (key, point) in zip(summary, sorted(state["points"].items())):
+		parameterDir, deltaFreqStr = key.split("/")
+		record["pumpFreq"], record["pumpAmp"], record["transverseField"] = fileio.dirToParameters(parameterDir)
+		record["probeDeltaFreq"] = fileio.strToDeltaFreq(deltaFreqStr)
+		record["numTrials"], record["numPts"] = point["numTrials"], point["numPts"]
+		record["mean"] = point["mean"]
+		record["std"] = np.sqrt(np.array(point["M2"]) / (point["numTrials"] - 1)) if point["numTrials"] > 1 else np.nan
+		record["sem"] = record["std"] / np.sqrt(point["numTrials"])
+	return summary
+
+def saveSummary(state, path=None):
+	"""Writes the summary table as a .csv with a header line, returning its path"""
+
+	if path is None: path = os.path.join(fileio.PROCESSED_DATA_FOLDER, SUMMARY_FILENAME)
+	summary = summaryTable(state)
+	numCols = summary["mean"].shape[1]
+	header = ["pumpFreq", "pumpAmp", "transverseField", "probeDeltaFreq", "numTrials", "numPts"] + ["%s%d" % (name, i) for name in ["mean", "std", "sem"] for i in range(numCols)]
+	columns = [summary[name] for name in header[:6]] + [summary[name][:, i] for name in ["mean", "std", "sem"] for i in range(numCols)]
+	np.savetxt(path, np.column_stack(columns) if len(summary) else np.zeros((0, len(header))), delimiter=",", header=",".join(header))
+	return path
+##################################################################################################
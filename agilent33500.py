@@ -1,27 +1,45 @@
 # Chris Tang
 # agilent33500.py
 
-import visa
+import instrument
 
 ##################################################################################################
-class Agilent33500():
-	def __init__(self, port):
+class Agilent33500(instrument.Instrument):
+	BATCH_SEPARATOR = ";:"			# Leading colon returns each command to the SCPI root
+	BATCH_CONFIRM_QUERY = "*OPC?"
+
+	def __init__(self, port, syncChan=1, resourceManager=None, useCache=False):
 		self.comPort = port
-		self.inst = visa.ResourceManager().open_resource(port)
+		instrument.Instrument.__init__(self, port, resourceManager, useCache)
 
-		# Initialize chans to sine waves
-		self.setFunc(1, "SIN")
-		self.setFunc(2, "SIN")
+		with self.batch():
+			# Initialize chans to sine waves
+			self.setFunc(1, "SIN")
+			self.setFunc(2, "SIN")
 
-		# Initialize sync output
-		self.setSyncSource(constants.fnGenOutputChan())
-		self.setSyncState(True)
-		
-		self.setDisplay(False)		# Turn off display
+			# Initialize sync output
+			self.setSyncSource(syncChan)
+			self.setSyncState(True)
+			
+			self.setDisplay(False)		# Turn off display
 
 		# Optional printing
 		print("\nConnecting Agilent 33500 through address:\n%s" % port)
-		print("Querying IDN:\n%s" % self.inst.query("*IDN?"))
+		print("Querying IDN:\n%s" % self.query("*IDN?"))
+	######################################################################################
+	def resyncCache(self, printSwitch=True):
+		"""Rebuilds the setting cache by reading the waveform and output settings back from the function generator"""
+
+		self.invalidateCache()
+		for chan in [1, 2]:
+			self.settingCache["SOUR%d:FUNC" % chan] = "SOUR%d:FUNC %s" % (chan, self.query("SOUR%d:FUNC?" % chan).strip())
+			self.settingCache["SOUR%d:FREQ" % chan] = "SOUR%d:FREQ %e" % (chan, float(self.query("SOUR%d:FREQ?" % chan)))
+			self.settingCache["SOUR%d:VOLT" % chan] = "SOUR%d:VOLT %e" % (chan, float(self.query("SOUR%d:VOLT?" % chan)))
+			self.settingCache["SOUR%d:VOLT:OFFS" % chan] = "SOUR%d:VOLT:OFFS %e" % (chan, float(self.query("SOUR%d:VOLT:OFFS?" % chan)))
+			self.settingCache["OUTP%d" % chan] = "OUTP%d %s" % (chan, boolToStr(bool(int(self.query("OUTP%d?" % chan)))))
+		self.settingCache["OUTP:SYNC"] = "OUTP:SYNC %s" % boolToStr(bool(int(self.query("OUTP:SYNC?"))))
+		self.settingCache["OUTP:SYNC:SOUR"] = "OUTP:SYNC:SOUR %s" % self.query("OUTP:SYNC:SOUR?").strip()
+		if printSwitch: print("Setting cache resynced from instrument")
 	######################################################################################
 	def setFunc(self, chan, func, printSwitch=True):
 		"""Sets chan (1 or 2) to output waveform func"""
@@ -30,7 +48,7 @@ class Agilent33500():
 		checkValidFunc(func, "agilent33500.setFunc()")
 
 		if printSwitch: print("Output on chan %d set to: %s" % (chan, func))
-		self.inst.write("SOUR%d:FUNC %s" % (chan, func))
+		self.writeSetting("SOUR%d:FUNC" % chan, "SOUR%d:FUNC %s" % (chan, func))
 
 	def setOutputState(self, chan, state, printSwitch=True):
 		"""Turns output of specified chan (1 or 2) on (True) or off (False)"""
@@ -39,7 +57,7 @@ class Agilent33500():
 		checkValidState(state, "agilent33500.setOutputState()")
 
 		if printSwitch: print("Output %d set to %s" % (chan, boolToStr(state)))
-		self.inst.write("OUTP%d %s" % (chan, boolToStr(state)))
+		self.writeSetting("OUTP%d" % chan, "OUTP%d %s" % (chan, boolToStr(state)))
 	
 	def setLoad(self, chan, load, printSwitch=True):
 		"""Sets the output load of chan (1 or 2) in (ohms)"""
@@ -49,10 +67,10 @@ class Agilent33500():
 
 		if load == "INF":
 			if printSwitch: print("Output load (chan %d) set to INF" % chan)
-			self.inst.write("OUTP%d:LOAD INF" % chan)
+			self.writeSetting("OUTP%d:LOAD" % chan, "OUTP%d:LOAD INF" % chan)
 		else:
 			if printSwitch: print("Output load (chan %d) set to %e" % (chan, load))
-			self.inst.write("OUTP%d:LOAD %e" % (chan, load))
+			self.writeSetting("OUTP%d:LOAD" % chan, "OUTP%d:LOAD %e" % (chan, load))
 	
 	def setFreq(self, chan, freq, printSwitch=True):
 		"""Sets frequency of chan (1 or 2) to freq in (Hz)"""
@@ -61,7 +79,7 @@ class Agilent33500():
 		checkValidFreq(freq, "agilent33500.setFreq()")
 
 		if printSwitch: print("Frequency on chan %d set to: %e Hz" % (chan, freq))
-		self.inst.write("SOUR%d:FREQ %e" % (chan, freq))
+		self.writeSetting("SOUR%d:FREQ" % chan, "SOUR%d:FREQ %e" % (chan, freq))
 	
 	def setAmp(self, chan, amp, printSwitch=True):
 		"""Sets peak-to-peak amplitude of chan (1 or 2) to amp in (Volts)"""
@@ -70,7 +88,7 @@ class Agilent33500():
 		checkValidAmp(amp, "agilent33500.setAmp()")
 
 		if printSwitch: print("Vpp on chan %d set to: %e V" % (chan, amp))
-		self.inst.write("SOUR%d:VOLT %e" % (chan, amp))
+		self.writeSetting("SOUR%d:VOLT" % chan, "SOUR%d:VOLT %e" % (chan, amp))
 	
 	def setOffset(self, chan, offset, printSwitch=True):
 		"""Sets DC offset of chan (1 or 2) to offset in (Volts)"""
@@ -79,7 +97,7 @@ class Agilent33500():
 		checkValidOffset(offset, "agilent33500.setOffset()")
 
 		if printSwitch: print("DC Offset on chan %d set to: %e V" % (chan, offset))
-		self.inst.write("SOUR%d:VOLT:OFFS %e" % (chan, offset))
+		self.writeSetting("SOUR%d:VOLT:OFFS" % chan, "SOUR%d:VOLT:OFFS %e" % (chan, offset))
 
 	def setSyncState(self, state, printSwitch=True):
 		"""Turns the sync output on (True) or off (False)"""
@@ -87,7 +105,7 @@ class Agilent33500():
 		checkValidState(state, "agilent33500.setTrigState()")
 
 		if printSwitch: print("Sync turned %s" % boolToStr(state))
-		self.inst.write("OUTP:SYNC %s" % boolToStr(state))
+		self.writeSetting("OUTP:SYNC", "OUTP:SYNC %s" % boolToStr(state))
 
 	def setSyncSource(self, chan, printSwitch=True):
 		"""Sets the sync to trigger off of channel (1 or 2)"""
@@ -95,7 +113,7 @@ class Agilent33500():
 		checkValidChan(chan, "agilent33500.setSyncSource()")
 
 		if printSwitch: print("Sync source set to: %d" % chan)
-		self.inst.write("OUTP:SYNC:SOUR CH%d" % chan)
+		self.writeSetting("OUTP:SYNC:SOUR", "OUTP:SYNC:SOUR CH%d" % chan)
 	
 	def combineChan(self, chan, printSwitch=True):
 		"""Combines both channels into the primary chan (1 or 2)"""
@@ -103,7 +121,7 @@ class Agilent33500():
 		checkValidChan(chan, "agilent33500.combineChan()")
 
 		if printSwitch: print("Channels combined onto primary channel: %d" % chan)
-		self.inst.write("SOUR%d:COMB:FEED CH%d" % (chan, (chan % 2) + 1))
+		self.writeSetting("SOUR%d:COMB:FEED" % chan, "SOUR%d:COMB:FEED CH%d" % (chan, (chan % 2) + 1))
 	
 	def setDisplay(self, state, printSwitch=True):
 		"""Turns the display of the function generator on (True) or off (False)"""
@@ -111,7 +129,7 @@ class Agilent33500():
 		checkValidState(state, "agilent33500.setDisplay()")
 
 		if printSwitch: print("Display turned %s" % boolToStr(state))
-		self.inst.write("DISP %s" % boolToStr(state))
+		self.writeSetting("DISP", "DISP %s" % boolToStr(state))
 	def setSine(self, chan, freq, amp, offset=0, printSwitch=True):
 		"""Sets a sine wave on chan (1 or 2) with given:
 			frequency in (Hz)
@@ -125,9 +143,10 @@ class Agilent33500():
 		checkValidOffset(offset, "agilent33500.outputSine()")
 
 		if printSwitch: print("")
-		self.setFreq(chan, freq)
-		self.setAmp(chan, amp)
-		self.setOffset(chan, offset)
+		with self.batch():
+			self.setFreq(chan, freq)
+			self.setAmp(chan, amp)
+			self.setOffset(chan, offset)
 
 		# if printSwitch: print("chan %d outputting Sine Wave:\nFreq: %e Hz\nVpp: %e Volts\nDC Offset: %e Volts" % (chan, freq, amp, offset))
 		# self.inst.write("SOUR%d:APPL:SIN %e,%e,%e" (chan, freq, amp, offset))
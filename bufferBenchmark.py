@@ -0,0 +1,93 @@
+# Chris Tang
+# bufferBenchmark.py
+
+import time
+import tracemalloc
+import numpy as np
+
+import sr830
+import simVisa
+
+##################################################################################################
+# Define Parameters Here
+
+# Number of full-buffer reads per transfer method
+NUM_TRIALS = 20
+# Chunks per buffer when reading as lockinData.streamData() does
+NUM_CHUNKS = 32
+# SR 830 to benchmark; leave as None to run against the simulated backend
+LOCKIN_PORT = None
+##################################################################################################
+def fillBuffer(lockin):
+	"""Stores a full buffer of points to read back, returning the number stored"""
+
+	if isinstance(lockin.inst, simVisa.SimSR830):
+		# The simulated lock-in fills its buffer instantly
+		lockin.inst.resetBuffer()
+		lockin.inst.numStored = lockin.inst.bufferSize
+	else:
+		lockin.setSampleRate(512, printSwitch=False)
+		lockin.resetDataBuffer(printSwitch=False)
+		lockin.startDataStorage(printSwitch=False)
+		time.sleep(sr830.BUFFER_SIZE / 512.)
+		lockin.stopDataStorage(printSwitch=False)
+	return lockin.getNumStoredPoints()
+
+def benchmark(name, readFunc, numPts):
+	"""Times NUM_TRIALS calls of readFunc and measures the allocations each one makes
+	Allocations are the memory blocks each trial's results keep alive when the caller holds on to
+	them, counted from tracemalloc snapshots; transient memory includes the VISA transfer itself
+	"""
+
+	readFunc()		# Warm up, so the pooled buffer is already allocated
+
+	results = []
+	peaks = []
+	tracemalloc.start()
+	before = tracemalloc.take_snapshot()
+	startTime = time.perf_counter()
+	for i in range(NUM_TRIALS):
+		tracemalloc.reset_peak()
+		baseline = tracemalloc.get_traced_memory()[0]
+		results.append(readFunc())
+		peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+	elapsed = time.perf_counter() - startTime
+	after = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+
+	filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+	stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "filename")
+	numBlocks = sum(stat.count_diff for stat in stats)
+	numBytes = NUM_TRIALS * 2 * 4 * numPts
+	print("%-36s %10.2f MB/sec %8.1f allocations/trial %10.1f kB transient/trial" % (name, numBytes / elapsed / 1e6, numBlocks / NUM_TRIALS, np.mean(peaks) / 1e3))
+
+def readChunks(lockin, numPts, numChunks, pooled):
+	"""Reads the buffer in numChunks pieces as lockinData.streamData() does, keeping every chunk
+	pooled: True reads into one array for the whole buffer, False into a fresh array per chunk
+	"""
+
+	bounds = np.linspace(0, numPts, numChunks + 1).astype(int)
+	segmentBuffer = np.empty((2, sr830.BUFFER_SIZE), dtype='<f4') if pooled else None
+	chunks = []
+	for start, stop in zip(bounds[:-1], bounds[1:]):
+		out = segmentBuffer[:, start:] if pooled else np.empty((2, stop - start), dtype='<f4')
+		chunks.append(lockin.readDataBuffers(start, stop - start, out=out, printSwitch=False))
+	return chunks
+##################################################################################################
+def main():
+	if LOCKIN_PORT is None:
+		lockin = sr830.SR830("SIM::LOCKIN", resourceManager=simVisa.SimResourceManager())
+	else:
+		lockin = sr830.SR830(LOCKIN_PORT)
+
+	numPts = fillBuffer(lockin)
+	print("\nReading %d points per channel, %d trials each:" % (numPts, NUM_TRIALS))
+	benchmark("Per-channel TRCB? (legacy)", lambda: (lockin.readDataBuffer(1, printSwitch=False), lockin.readDataBuffer(2, printSwitch=False)), numPts)
+	benchmark("Pooled TRCB? (ieee)", lambda: lockin.readDataBuffers(0, numPts, printSwitch=False), numPts)
+	benchmark("Pooled TRCL? (lia)", lambda: lockin.readDataBuffers(0, numPts, fmt="lia", printSwitch=False), numPts)
+	benchmark("Streamed, array per chunk", lambda: readChunks(lockin, numPts, NUM_CHUNKS, pooled=False), numPts)
+	benchmark("Streamed, array per segment", lambda: readChunks(lockin, numPts, NUM_CHUNKS, pooled=True), numPts)
+
+##################################################################################################
+if __name__ == "__main__":
+	main()
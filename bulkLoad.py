@@ -0,0 +1,88 @@
+# Chris Tang
+# bulkLoad.py
+
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import fileio
+import catalog
+
+# Parallel loading of the legacy .csv trials (ffff_AAAA_HHHH/dddd_xxx.csv) into one structured array:
+#	trials, paths = bulkLoad.loadTrials(transverseField=0.4)
+#	trials["values"][trials["probeDeltaFreq"] == 3e-3]
+# Each row of each file becomes one record, tagged with the parameters decoded from its path
+
+##################################################################################################
+# Loader Parameters
+
+# Worker processes for parsing, None uses one per core
+NUM_WORKERS = None
+# Files handed to a worker at a time
+CHUNK_SIZE = 16
+##################################################################################################
+def parseTrialFile(path):
+	"""Parses one comma-delimited trial file into a 2d float array
+
+	Arguments:
+		path: path of the trial file
+	Return Values:
+		arr: (rows, columns) array, (0, 0) for an empty file
+	"""
+
+	with open(path) as trialFile:
+		lines = [line for line in trialFile if line.strip() and not line.startswith("#")]
+	if not lines: return np.zeros((0, 0))
+	try:
+		return np.loadtxt(lines, delimiter=",", ndmin=2)
+	except ValueError:
+		raise ValueError("Ragged or unparseable rows in trial file: %s" % path)
+
+def loadTrials(paths=None, numWorkers=NUM_WORKERS, printSwitch=True, **parameters):
+	"""Loads many trial files in parallel into one structured array
+
+	Arguments:
+		paths: paths of the trial files; if None the catalog is queried with parameters
+		numWorkers: worker processes for parsing, None uses one per core, 1 parses in this process
+		printSwitch: prints the throughput if True
+		parameters: passed to catalog.queryTrials() when paths is None, e.g. transverseField=0.4
+	Return Values:
+		trials: structured array with one record per row of each file and the fields
+			pumpFreq (Hz), pumpAmp (Tesla), transverseField (Tesla), probeDeltaFreq (Hz), trialNum,
+			fileIndex (index into paths), row and values (the row's columns)
+		paths: paths of the loaded files
+	"""
+
+	if paths is None: paths = catalog.queryTrials(**parameters)
+	paths = list(paths)
+	startTime = time.time()
+
+	if numWorkers == 1 or len(paths) <= 1:
+		arrs = [parseTrialFile(path) for path in paths]
+	else:
+		with ProcessPoolExecutor(numWorkers) as executor:
+			arrs = list(executor.map(parseTrialFile, paths, chunksize=CHUNK_SIZE))
+
+	numCols = set(arr.shape[1] for arr in arrs if len(arr))
+	if len(numCols) > 1: raise ValueError("Trial files passed to bulkLoad.loadTrials() have different numbers of columns: %s" % sorted(numCols))
+	numCols = numCols.pop() if numCols else 0
+
+	dtype = [("pumpFreq", "f8"), ("pumpAmp", "f8"), ("transverseField", "f8"), ("probeDeltaFreq", "f8"), ("trialNum", "i4"), ("fileIndex", "i4"), ("row", "i4"), ("values", "f8", (numCols,))]
+	trials = np.zeros(sum(len(arr) for arr in arrs), dtype=dtype)
+	start = 0
+	for fileIndex, (path, arr) in enumerate(zip(paths, arrs)):
+		if not len(arr): continue
+		records = trials[start:start + len(arr)]
+		records["pumpFreq"], records["pumpAmp"], records["transverseField"], records["probeDeltaFreq"], records["trialNum"] = fileio.trialPathToParameters(path)
+		records["fileIndex"] = fileIndex
+		records["row"] = np.arange(len(arr))
+		records["values"] = arr
+		start += len(arr)
+
+	if printSwitch:
+		elapsed = max(time.time() - startTime, 1e-9)
+		numBytes = sum(os.path.getsize(path) for path in paths)
+		print("Loaded %d files (%.1f MB) in %.2f sec: %.1f files/sec, %.1f MB/sec" % (len(paths), numBytes / 1e6, elapsed, len(paths) / elapsed, numBytes / elapsed / 1e6))
+	return trials, paths
+##################################################################################################
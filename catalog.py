@@ -0,0 +1,159 @@
+# Chris Tang
+# catalog.py
+
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing
+
+import fileio
+
+# Persistent SQLite catalog of every .csv trial under the raw data folder, so that points in
+# parameter space can be selected without globbing and parsing the whole tree:
+#	paths = catalog.queryTrials(transverseField=0.4, pumpAmp=(None, 1e-4))
+# The catalog is brought up to date before each query by re-listing only the parameter
+# directories whose modification time changed since the last scan
+
+##################################################################################################
+# Catalog Parameters
+
+# Name of the catalog file inside the raw data folder
+CATALOG_FILENAME = "catalog.sqlite"
+# Parameter directories (ffff_AAAA_HHHH) and trial files (dddd_xxx.csv) that are catalogued
+PARAMETER_DIR_PATTERN = re.compile(r"^\d+_\d+_\d+$")
+TRIAL_FILE_PATTERN = re.compile(r"^\d+_\d+\.csv$")
+# Half the resolution of each parameter in the directory/file names, used when matching a single value
+PARAMETER_TOLERANCES = {"pumpFreq": 0.05, "pumpAmp": 0.5e-7, "transverseField": 0.5e-3, "probeDeltaFreq": 0.5e-4, "trialNum": 0}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+	path TEXT PRIMARY KEY,
+	dir TEXT NOT NULL,
+	pumpFreq REAL,
+	pumpAmp REAL,
+	transverseField REAL,
+	probeDeltaFreq REAL,
+	trialNum INTEGER,
+	size INTEGER,
+	mtime REAL
+);
+CREATE INDEX IF NOT EXISTS trialsByParameters ON trials (transverseField, pumpAmp, pumpFreq, probeDeltaFreq);
+CREATE INDEX IF NOT EXISTS trialsByDir ON trials (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+	dir TEXT PRIMARY KEY,
+	mtime INTEGER,
+	pending INTEGER
+);
+"""
+##################################################################################################
+def catalogPath(dataFolder=None):
+	"""Returns the path of the catalog of a raw data folder (defaults to fileio.RAW_DATA_FOLDER)"""
+
+	if dataFolder is None: dataFolder = fileio.RAW_DATA_FOLDER
+	return os.path.join(dataFolder, CATALOG_FILENAME)
+
+def connect(dataFolder=None):
+	"""Opens the catalog of a raw data folder, creating its tables if needed"""
+
+	connection = sqlite3.connect(catalogPath(dataFolder))
+	connection.executescript(SCHEMA)
+	return connection
+
+def updateCatalog(dataFolder=None, printSwitch=False):
+	"""Brings the catalog up to date with the raw data folder
+	Only directories whose mtime changed (files added, removed or renamed) are re-listed, plus
+	directories that held empty files on the last scan, since trialPath() reserves a file before
+	its data is written
+
+	Arguments:
+		dataFolder: raw data folder, defaults to fileio.RAW_DATA_FOLDER
+		printSwitch: prints the number of rescanned directories if True
+	Return Values:
+		numRescanned: number of directories that were re-listed
+	"""
+
+	if dataFolder is None: dataFolder = fileio.RAW_DATA_FOLDER
+	startTime = time.time()
+
+	with closing(connect(dataFolder)) as connection, connection:
+		known = {dir: (mtime, pending) for dir, mtime, pending in connection.execute("SELECT dir, mtime, pending FROM dirs")}
+
+		present = set()
+		numRescanned = 0
+		with os.scandir(dataFolder) as entries:
+			for entry in entries:
+				if not entry.is_dir() or not PARAMETER_DIR_PATTERN.match(entry.name): continue
+				present.add(entry.name)
+				mtime = entry.stat().st_mtime_ns
+				if entry.name in known and known[entry.name][0] == mtime and not known[entry.name][1]: continue
+				scanDir(connection, dataFolder, entry.name, mtime)
+				numRescanned += 1
+
+		for dir in set(known) - present:
+			connection.execute("DELETE FROM trials WHERE dir = ?", (dir,))
+			connection.execute("DELETE FROM dirs WHERE dir = ?", (dir,))
+
+	if printSwitch: print("Catalog: Rescanned %d of %d directories in %.3f sec" % (numRescanned, len(present), time.time() - startTime))
+	return numRescanned
+
+def scanDir(connection, dataFolder, dir, mtime):
+	"""Replaces the catalogued trials of one parameter directory with its current contents"""
+
+	pumpFreq, pumpAmp, transverseField = fileio.dirToParameters(dir)
+	rows = []
+	with os.scandir(os.path.join(dataFolder, dir)) as entries:
+		for entry in entries:
+			if not entry.is_file() or not TRIAL_FILE_PATTERN.match(entry.name): continue
+			stat = entry.stat()
+			probeDeltaFreq = fileio.strToDeltaFreq(entry.name.split("_")[0])
+			rows.append((dir + "/" + entry.name, dir, pumpFreq, pumpAmp, transverseField, probeDeltaFreq, fileio.strToTrialNum(entry.name), stat.st_size, stat.st_mtime))
+
+	pending = any(row[7] == 0 for row in rows)
+	connection.execute("DELETE FROM trials WHERE dir = ?", (dir,))
+	connection.executemany("INSERT INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+	connection.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (dir, mtime, pending))
+##################################################################################################
+def queryTrials(dataFolder=None, update=True, **parameters):
+	"""Returns the paths of the catalogued trials matching all of the given parameters
+		queryTrials(transverseField=0.4, pumpAmp=(None, 1e-4))		# 0.4 T, pump below 1 Oe
+
+	Arguments:
+		dataFolder: raw data folder, defaults to fileio.RAW_DATA_FOLDER
+		update: updates the catalog first if True
+		parameters: any of pumpFreq (Hz), pumpAmp (Tesla), transverseField (Tesla), probeDeltaFreq (Hz)
+			and trialNum, each a single value or an inclusive (min, max) range with None for an open end
+	Return Values:
+		paths: full paths of the matching trials, sorted by parameters then trial number
+	"""
+
+	if dataFolder is None: dataFolder = fileio.RAW_DATA_FOLDER
+	if update: updateCatalog(dataFolder)
+
+	conditions, values = [], []
+	for name, value in parameters.items():
+		if name not in PARAMETER_TOLERANCES: raise ValueError("Unknown parameter passed to catalog.queryTrials(): %s" % name)
+		# Catalogued values are parsed from the names, so even the ends of a range match to within the tolerance
+		low, high = value if isinstance(value, (tuple, list)) else (value, value)
+		if low is not None:
+			conditions.append("%s >= ?" % name)
+			values.append(low - PARAMETER_TOLERANCES[name])
+		if high is not None:
+			conditions.append("%s <= ?" % name)
+			values.append(high + PARAMETER_TOLERANCES[name])
+
+	query = "SELECT path FROM trials"
+	if conditions: query += " WHERE " + " AND ".join(conditions)
+	query += " ORDER BY pumpFreq, pumpAmp, transverseField, probeDeltaFreq, trialNum"
+	with closing(connect(dataFolder)) as connection:
+		return [os.path.join(dataFolder, path) for path, in connection.execute(query, values)]
+
+def parameterPoints(dataFolder=None, update=True):
+	"""Returns the distinct (pumpFreq, pumpAmp, transverseField, probeDeltaFreq) points and their numbers of trials"""
+
+	if dataFolder is None: dataFolder = fileio.RAW_DATA_FOLDER
+	if update: updateCatalog(dataFolder)
+
+	with closing(connect(dataFolder)) as connection:
+		return connection.execute("SELECT pumpFreq, pumpAmp, transverseField, probeDeltaFreq, COUNT(*) FROM trials GROUP BY pumpFreq, pumpAmp, transverseField, probeDeltaFreq ORDER BY pumpFreq, pumpAmp, transverseField, probeDeltaFreq").fetchall()
+##################################################################################################
@@ -0,0 +1,164 @@
+# Chris Tang
+# demodulation.py
+
+import numpy as np
+from scipy import signal
+
+import fileio
+import traceStore
+
+# Software lock-in for the pump-probe beat. The lock-ins are referenced to the pump, so a probe
+# at pump + probeDeltaFreq appears in their outputs as z = X + iY rotating at probeDeltaFreq:
+#	z(t) = A exp(2 pi i probeDeltaFreq t) + (pump response, constant) + noise
+# Demodulating with exp(-2 pi i probeDeltaFreq t) and averaging over whole beat periods gives the
+# complex probe amplitude A while rejecting the constant pump response. The reference phase is
+# taken from the absolute time, so traces started by a common trigger (see lockinData) and chunks
+# of one stream share it.
+#	amp, numPeriods = demodulation.demodulateTraces([(t, x, y), ...], [3e-3, ...])
+#	for tPeriod, ampPeriod in demodulation.demodulateStream(lockinData.streamData(lockin, 600), 3e-3): ...
+
+##################################################################################################
+# Demodulation Parameters
+
+# Points per chunk when streaming a trace out of a trace store
+STREAM_CHUNK_SIZE = 2 ** 18
+# Default segment length for Welch spectra in (points)
+WELCH_SEGMENT_LENGTH = 1024
+##################################################################################################
+def stackTraces(traces):
+	"""Stacks traces of different lengths into NaN-padded 2d arrays, one row per trace
+
+	Arguments:
+		traces: list of (t, x, y) tuples of 1d arrays
+	Return Values:
+		t, x, y: (numTraces, longest trace) arrays
+	"""
+
+	numPts = max([len(trace[0]) for trace in traces], default=0)
+	t, x, y = [np.full((len(traces), numPts), np.nan) for i in range(3)]
+	for i, trace in enumerate(traces):
+		for stacked, column in zip((t, x, y), trace):
+			stacked[i, :len(column)] = column
+	return t, x, y
+
+def demodulate(t, x, y, deltaFreq):
+	"""Demodulates many traces at once, each at its own beat frequency
+
+	Arguments:
+		t: time array(s) in (sec), (numPts,) shared by all traces or (numTraces, numPts)
+		x, y: lock-in outputs in (Volt), (numTraces, numPts) or (numPts,) for a single trace; NaN marks padding
+		deltaFreq: beat frequency in (Hz), scalar or one per trace; 0 averages the whole trace
+	Return Values:
+		amp: complex beat amplitude per trace in (Volt), averaged over whole beat periods; NaN for a trace
+			shorter than one beat period, where the beat cannot be separated from the pump response
+		numPeriods: number of whole beat periods averaged per trace (0 for those NaN amplitudes, and when deltaFreq is 0)
+	"""
+
+	z = np.atleast_2d(np.asarray(x, dtype=float) + 1j * np.asarray(y, dtype=float))
+	t = np.broadcast_to(np.atleast_2d(np.asarray(t, dtype=float)), z.shape)
+	deltaFreq = np.broadcast_to(np.asarray(deltaFreq, dtype=float), (len(z),))[:, None]
+	valid = ~(np.isnan(z) | np.isnan(t))
+
+	# Keep only whole beat periods from the first point of each trace
+	numValid = valid.sum(axis=1, keepdims=True)
+	tFirst = np.nanmin(np.where(valid, t, np.nan), axis=1, keepdims=True)
+	tLast = np.nanmax(np.where(valid, t, np.nan), axis=1, keepdims=True)
+	dt = (tLast - tFirst) / np.maximum(numValid - 1, 1)
+	numPeriods = np.floor((tLast - tFirst + dt) * deltaFreq + 1e-9)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		inPeriods = np.where(deltaFreq > 0, t - tFirst < numPeriods / deltaFreq - 0.5 * dt, True)
+	mask = valid & inPeriods
+
+	reference = np.exp(-2j * np.pi * deltaFreq * np.where(mask, t, 0))
+	with np.errstate(divide="ignore", invalid="ignore"):
+		amp = np.where(mask, z * reference, 0).sum(axis=1) / mask.sum(axis=1)
+	return amp, numPeriods[:, 0].astype(int)
+
+def demodulateTraces(traces, deltaFreqs):
+	"""Demodulates a list of (t, x, y) traces of any lengths in one vectorized call, see demodulate()"""
+
+	return demodulate(*stackTraces(traces), deltaFreqs)
+
+def demodulateStore(path, keys=None, columns=("x", "y")):
+	"""Demodulates trials of a trace store at the probe delta frequencies of their names
+
+	Arguments:
+		path: path of the store
+		keys: names of the trials, defaults to all
+		columns: names of the in-phase and out-of-phase columns
+	Return Values:
+		keys: names of the demodulated trials
+		amp: complex beat amplitude per trial in (Volt)
+		numPeriods: number of whole beat periods averaged per trial
+	"""
+
+	if keys is None: keys = traceStore.listTraces(path)
+	traces = traceStore.readTraces(path, keys, list(columns))
+	deltaFreqs = [fileio.strToDeltaFreq(key.split("_")[0]) for key in keys]
+	amp, numPeriods = demodulateTraces([(trace["t"], trace[columns[0]], trace[columns[1]]) for trace in traces], deltaFreqs)
+	return keys, amp, numPeriods
+##################################################################################################
+def demodulateStream(chunks, deltaFreq):
+	"""Demodulates a stream of chunks, yielding the amplitude of each beat period as it completes
+	Only one chunk is held at a time, so arbitrarily long traces can be processed; the
+	trailing partial period at the end of the stream is dropped
+
+	Arguments:
+		chunks: iterable of (t, x, y) chunks, e.g. lockinData.streamData() or storeChunks()
+		deltaFreq: beat frequency in (Hz), must be > 0
+	Yields:
+		tPeriod: centre time of the period in (sec)
+		amp: complex beat amplitude over the period in (Volt)
+	"""
+
+	if deltaFreq <= 0: raise ValueError("Beat frequency passed to demodulation.demodulateStream() must be positive")
+	t0 = None
+	period = None
+	total = 0j
+	count = 0
+	for t, x, y in chunks:
+		if not len(t): continue
+		if t0 is None: t0 = t[0]
+		periods = np.floor((np.asarray(t) - t0) * deltaFreq + 1e-9).astype(int)
+		products = (np.asarray(x) + 1j * np.asarray(y)) * np.exp(-2j * np.pi * deltaFreq * np.asarray(t))
+
+		# Sums over each period touched by the chunk; all but the last are complete
+		boundaries = np.flatnonzero(np.diff(periods)) + 1
+		for start, stop in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(t)]))):
+			if period is not None and periods[start] != period:
+				yield t0 + (period + 0.5) / deltaFreq, total / count
+				total, count = 0j, 0
+			period = periods[start]
+			total += products[start:stop].sum()
+			count += stop - start
+
+def storeChunks(path, key, columns=("x", "y"), chunkSize=STREAM_CHUNK_SIZE):
+	"""Yields (t, x, y) chunks of one trial of a trace store, reading only one chunk at a time"""
+
+	start = 0
+	while True:
+		trace = traceStore.readTrace(path, key, columns=list(columns), start=start, stop=start + chunkSize)
+		if not len(trace["t"]): return
+		yield trace["t"], trace[columns[0]], trace[columns[1]]
+		start += chunkSize
+##################################################################################################
+def spectra(t, x, y, segmentLength=WELCH_SEGMENT_LENGTH):
+	"""Welch power spectra of many equal-length, equally sampled traces in one call
+	The spectra are two-sided, since z = X + iY distinguishes beats above and below the pump
+
+	Arguments:
+		t: time array in (sec), (numPts,) or (numTraces, numPts); only its spacing is used
+		x, y: lock-in outputs in (Volt), (numTraces, numPts) or (numPts,) for a single trace
+		segmentLength: length of the Welch segments in (points)
+	Return Values:
+		freq: frequency array in (Hz), relative to the pump
+		psd: (numTraces, len(freq)) power spectral densities in (Volt^2/Hz)
+	"""
+
+	z = np.atleast_2d(np.asarray(x, dtype=float) + 1j * np.asarray(y, dtype=float))
+	if np.isnan(z).any(): raise ValueError("Traces passed to demodulation.spectra() must have equal lengths without padding")
+	t = np.atleast_2d(np.asarray(t, dtype=float))
+	sampleRate = (t.shape[1] - 1) / (t[0, -1] - t[0, 0])
+	freq, psd = signal.welch(z, fs=sampleRate, nperseg=min(segmentLength, z.shape[1]), return_onesided=False, axis=-1)
+	return np.fft.fftshift(freq), np.fft.fftshift(psd, axes=-1)
+##################################################################################################
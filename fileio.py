@@ -3,6 +3,7 @@
 
 import glob
 import os
+import fcntl
 
 # ffff_AAAA_HHHH/dddd_xxx.csv:
 # pumpFreq = fff.f (Hz)
@@ -19,10 +20,17 @@ PROGRAM_HOME_FOLDER = "/Users/ct/Documents/PyBin/Susceptibility_Automation/"
 # Sub-folder where raw data is to be stored
 RAW_DATA_FOLDER = PROGRAM_HOME_FOLDER + "Raw_Data/"
 # Sub-folder where processed data is to be stored
-PROCESSED_DATA_FOLDER = PROGRAM_HOME_FOLDER = "Processed_Data/"
+PROCESSED_DATA_FOLDER = PROGRAM_HOME_FOLDER + "Processed_Data/"
+# Sub-folder where cached processing results are stored (see resultCache.py)
+RESULT_CACHE_FOLDER = PROGRAM_HOME_FOLDER + "Result_Cache/"
+# Name of the binary trace store (see traceStore.py) inside each parameter directory
+TRACE_STORE_FILENAME = "traces.h5"
+# Extension of the hidden per-probe-frequency trial counters (.dddd.next) inside each parameter directory
+TRIAL_COUNTER_EXT = ".next"
 ##################################################################################################
 def trialPath(pumpFreq, pumpAmp, transverseField, probeDeltaFreq):
 	"""Returns the appropriate filename to create for a given set of parameters
+	Note, the (empty) file is created to reserve the name, and there is no limit on the trial number
 
 	Arguments:
 		pumpFreq: Pump frequency in (Hz)
@@ -33,12 +41,98 @@ def trialPath(pumpFreq, pumpAmp, transverseField, probeDeltaFreq):
 		path: appropriate path
 	"""
 
+	parameterDir = RAW_DATA_FOLDER + parametersToDir(pumpFreq, pumpAmp, transverseField)
+	os.makedirs(parameterDir, exist_ok=True)
+	deltaFreqStr = deltaFreqToStr(probeDeltaFreq)
+
+	# Claim the name by exclusive creation, so that even writers not using the counter never get the same path
+	def claim(trialNum):
+		try:
+			os.close(os.open(trialNumToPath(parameterDir, deltaFreqStr, trialNum), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+			return True
+		except FileExistsError:
+			return False
+	return trialNumToPath(parameterDir, deltaFreqStr, claimTrialNum(parameterDir, deltaFreqStr, claim))
+
+def trialNumToPath(parameterDir, deltaFreqStr, trialNum):
+	"""Returns the path of the .csv file of a trial number in a parameter directory"""
+	return parameterDir + deltaFreqStr + "_" + str(trialNum).zfill(3) + ".csv"
+
+def claimTrialNum(parameterDir, deltaFreqStr, claim):
+	"""Claims the next trial number of a probe frequency in a parameter directory
+	The .csv trials (trialPath()) and the trace store (traceStore.appendTrace()) share one counter
+	per probe frequency, so their trial numbers never collide; it is locked while a number is claimed
+
+	Arguments:
+		parameterDir: parameter directory holding the trials
+		deltaFreqStr: probe delta frequency string of the trials
+		claim: function of a trial number that claims it, returning False if the number is already taken
+	Return Values:
+		trialNum: claimed trial number
+	"""
+
+	counterPath = parameterDir + "." + deltaFreqStr + TRIAL_COUNTER_EXT
+	with open(counterPath, "a+") as counterFile:
+		fcntl.flock(counterFile, fcntl.LOCK_EX)
+		counterFile.seek(0)
+		trialNum = readTrialCounter(counterFile.read(), parameterDir, deltaFreqStr)
+		while not claim(trialNum):
+			trialNum += 1
+		counterFile.seek(0)
+		counterFile.truncate()
+		counterFile.write(str(trialNum + 1))
+	return trialNum
+
+def readTrialCounter(counterStr, parameterDir, deltaFreqStr):
+	"""Returns the next trial number from the contents of a counter file
+	Directories written before counters existed (or whose counter was lost) are scanned once instead,
+	both the .csv names and the trials of the trace store
+
+	Arguments:
+		counterStr: contents of the counter file
+		parameterDir: parameter directory holding the trials
+		deltaFreqStr: probe delta frequency string of the trials
+	Return Values:
+		trialNum: next trial number to try
+	"""
+
+	try:
+		return int(counterStr)
+	except ValueError:
+		trialNums = [strToTrialNum(file) for file in os.listdir(parameterDir) if file.startswith(deltaFreqStr + "_") and file.endswith(".csv")]
+		if os.path.exists(parameterDir + TRACE_STORE_FILENAME):
+			import traceStore
+			trialNums += [strToTrialNum(key) for key in traceStore.listTraces(parameterDir + TRACE_STORE_FILENAME) if key.startswith(deltaFreqStr + "_")]
+		return max(trialNums) + 1 if trialNums else 0
+
+def traceStorePath(pumpFreq, pumpAmp, transverseField):
+	"""Returns the path of the binary trace store for a given point in parameter space
+
+	Arguments:
+		pumpFreq: Pump frequency in (Hz)
+		pumpAmp: Pump amplitude in (Tesla)
+		transverseField: Transverse field in (Tesla)
+	Return Values:
+		path: path of the store
+	"""
+
 	parameterDir = RAW_DATA_FOLDER + parametersToDir(pumpFreq, pumpAmp, transverseField)
 	if not os.path.isdir(parameterDir): os.mkdir(parameterDir)
+	return parameterDir + TRACE_STORE_FILENAME
 
-	for i in range(1000):
-		path = parameterDir + deltaFreqToStr(probeDeltaFreq) + "_" + str(i).zfill(3) + ".csv"
-		if not os.path.exists(path): return path
+def processedPath(pumpFreq, pumpAmp, transverseField):
+	"""Returns the path of the processed results (ffff_AAAA_HHHH.npz) for a given point in parameter space
+
+	Arguments:
+		pumpFreq: Pump frequency in (Hz)
+		pumpAmp: Pump amplitude in (Tesla)
+		transverseField: Transverse field in (Tesla)
+	Return Values:
+		path: path of the results
+	"""
+
+	os.makedirs(PROCESSED_DATA_FOLDER, exist_ok=True)
+	return PROCESSED_DATA_FOLDER + parametersToDir(pumpFreq, pumpAmp, transverseField)[:-1] + ".npz"
 ##################################################################################################
 # Convert values to appropriate strings for directory/file names
 
@@ -80,17 +174,15 @@ def dirToParameters(parameterDir):
 	"""Back-converts a directory to the appropriate parameters
 
 	Arguments:
-		parameterDir: directory string
+		parameterDir: directory string, or path ending in one
 	Return Values:
 		pumpFreq: Pump frequency in (Hz)
 		pumpAmp: Pump amplitude in (Tesla)
 		transverseField: Transverse field strength in (Tesla)
 	"""
 
-	pumpFreq = strToPumpFreq(parameterDir[0:4])
-	pumpAmp = strToPumpAmp(parameterDir[5:9])
-	transverseField = strToTransverseField(parameterDir[10:14])
-	return pumpFreq, pumpAmp, transverseField
+	pumpFreqStr, pumpAmpStr, transverseFieldStr = os.path.basename(os.path.normpath(parameterDir)).split("_")
+	return strToPumpFreq(pumpFreqStr), strToPumpAmp(pumpAmpStr), strToTransverseField(transverseFieldStr)
 
 def deltaFreqToStr(deltaFreq):
 	"""Converts a frequency in (Hz) to the format fff.f (mHz)"""
@@ -98,6 +190,27 @@ def deltaFreqToStr(deltaFreq):
 def strToDeltaFreq(deltaFreqStr):
 	"""Back-converts from string to probe delta frequency (Hz)"""
 	return float(deltaFreqStr) * 1e-4
+
+def strToTrialNum(fileName):
+	"""Back-converts a trial file name (dddd_xxx.csv) to its trial number"""
+	return int(os.path.splitext(os.path.basename(fileName))[0].split("_")[1])
+
+def trialPathToParameters(path):
+	"""Back-converts the path of a trial file (.../ffff_AAAA_HHHH/dddd_xxx.csv) to its parameters
+
+	Arguments:
+		path: path of the trial file
+	Return Values:
+		pumpFreq: Pump frequency in (Hz)
+		pumpAmp: Pump amplitude in (Tesla)
+		transverseField: Transverse field strength in (Tesla)
+		probeDeltaFreq: Difference between pump and probe frequencies in (Hz)
+		trialNum: trial number
+	"""
+
+	parameterDir, fileName = os.path.split(path)
+	pumpFreq, pumpAmp, transverseField = dirToParameters(parameterDir)
+	return pumpFreq, pumpAmp, transverseField, strToDeltaFreq(fileName.split("_")[0]), strToTrialNum(fileName)
 ##################################################################################################
 ##################################################################################################
 ##################################################################################################
@@ -0,0 +1,258 @@
+# Chris Tang
+# fitting.py
+
+import os
+import glob
+import numpy as np
+
+import fileio
+import catalog
+
+# Batched fits of relaxation models to susceptibility spectra chi(f) = chi' - i chi'', one spectrum
+# per (pumpFreq, pumpAmp, transverseField) point with f the probe delta frequency:
+#	debye:		chi = chiS + (chiT - chiS) / (1 + i 2 pi f tau)
+#	coleCole:	chi = chiS + (chiT - chiS) / (1 + (i 2 pi f tau)^(1 - alpha))
+# All spectra are fitted together by a vectorized Levenberg-Marquardt: every iteration solves the
+# (numParams x numParams) normal equations of all spectra in one batched np.linalg.solve, instead
+# of one curve_fit call per spectrum. Spectra may have different frequencies and lengths (NaN pads).
+#	coordinates, freq, chi = fitting.loadSpectra()
+#	table = fitting.fitSpectra("debye", freq, chi, coordinates)
+
+##################################################################################################
+# Fitting Parameters
+
+# Parameters of each model; tau is fitted as log10(tau / sec) for conditioning
+MODELS = {"debye": ("chiT", "chiS", "logTau"), "coleCole": ("chiT", "chiS", "logTau", "alpha")}
+# Initial guess of the Cole-Cole alpha
+INITIAL_ALPHA = 0.1
+# Levenberg-Marquardt damping: initial value, and value above which a fit is abandoned as stuck
+LM_INITIAL_LAMBDA = 1e-3
+LM_MAX_LAMBDA = 1e10
+# Maximum iterations, and relative cost decrease below which a fit has converged
+LM_MAX_ITERATIONS = 200
+LM_TOLERANCE = 1e-10
+# Decades beyond the measured frequency band within which 1 / (2 pi tau) of a converged fit must lie
+LOG_TAU_MARGIN = 2
+# Relative step of the finite-difference Jacobian
+FD_STEP = 1e-7
+##################################################################################################
+def modelChi(model, params, freq):
+	"""Evaluates a model for many spectra at once
+
+	Arguments:
+		model: name of the model in MODELS
+		params: (numSpectra, numParams) array of parameters
+		freq: (numSpectra, numPts) array of frequencies in (Hz)
+	Return Values:
+		chi: (numSpectra, numPts) complex array of the susceptibility
+	"""
+
+	chiT, chiS, logTau = params[:, 0:1], params[:, 1:2], params[:, 2:3]
+	iwt = 2j * np.pi * freq * 10 ** logTau
+	if model == "debye": return chiS + (chiT - chiS) / (1 + iwt)
+	if model == "coleCole": return chiS + (chiT - chiS) / (1 + iwt ** (1 - params[:, 3:4]))
+	raise ValueError("Unknown model passed to fitting.modelChi(): %s" % model)
+
+def residuals(model, params, freq, chi, weight):
+	"""Returns the weighted residuals of the real and imaginary parts, zero at masked (NaN) points"""
+
+	with np.errstate(invalid="ignore", over="ignore"):
+		diff = (modelChi(model, params, freq) - chi) * weight
+	diff = np.where(np.isnan(chi) | np.isnan(freq), 0, diff)
+	return np.concatenate((diff.real, diff.imag), axis=1)
+
+def jacobian(model, params, freq, chi, weight, r):
+	"""Forward-difference Jacobian of the residuals, (numSpectra, 2 numPts, numParams)"""
+
+	J = np.zeros(r.shape + (params.shape[1],))
+	for i in range(params.shape[1]):
+		shifted = params.copy()
+		h = FD_STEP * (np.abs(params[:, i]) + FD_STEP ** 0.5)
+		shifted[:, i] += h
+		J[:, :, i] = (residuals(model, shifted, freq, chi, weight) - r) / h[:, None]
+	return J
+##################################################################################################
+def levenbergMarquardt(model, params, freq, chi, weight, maxIterations=LM_MAX_ITERATIONS):
+	"""Fits all spectra together; each keeps its own damping and stops independently
+
+	Arguments:
+		model: name of the model in MODELS
+		params: (numSpectra, numParams) initial parameters
+		freq, chi, weight: (numSpectra, numPts) frequencies in (Hz), complex data and weights (1 / sigma)
+		maxIterations: iterations after which unfinished fits are reported as not converged
+	Return Values:
+		params: (numSpectra, numParams) fitted parameters
+		cost: sum of squared weighted residuals per spectrum
+		converged: True per spectrum that reached a minimum; False for fits that ran out of iterations
+			or reached LM_MAX_LAMBDA without a step decreasing the cost
+	"""
+
+	params = np.array(params, dtype=float)
+	numParams = params.shape[1]
+	r = residuals(model, params, freq, chi, weight)
+	cost = (r ** 2).sum(axis=1)
+	dataCost = (residuals(model, np.zeros_like(params), freq, chi, weight) ** 2).sum(axis=1)
+	damping = np.full(len(params), LM_INITIAL_LAMBDA)
+	converged = cost < LM_TOLERANCE ** 2 * dataCost
+	active = np.isfinite(cost) & ~converged
+
+	for iteration in range(maxIterations):
+		index = np.flatnonzero(active)
+		if not len(index): break
+
+		J = jacobian(model, params[index], freq[index], chi[index], weight[index], r[index])
+		JTJ = np.einsum("nki,nkj->nij", J, J)
+		gradient = np.einsum("nki,nk->ni", J, r[index])
+		scale = np.maximum(np.diagonal(JTJ, axis1=1, axis2=2), 1e-30)
+		A = JTJ + damping[index, None, None] * np.eye(numParams) * scale[:, :, None]
+		step = -np.linalg.solve(A, gradient[:, :, None])[:, :, 0]
+
+		trialParams = params[index] + step
+		trialR = residuals(model, trialParams, freq[index], chi[index], weight[index])
+		trialCost = (trialR ** 2).sum(axis=1)
+		better = np.isfinite(trialCost) & (trialCost < cost[index])
+
+		accepted = index[better]
+		decrease = (cost[accepted] - trialCost[better]) / np.maximum(cost[accepted], 1e-300)
+		params[accepted], r[accepted], cost[accepted] = trialParams[better], trialR[better], trialCost[better]
+		damping[accepted] /= 10
+		damping[index[~better]] *= 10
+
+		# Converged when an accepted step barely decreases the cost, or the fit matches the data to rounding;
+		# a fit that no damped step improves any more is stuck, and stops without converging
+		done = accepted[(decrease < LM_TOLERANCE) | (cost[accepted] < LM_TOLERANCE ** 2 * dataCost[accepted])]
+		stuck = index[~better][damping[index[~better]] > LM_MAX_LAMBDA]
+		converged[done] = True
+		active[done] = False
+		active[stuck] = False
+	return params, cost, converged
+
+def uncertainties(model, params, freq, chi, weight, cost):
+	"""Standard errors of the parameters from the covariance matrix inv(J^T J) scaled by the reduced chi-square"""
+
+	r = residuals(model, params, freq, chi, weight)
+	J = jacobian(model, params, freq, chi, weight, r)
+	JTJ = np.einsum("nki,nkj->nij", J, J)
+	dof = 2 * np.sum(~(np.isnan(chi) | np.isnan(freq)), axis=1) - params.shape[1]
+	covariance = np.linalg.pinv(JTJ) * (cost / np.maximum(dof, 1))[:, None, None]
+	errors = np.sqrt(np.abs(np.diagonal(covariance, axis1=1, axis2=2)))
+	errors[dof <= 0] = np.nan
+	return errors
+
+def tauInBand(params, freq):
+	"""Returns True per spectrum whose fitted 1 / (2 pi tau) lies within LOG_TAU_MARGIN decades of its
+	measured frequencies; outside, the data no longer constrain tau and the fit has run off
+	"""
+
+	with np.errstate(divide="ignore", invalid="ignore"):
+		logFreq = np.log10(np.where(np.isnan(freq), np.nan, np.abs(freq)))
+	peak = -np.log10(2 * np.pi) - params[:, 2]
+	return (peak >= np.nanmin(logFreq, axis=1) - LOG_TAU_MARGIN) & (peak <= np.nanmax(logFreq, axis=1) + LOG_TAU_MARGIN)
+
+def initialGuess(model, freq, chi):
+	"""Guesses parameters from each spectrum: chiT and chiS from chi' at the lowest and highest
+	frequencies, tau from the frequency at the peak of chi''
+	"""
+
+	rows = np.arange(len(chi))
+	valid = ~(np.isnan(chi) | np.isnan(freq))
+	lowest = np.argmin(np.where(valid, freq, np.inf), axis=1)
+	highest = np.argmax(np.where(valid, freq, -np.inf), axis=1)
+	peak = np.argmax(np.where(valid, -chi.imag, -np.inf), axis=1)
+
+	params = np.zeros((len(chi), len(MODELS[model])))
+	params[:, 0] = chi.real[rows, lowest]
+	params[:, 1] = chi.real[rows, highest]
+	params[:, 2] = -np.log10(2 * np.pi * np.maximum(np.abs(freq[rows, peak]), 1e-12))
+	if model == "coleCole": params[:, 3] = INITIAL_ALPHA
+	return params
+##################################################################################################
+def fitSpectra(model, freq, chi, coordinates=None, sigma=None, initialParams=None, maxIterations=LM_MAX_ITERATIONS, printSwitch=True):
+	"""Fits a model to many spectra together, then refits the ones that did not converge starting
+	from the result of their nearest converged neighbour in parameter space
+
+	Arguments:
+		model: name of the model in MODELS
+		freq: (numSpectra, numPts) frequencies in (Hz), NaN for padding
+		chi: (numSpectra, numPts) complex susceptibility, NaN for padding or missing points
+		coordinates: (numSpectra, numCoordinates) positions in parameter space, e.g. from loadSpectra(), used
+			for warm starts and copied into the table as pumpFreq, pumpAmp, transverseField
+		sigma: (numSpectra, numPts) uncertainties of chi (same for real and imaginary parts), None for equal weights
+		initialParams: (numSpectra, numParams) starting parameters, None to guess them
+		maxIterations: maximum iterations of each pass
+		printSwitch: prints the number of converged fits if True
+	Return Values:
+		table: structured array, one record per spectrum, with the coordinates, each parameter and its
+			uncertainty (name + "Err"), cost, numPts and converged (False also where tau ran off, see tauInBand())
+	"""
+
+	freq, chi = np.atleast_2d(np.asarray(freq, dtype=float)), np.atleast_2d(np.asarray(chi, dtype=complex))
+	freq = np.broadcast_to(freq, chi.shape)
+	weight = np.ones(chi.shape) if sigma is None else 1 / np.broadcast_to(np.asarray(sigma, dtype=float), chi.shape)
+	params = initialGuess(model, freq, chi) if initialParams is None else np.array(initialParams, dtype=float)
+	params, cost, converged = levenbergMarquardt(model, params, freq, chi, weight, maxIterations)
+	converged &= tauInBand(params, freq)
+
+	# Warm starts from the nearest converged neighbours
+	if coordinates is not None: coordinates = np.atleast_2d(np.asarray(coordinates, dtype=float))
+	if coordinates is not None and converged.any() and not converged.all():
+		scale = np.where(np.ptp(coordinates, axis=0) > 0, np.ptp(coordinates, axis=0), 1)
+		failed, done = np.flatnonzero(~converged), np.flatnonzero(converged)
+		distance = np.sum(((coordinates[failed, None, :] - coordinates[None, done, :]) / scale) ** 2, axis=2)
+		neighbours = done[np.argmin(distance, axis=1)]
+		retryParams, retryCost, retryConverged = levenbergMarquardt(model, params[neighbours], freq[failed], chi[failed], weight[failed], maxIterations)
+		retryConverged &= tauInBand(retryParams, freq[failed])
+		improved = retryConverged | (retryCost < cost[failed])
+		params[failed[improved]], cost[failed[improved]], converged[failed[improved]] = retryParams[improved], retryCost[improved], retryConverged[improved]
+
+	errors = uncertainties(model, params, freq, chi, weight, cost)
+	names = MODELS[model]
+	coordinateNames = ["pumpFreq", "pumpAmp", "transverseField"] if coordinates is not None else []
+	dtype = [(name, "f8") for name in coordinateNames] + [(name, "f8") for name in names] + [(name + "Err", "f8") for name in names] + [("cost", "f8"), ("numPts", "i4"), ("converged", "?")]
+	table = np.zeros(len(chi), dtype=dtype)
+	for i, name in enumerate(coordinateNames):
+		table[name] = coordinates[:, i]
+	for i, name in enumerate(names):
+		table[name], table[name + "Err"] = params[:, i], errors[:, i]
+	table["cost"], table["numPts"], table["converged"] = cost, np.sum(~np.isnan(chi), axis=1), converged
+
+	if printSwitch: print("Fitting: %d of %d spectra converged (%s)" % (converged.sum(), len(chi), model))
+	return table
+##################################################################################################
+def loadSpectra(paths=None):
+	"""Builds spectra from processed results (see processing.py), averaging the trials at each probe delta frequency
+
+	Arguments:
+		paths: processed result files, defaults to every ffff_AAAA_HHHH.npz in fileio.PROCESSED_DATA_FOLDER
+	Return Values:
+		coordinates: (numSpectra, 3) array of pumpFreq (Hz), pumpAmp (Tesla), transverseField (Tesla)
+		freq: (numSpectra, numPts) probe delta frequencies in (Hz), NaN padded
+		chi: (numSpectra, numPts) complex susceptibility, NaN padded
+	"""
+
+	if paths is None:
+		paths = sorted(path for path in glob.glob(fileio.PROCESSED_DATA_FOLDER + "*.npz") if catalog.PARAMETER_DIR_PATTERN.match(os.path.basename(path)[:-len(".npz")]))
+
+	coordinates, spectra = [], []
+	for path in paths:
+		with np.load(path) as results:
+			deltaFreqs, inverse = np.unique(results["probeDeltaFreq"], return_inverse=True)
+			chi = np.full(len(deltaFreqs), np.nan + 0j)
+			for i in range(len(deltaFreqs)):
+				trials = results["chi"][inverse == i]
+				trials = trials[~np.isnan(trials)]
+				if len(trials): chi[i] = trials.mean()
+			coordinates.append([float(results["pumpFreq"]), float(results["pumpAmp"]), float(results["transverseField"])])
+			spectra.append((deltaFreqs, chi))
+
+	numPts = max([len(spectrum[0]) for spectrum in spectra], default=0)
+	freq, chi = np.full((len(spectra), numPts), np.nan), np.full((len(spectra), numPts), np.nan + 0j)
+	for i, (deltaFreqs, spectrumChi) in enumerate(spectra):
+		freq[i, :len(deltaFreqs)], chi[i, :len(deltaFreqs)] = deltaFreqs, spectrumChi
+	return np.array(coordinates).reshape(-1, 3), freq, chi
+
+def saveTable(table, path):
+	"""Writes a fit table as a .csv with a header line"""
+
+	np.savetxt(path, np.column_stack([table[name].astype(float) for name in table.dtype.names]), delimiter=",", header=",".join(table.dtype.names))
+##################################################################################################
@@ -0,0 +1,125 @@
+# Chris Tang
+# instrument.py
+
+from contextlib import contextmanager
+
+##################################################################################################
+class Instrument():
+	"""Common base of the instrument drivers: owns the VISA resource and an optional cache of
+	the last command written for each setting, so that repeated settings are not re-sent
+	"""
+
+	# String joining the commands of a batch into one message
+	BATCH_SEPARATOR = ";"
+	# Query sent after a batch to confirm it has been executed
+	BATCH_CONFIRM_QUERY = "*OPC?"
+	# Longest message the instrument accepts in (characters), None if unlimited
+	BATCH_MAX_LENGTH = None
+
+	def __init__(self, port, resourceManager=None, useCache=False):
+		self.port = port
+		self.resourceManager = resourceManager
+		self.useCache = useCache
+		self.settingCache = {}
+		self.batchQueue = None
+		self.connect()
+	######################################################################################
+	def connect(self):
+		"""Opens (or reopens) the VISA resource, which invalidates the state cache
+		VISA is only imported when no resource manager was given, so that the drivers (and the
+		simulated instruments of simVisa) can be used without it
+		"""
+
+		if self.resourceManager is None:
+			import visa
+			self.resourceManager = visa.ResourceManager()
+		self.inst = self.resourceManager.open_resource(self.port)
+		self.invalidateCache()
+
+	def write(self, cmd):
+		"""Writes a command, or queues it if a batch is open"""
+
+		if self.batchQueue is None:
+			self.inst.write(cmd)
+		else:
+			self.batchQueue.append(cmd)
+
+	def query(self, cmd):
+		"""Sends any queued commands, then queries the instrument"""
+
+		self.flushBatch(confirm=False)
+		return self.inst.query(cmd)
+
+	@contextmanager
+	def batch(self, confirm=True):
+		"""Context in which writes are queued and sent together as one message on exit:
+			with lockin.batch():
+				lockin.setSensitivity(...)
+				lockin.setTimeConstant(...)
+
+		Arguments:
+			confirm: sends BATCH_CONFIRM_QUERY after the batch and waits for the reply if True
+		"""
+
+		if self.batchQueue is not None:
+			yield		# Nested batches join the outer one
+			return
+		self.batchQueue = []
+		try:
+			yield
+		finally:
+			self.flushBatch(confirm)
+			self.batchQueue = None
+
+	def flushBatch(self, confirm=True):
+		"""Sends the queued commands as few messages as BATCH_MAX_LENGTH allows
+
+		Arguments:
+			confirm: sends BATCH_CONFIRM_QUERY afterwards and waits for the reply if True
+		"""
+
+		if not self.batchQueue: return
+		message = self.batchQueue[0]
+		for cmd in self.batchQueue[1:]:
+			if self.BATCH_MAX_LENGTH is not None and len(message) + len(self.BATCH_SEPARATOR) + len(cmd) > self.BATCH_MAX_LENGTH:
+				self.inst.write(message)
+				message = cmd
+			else:
+				message += self.BATCH_SEPARATOR + cmd
+		self.inst.write(message)
+		self.batchQueue[:] = []
+		if confirm: self.inst.query(self.BATCH_CONFIRM_QUERY)
+
+	def writeSetting(self, key, cmd):
+		"""Writes a command that sets key, skipping it if the cache shows it was the last one written
+
+		Arguments:
+			key: name of the setting the command changes
+			cmd: command string to write
+		Return Values:
+			written: True if the command was sent, False if it was skipped
+		"""
+
+		if self.useCache and self.settingCache.get(key) == cmd: return False
+		self.write(cmd)
+		self.settingCache[key] = cmd
+		return True
+
+	def invalidateCache(self, key=None):
+		"""Forgets the cached state of one setting (key), or of all settings (None)
+		Call after settings were changed behind the driver's back, e.g. from the front panel
+		"""
+
+		if key is None:
+			self.settingCache = {}
+		else:
+			self.settingCache.pop(key, None)
+
+	def resyncCache(self, printSwitch=True):
+		"""Rebuilds the cache from the instrument
+		Drivers that can read their settings back override this; by default the cache is cleared
+		"""
+
+		self.invalidateCache()
+		if printSwitch: print("%s: Setting cache cleared" % self.__class__.__name__)
+##################################################################################################
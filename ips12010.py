@@ -1,20 +1,48 @@
 # Chris Tang
 # ips12010.py
 
-import visa
+import instrument
 import time
 
 ##################################################################################################
-class IPS12010():
-	def __init__(self, port):
-		self.port = port
-		self.inst = visa.ResourceManager().open_resource(port)
+# Ramp Parameters
+
+# Output current in (Amp), about 6 Tesla, at and above which the magnet is ramped at the reduced rate
+RAMP_RATE_BOUNDARY_CURRENT = 57
+# Time in (sec) to wait after starting a ramp so that the status can update to sweeping before querying
+RAMP_START_DELAY = 5
+# Fraction of the predicted remaining ramp time to sleep before polling the status again
+RAMP_WAIT_FRACTION = 0.9
+# Longest time in (sec) between status polls as they back off near the end of a ramp
+RAMP_MAX_POLL_TIME = 30
+# Smallest tolerance in (Amp) for currents to match, so that currents near zero can match
+MATCH_CURRENT_FLOOR = 0.01
+# Deadline of a ramp as a multiple of its predicted time, plus a margin in (sec)
+RAMP_TIMEOUT_FACTOR = 2
+RAMP_TIMEOUT_MARGIN = 60
+##################################################################################################
+class IPS12010(instrument.Instrument):
+	BATCH_SEPARATOR = "\r"			# $-prefixed commands are executed without a reply
+	BATCH_CONFIRM_QUERY = "X"
+
+	def __init__(self, port, resourceManager=None, useCache=False):
+		instrument.Instrument.__init__(self, port, resourceManager, useCache)
+		self.rampRate = None		# Last ramp rate set in (Amp / min)
 
 		self.setInputMode("remoteAndUnlocked")
 
 		# Optional printing
 		print("\nConnecting IPS 120-10 through address:\n%s" % port)
-		print("Querying IDN:\n%s" % self.inst.query("*IDN?"))
+		print("Querying IDN:\n%s" % self.query("*IDN?"))
+	######################################################################################
+	def resyncCache(self, printSwitch=True):
+		"""Rebuilds the setting cache by reading the current set point and sweep rate back from the power supply"""
+
+		self.invalidateCache()
+		self.settingCache["I"] = "$I%.4f" % float(self.query("R 5"))
+		self.rampRate = float(self.query("R 6"))
+		self.settingCache["S"] = "$S%.3f" % self.rampRate
+		if printSwitch: print("IPS 120-10: Setting cache resynced from instrument")
 	######################################################################################
 	def setHeater(self, mode, heatTime, coolTime, printSwitch=True):
 		"""Turns the switch heater on (True) or off (False) and waits for heater to heat/cool
@@ -26,12 +54,12 @@ class IPS12010():
 		"""
 
 		if mode:
-			self.inst.write("$H1") 		# Note: NEVER use command H2, which overrides the persistent/output current check
+			self.write("$H1") 		# Note: NEVER use command H2, which overrides the persistent/output current check
 			if printSwitch: print("IPS 120-10: Switch heater turned ON\nNow waiting %d sec for S.C. switch to heat up ..." % heatTime)
 			time.sleep(heatTime)
 			if printSwitch: print("Wait time completed.")
 		elif not mode:
-			self.inst.write("$H0")
+			self.write("$H0")
 			if printSwitch: print("IPS 120-10: Switch heater turned OFF\nNow waiting %d sec for S.C. switch to cool ..." % coolTime)
 			time.sleep(coolTime)
 			if printSwitch: print("Wait time completed.")
@@ -45,31 +73,50 @@ class IPS12010():
 			current: target current to which to ramp in (Amp)
 		"""
 
-		self.inst.write("$I%.4f" % current)
-		if printSwitch: print("IPS 120-10: Output current set point: %.4f Amp" % current)
+		self.startRamp(current, printSwitch=printSwitch)
+		self.waitUntilStable(refreshTime, target=current, printSwitch=printSwitch)
 
-		self.setRampRate(acceptableRampRate(current))
+		self.write("$A0")
+		if printSwitch: print("IPS 120-10: Output mode: HOLD")
+	
+	def startRamp(self, current, rate=None, printSwitch=True):
+		"""Starts ramping the output current to a target in (Amp) and returns without waiting
 
-		self.inst.write("$A1")
-		if printSwitch: print("IPS 120-10: Now ramping to set point...")
+		Arguments:
+			current: target current to which to ramp in (Amp)
+			rate: ramp rate in (Amp / min), defaults to the safe rate between the present output and the target
+		Return Values:
+			predictedTime: predicted duration of the ramp in (sec)
+		"""
 
-		self.waitUntilStable(refreshTime)
+		startCurrent = self.getOutputCurrent(printSwitch=False)
+		if rate is None: rate = safeRampRate(startCurrent, current)
+		with self.batch():
+			self.writeSetting("I", "$I%.4f" % current)
+			if printSwitch: print("IPS 120-10: Output current set point: %.4f Amp" % current)
+
+			self.setRampRate(rate, printSwitch=printSwitch)
+
+			self.write("$A1")
+			if printSwitch: print("IPS 120-10: Now ramping to set point...")
+		return rampTime(startCurrent, current, rate)
 
-		self.inst.write("$A0")
-		if printSwitch: print("IPS 120-10: Output mode: HOLD")
-	
 	def rampToZero(self, refreshTime, printSwitch=True):
 		"""RAmp the magnet supply to zero, waits for it to be at rest, and then holds"""
 
-		self.inst.write("$I0")
-		if printSwitch: print("IPS 120-10: Output current set point: 0 Amp")
+		startCurrent = self.getOutputCurrent(printSwitch=False)
+		with self.batch():
+			self.writeSetting("I", "$I%.4f" % 0)
+			if printSwitch: print("IPS 120-10: Output current set point: 0 Amp")
+
+			self.setRampRate(safeRampRate(startCurrent, 0.), printSwitch=printSwitch)
 
-		self.inst.write("$A2")
-		if printSwitch: print("IPS 120-10: Now ramping zero...")
+			self.write("$A2")
+			if printSwitch: print("IPS 120-10: Now ramping zero...")
 
-		self.waitUntilStable(refreshTime)
+		self.waitUntilStable(refreshTime, target=0., printSwitch=printSwitch)
 
-		self.inst.write("$A0")
+		self.write("$A0")
 		if printSwitch: print("IPS 120-10: Output mode: HOLD")
 	
 	def setRampRate(self, rate, printSwitch=True):
@@ -79,10 +126,11 @@ class IPS12010():
 			rate: desired ramp rate in (Amp / min)
 		"""
 
-		self.inst.write("$S%.3f" % rate)
+		self.writeSetting("S", "$S%.3f" % rate)
+		self.rampRate = rate
 		if printSwitch: print("IPS 120-10: Ramp Rate set to: %.2f Amp/min" % rate)
 	######################################################################################
-	def setInputMode(self, mode):
+	def setInputMode(self, mode, printSwitch=True):
 		"""Sets the input mode
 
 		Arguments:
@@ -91,12 +139,12 @@ class IPS12010():
 		"""
 
 		if mode == "remoteAndUnlocked":
-			self.inst.write("$C3")
+			self.writeSetting("C", "$C3")
 			if printSwitch: print("IPS 120-10: Set to Remote and Unlocked")
 		else:
 			raise ValueError("Invalid mode passed to ips12010.setInputMode")
 
-	def setResolution(self, resolution):
+	def setResolution(self, resolution, printSwitch=True):
 		"""Sets the resolution
 		
 		Arguments
@@ -106,10 +154,10 @@ class IPS12010():
 		"""
 
 		if resolution == "normal":
-			self.inst.write("$Q0")
+			self.writeSetting("Q", "$Q0")
 			if printSwitch: print("IPS 120-10: Set to Normal Resolution")
 		elif resolution == "extended":
-			self.inst.write("$Q4")
+			self.writeSetting("Q", "$Q4")
 			if printSwitch: print("IPS 120-10: Set to Extended Resolution")
 		else:
 			raise ValueError("Invalid resolution passed to ips12010.setResolution()")
@@ -117,14 +165,14 @@ class IPS12010():
 	def getPersistentCurrent(self, printSwitch=True):
 		"""Querys/returns the persistent current in (Amp) from the magnet power supply"""
 
-		persistentCurrent = float(self.inst.query("R 16"))
+		persistentCurrent = float(self.query("R 16"))
 		if printSwitch: print("IPS 120-10: Persistent current: %.4f Amp" % persistentCurrent)
 		return persistentCurrent
 
 	def getOutputCurrent(self, printSwitch=True):
 		"""Querys/returns the output current in (Amp) from the magnet power supply"""
 
-		outputCurrent = float(self.inst.query("R 2"))
+		outputCurrent = float(self.query("R 2"))
 		if printSwitch: print("IPS 120-10: Output current: %.4f Amp" % outputCurrent)
 		return outputCurrent
 	
@@ -135,7 +183,7 @@ class IPS12010():
 			status: True if heater is on, False otherwise
 		"""
 
-		statusStr = self.inst.query("X")
+		statusStr = self.query("X")
 		heaterChar = statusStr[8]
 		if heaterChar == '1':
 			if printSwitch: print("IPS 120-10: Heater status: ON")
@@ -144,28 +192,51 @@ class IPS12010():
 			if printSwitch: print("IPS 120-10: Heater status: OFF")
 			return False
 	######################################################################################
-	def waitUntilStable(self, refreshTime, printSwitch=True):
-		"""Periodically queries the magnet status until it is at rest
+	def waitUntilStable(self, refreshTime, target=None, timeout=None, printSwitch=True):
+		"""Waits until the power supply is at rest, predicting the end of the ramp from the output current,
+		the target and the ramp rate: sleeps through most of the ramp without touching the bus, then polls
+		the status starting every refreshTime and backing off exponentially
 
 		Arguments:
-			refreshTime: delay time in (sec) to wait between queries
+			refreshTime: first delay time in (sec) between queries near the end of the ramp
+			target: target current in (Amp), defaults to the set point read from the power supply
+			timeout: time in (sec) after which to give up, defaults to RAMP_TIMEOUT_FACTOR * predicted + RAMP_TIMEOUT_MARGIN
 		"""
 
-		# IMPLEMENT TIMEOUT TIME???
-		print("WARNING: Timeout not implemented for ips12010.waitUntilStable()")
+		startTime = time.time()
+		if target is None: target = float(self.query("R 5"))
+		if self.rampRate is None: self.rampRate = float(self.query("R 6"))
+		outputCurrent = self.getOutputCurrent(printSwitch=False)
+		remainingTime = rampTime(outputCurrent, target, self.rampRate)
+		if timeout is None: timeout = RAMP_TIMEOUT_FACTOR * remainingTime + RAMP_TIMEOUT_MARGIN
+		deadline = startTime + timeout
+		if printSwitch: print("IPS 120-10: Ramping %.4f -> %.4f Amp at %.3f Amp/min, ETA %.0f sec" % (outputCurrent, target, self.rampRate, remainingTime))
 
-		time.sleep(5)		# Wait a fixed time so that status can update to sweeping before querying
+		time.sleep(min(max(RAMP_START_DELAY, RAMP_WAIT_FRACTION * remainingTime), max(0, deadline - time.time())))
 
+		pollTime = refreshTime
 		while not self.isAtRest():
-			time.sleep(refreshTime)
-
-		if printSwitch: print("IPS 120-10: Power supply is AT REST")
+			now = time.time()
+			if now >= deadline: raise TimeoutError("IPS 120-10: Power supply not at rest after %.0f sec" % (now - startTime))
+
+			# Re-predict in case the ramp is running behind; back off once it should be over
+			outputCurrent = self.getOutputCurrent(printSwitch=False)
+			remainingTime = rampTime(outputCurrent, target, self.rampRate)
+			if printSwitch: print("IPS 120-10: Output current %.4f Amp, ETA %.0f sec" % (outputCurrent, remainingTime))
+			if remainingTime > pollTime:
+				sleepTime = RAMP_WAIT_FRACTION * remainingTime
+			else:
+				sleepTime = pollTime
+				pollTime = min(2 * pollTime, RAMP_MAX_POLL_TIME)
+			time.sleep(max(0, min(sleepTime, deadline - now)))
+
+		if printSwitch: print("IPS 120-10: Power supply is AT REST after %.0f sec" % (time.time() - startTime))
 		return True
 
 	def isAtRest(self):
 		"""Queries the magnet power supply status and returns True/False if the power supply is at rest or not"""
 
-		statusStr = self.inst.query("X")			# Examine returns a string that must be parsed
+		statusStr = self.query("X")			# Examine returns a string that must be parsed
 		if statusStr[11] == '0': return True		# Parse the string for the magnet status
 		return False
 	######################################################################################
@@ -173,14 +244,14 @@ class IPS12010():
 		"""Checks whether the output current and the persistent current match, to within the tolerance
 
 		Arguments:
-			tolerance: tolerance as a fraction of output current for deciding whether currents match
+			tolerance: tolerance as a fraction of output current for deciding whether currents match (at least MATCH_CURRENT_FLOOR)
 		"""
 
-		outputCurrent = self.getOutputCurrent()
-		persistentCurrent = self.getPersistentCurrent()
+		outputCurrent = self.getOutputCurrent(printSwitch=printSwitch)
+		persistentCurrent = self.getPersistentCurrent(printSwitch=printSwitch)
 
-		if abs(outputCurrent - persistentCurrent) < tolerance * outputCurrent:
-			if printSwitch: print("IPS 120-10: Output current matches persistent current to within %.2f %%" % tolerance*100)
+		if currentsMatch(outputCurrent, persistentCurrent, tolerance):
+			if printSwitch: print("IPS 120-10: Output current matches persistent current to within %.2f %%" % (tolerance * 100))
 			return True
 		else:
 			raise Exception("\nERROR ERROR ERROR ERROR\nMAGNET PERSISTENT CURRENT DOES NOT MATCH OUTPUT CURRENT\nERROR ERROR ERROR ERROR")
@@ -196,9 +267,26 @@ def acceptableRampRate(current):
 			0.5 Amp/min for current >= 57 Amp (~6 Tesla)
 	"""
 
-	if abs(current) < 57: 
+	if abs(current) < RAMP_RATE_BOUNDARY_CURRENT:
 		return 1.
 	else:
 		return 0.5
+
+def safeRampRate(startCurrent, endCurrent):
+	"""Returns the ramp rate in (Amp / min) acceptable over the whole ramp between two currents in (Amp),
+	i.e. the reduced rate if either end is at or above RAMP_RATE_BOUNDARY_CURRENT
+	"""
+
+	return min(acceptableRampRate(startCurrent), acceptableRampRate(endCurrent))
+
+def currentsMatch(current1, current2, tolerance):
+	"""Returns True if two currents in (Amp) match to within a fraction tolerance, or MATCH_CURRENT_FLOOR near zero"""
+
+	return abs(current1 - current2) <= max(tolerance * max(abs(current1), abs(current2)), MATCH_CURRENT_FLOOR)
+
+def rampTime(startCurrent, endCurrent, rate):
+	"""Returns the time in (sec) to ramp between two currents in (Amp) at a rate in (Amp / min)"""
+
+	return abs(endCurrent - startCurrent) / rate * 60.
 ##################################################################################################
 
@@ -1,19 +1,21 @@
 # Chris Tang
 # lakeshore372.py
 
-import visa
+import instrument
 
 ##################################################################################################
-class Lakeshore372():
-	def __init__(self, port):
-		self.port = port
-		self.inst = visa.ResourceManager().open_resource(port)
+class Lakeshore372(instrument.Instrument):
+	BATCH_SEPARATOR = ";"
+	BATCH_CONFIRM_QUERY = "*OPC?"
+
+	def __init__(self, port, resourceManager=None, useCache=False):
+		instrument.Instrument.__init__(self, port, resourceManager, useCache)
 
 		# self.setLedState(False)			# Turn off front panel LEDs
 
 		# Optional printing
 		print("\nConnecting Lakeshore 372 through address:\n%s" % port)
-		print("Querying IDN:\n%s" % self.inst.query("*IDN?"))
+		print("Querying IDN:\n%s" % self.query("*IDN?"))
 
 	######################################################################################
 	def setCalibrationCurve(self, chan, curveNum, printSwitch=True):
@@ -27,10 +29,10 @@ class Lakeshore372():
 		"""
 
 		if chan == 0:
-			self.inst.write("INCRV A,%d" % curveNum)
+			self.writeSetting("INCRV A", "INCRV A,%d" % curveNum)
 			if printSwitch: print("Lakeshore 372: Calibration curve #%d set to input channel: A" % curveNum)
 		else:
-			self.inst.write("INCRV %d,%d" % (chan, curveNum))
+			self.writeSetting("INCRV %d" % chan, "INCRV %d,%d" % (chan, curveNum))
 			if printSwitch: print("Lakeshore 372: Calibration curve #%d set to input channel: %d" % (chan, curveNum))
 
 	# NEED TO DO
@@ -49,14 +51,14 @@ class Lakeshore372():
 		"""
 
 		if chan == 0:
-			self.inst.write("FILTER A,%d,%d,%d" % (boolToInt(state), settleTime, window))
+			self.writeSetting("FILTER A", "FILTER A,%d,%d,%d" % (boolToInt(state), settleTime, window))
 			if printSwitch: 
 				if state: 
 					print("Lakeshore 372: Filter on channel A turned ON")
 				else:
 					print("Lakeshore 372: Fitler on channel A turned OFF")
 		else:
-			self.inst.write("FILTER %d,%d,%d,%d" % (chan, boolToInt(state), settleTime, window))
+			self.writeSetting("FILTER %d" % chan, "FILTER %d,%d,%d,%d" % (chan, boolToInt(state), settleTime, window))
 			if printSwitch: 
 				if state: 
 					print("Lakeshore 372: Filter on channel %d turned ON" % chan)
@@ -86,7 +88,7 @@ class Lakeshore372():
 			temp: desired temperature setpoint in (K)
 		"""
 
-		self.inst.write("SETP %d,%e" % (output, temp))
+		self.writeSetting("SETP %d" % output, "SETP %d,%e" % (output, temp))
 		if printSwitch: 
 			if output == 0:
 				print("Lakeshore 372: Sample heater setpoint: %e K" % temp)
@@ -103,7 +105,7 @@ class Lakeshore372():
 			d: derivative rate parameter (0 -> 2500)
 		"""
 
-		self.inst.write("PID %d,%d,%d,%d" % (output, int(p), int(i), int(d)))
+		self.writeSetting("PID %d" % output, "PID %d,%d,%d,%d" % (output, int(p), int(i), int(d)))
 		if printSwitch: 
 			if output == 0:
 				print("Lakeshore 372: PID parameters set on sample heater:\nP: %d\nI: %d\nD: %d" (int(p), int(i), int(d)))
@@ -120,11 +122,11 @@ class Lakeshore372():
 		"""
 
 		if chan == 0:
-			temp = self.inst.query("KRDG?A")
+			temp = self.query("KRDG?A")
 			if printSwitch: print("Lakeshore 372: Temperature of channel A: %e K" % temp)
 			return temp
 		else:
-			temp = self.inst.query("KRDG?%d" % chan)
+			temp = self.query("KRDG?%d" % chan)
 			if printSwitch: print("Lakeshore 372: Temperature of channel %d: %e K" % (chan, temp))
 			return temp
 
@@ -3,8 +3,28 @@
 
 import sr830
 import time
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
+##################################################################################################
+# Streaming Parameters
+
+# Time in (sec) to wait between reads of the data buffer while streaming
+STREAM_POLL_TIME = 0.5
+# Time in (sec) that lock-ins acquiring together wait for each other to be ready to start
+MULTI_START_TIMEOUT = 10
+# Minimum number of independent samples before trusting the error estimate of an adaptive run
+ADAPTIVE_MIN_INDEPENDENT_SAMPLES = 10
+##################################################################################################
+# Settling Parameters
+
+# Number of snapshots in each of the two windows compared by the settling test
+SETTLE_WINDOW = 5
+# Time between snapshots while testing for settling in units of (time constant)
+SETTLE_POLL_TIME_CONSTANTS = 0.25
+# Drift between windows, as a fraction of the signal magnitude, below which the outputs count as settled
+SETTLE_TOLERANCE = 1e-3
 ##################################################################################################
 def takeData(lockin, sampleTime, printSwitch=True):
 	"""Takes data for a given time
@@ -23,17 +43,297 @@ def takeData(lockin, sampleTime, printSwitch=True):
 	if printSwitch: print("Predicted finish time:")
 	if printSwitch: print(time.asctime( time.localtime(time.time() + sampleTime) ))
 
-	lockin.stopDataStorage()
-	lockin.resetDataBuffer()
-	lockin.startDataStorage()
-	time.sleep(sampleTime)
-	lockin.stopDataStorage()
-	x = lockin.readDataBuffer(chan=1)
-	y = lockin.readDataBuffer(chan=2)
-	t = np.arange(len(x)) * (1 / lockin.getSampleRate())
+	t, x, y = concatenateChunks(list(streamData(lockin, sampleTime, printSwitch=False)))
 	if printSwitch: print("%d data points acquired." % len(x))
 	return t, x, y
 
+def streamData(lockin, sampleTime, pollTime=STREAM_POLL_TIME, t0=None, startBarrier=None, rate=None, triggered=False, stopEvent=None, printSwitch=True):
+	"""Reads the data buffer while storage is running, yielding the newly stored points in chunks
+	Runs longer than the buffer holds are split into segments: the buffer is drained, reset and
+	restarted before it fills, so consecutive segments are separated by a short gap in time
+	Triggered runs (see sr830.armTriggeredStorage()) are never segmented, since a restarted buffer
+	would no longer be locked to the trigger: they must fit in one buffer and end once
+	sampleTime * rate points have been stored
+
+	Arguments:
+		lockin: instance of sr830 class
+		sampleTime: time to take data in (sec)
+		pollTime: time to wait between reads of the buffer in (sec)
+		t0: reference time (as from time.time()) for the returned time arrays
+			None: time is measured from the start of data storage
+		startBarrier: optional threading.Barrier to wait on right before storage is started
+		rate: sample rate in (Hz), read from the lock-in if None (required when sampling on the trigger input)
+		triggered: True if the lock-in is armed and storage is started by a trigger instead of STRT
+		stopEvent: optional threading.Event that ends the run early once set, sampleTime is then the longest run
+	Yields:
+		t: time array of the chunk with units of (sec)
+		x: in-phase amplitude array of the chunk with units of (Volt)
+		y: out-of-phase amplitude array of the chunk with units of (Volt)
+	"""
+
+	if rate is None: rate = lockin.getSampleRate(printSwitch=False)
+	if rate is None: raise ValueError("rate must be passed to lockinData.streamData() when sampling on the trigger input")
+	# Free points left in the buffer at which the current segment is ended
+	margin = int(2 * pollTime * rate) + 1
+	if margin >= sr830.BUFFER_SIZE: raise ValueError("pollTime passed to lockinData.streamData() is too long for the sample rate")
+	numTarget = int(sampleTime * rate) if triggered else None
+	if triggered and numTarget > sr830.BUFFER_SIZE: raise ValueError("Triggered run passed to lockinData.streamData() does not fit in the buffer")
+
+	if not triggered:
+		lockin.stopDataStorage(printSwitch=False)
+		lockin.resetDataBuffer(printSwitch=False)
+	if startBarrier is not None: startBarrier.wait()
+	segmentStart = time.time()
+	if not triggered: lockin.startDataStorage(printSwitch=False)
+	storing = True
+	if t0 is None: t0 = segmentStart
+	# Triggered runs end on the point count, the time limit only guards against a missing trigger
+	endTime = segmentStart + sampleTime + (MULTI_START_TIMEOUT if triggered else 0)
+	numRead = 0
+	numSegments = 1
+	# Chunks are read straight into one array per segment and yielded as views of it; a new array is
+	# allocated only when a segment starts, so chunks the caller keeps are never overwritten
+	segmentBuffer = np.empty((2, sr830.BUFFER_SIZE), dtype='<f4')
+
+	try:
+		while True:
+			numStored = lockin.getNumStoredPoints()
+			done = time.time() >= endTime or (triggered and numStored >= numTarget) or (stopEvent is not None and stopEvent.is_set())
+			segmentDone = done or (not triggered and numStored + margin >= sr830.BUFFER_SIZE)
+			if segmentDone:
+				lockin.stopDataStorage(printSwitch=False)
+				storing = False
+				numStored = lockin.getNumStoredPoints()
+			if triggered: numStored = min(numStored, numTarget)
+
+			if numStored > numRead:
+				x, y = lockin.readDataBuffers(numRead, numStored - numRead, out=segmentBuffer[:, numRead:], printSwitch=False)
+				t = (segmentStart - t0) + np.arange(numRead, numStored) / rate
+				numRead = numStored
+				yield t, x, y
+
+			if done: break
+			if segmentDone:
+				lockin.resetDataBuffer(printSwitch=False)
+				segmentBuffer = np.empty((2, sr830.BUFFER_SIZE), dtype='<f4')
+				segmentStart = time.time()
+				lockin.startDataStorage(printSwitch=False)
+				storing = True
+				numRead = 0
+				numSegments += 1
+				if printSwitch: print("Data buffer full, started segment %d" % numSegments)
+
+			time.sleep(max(0, min(pollTime, endTime - time.time())))
+	finally:
+		if storing: lockin.stopDataStorage(printSwitch=False)
+
+def takeDataAdaptive(lockin, relError, maxTime, minTime=0, pollTime=STREAM_POLL_TIME, printSwitch=True):
+	"""Takes data until the mean of x and y is known to a target relative error, or for maxTime
+	The standard error is corrected for the correlation between samples introduced by the
+	low-pass filter, using the current time constant and filter slope
+
+	Arguments:
+		lockin: instance of sr830 class
+		relError: target standard error of the mean of x and y, as a fraction of the mean magnitude
+		maxTime: longest time to take data
+		minTime: shortest time to take data
+		pollTime: time to wait between reads of the buffer in (sec), sets how often the error is checked
+	Return Values:
+		t: time array with units of (sec)
+		x: in-phase amplitude array with units of (Volt)
+		y: out-of-phase amplitude array with units of (Volt)
+		achievedError: relative standard error reached when data taking stopped
+	"""
+
+	rate = lockin.getSampleRate(printSwitch=False)
+	tauCorr = sr830.correlationTime(lockin.getTimeConstant(printSwitch=False), lockin.getLowPassFilterSlope(printSwitch=False))
+	samplesPerIndependent = max(1., tauCorr * rate)
+	if printSwitch: print("Now taking lockin data to %.2e relative error (at most %d secs)" % (relError, maxTime))
+
+	chunks = []
+	count = 0
+	shift = None
+	sums = np.zeros(2)
+	sumSqs = np.zeros(2)
+	achievedError = np.inf
+	for chunk in streamData(lockin, maxTime, pollTime=pollTime, rate=rate, printSwitch=False):
+		chunks.append(chunk)
+		t, x, y = chunk
+		# Accumulate about the first point to keep the variance numerically stable
+		values = np.array([x, y], dtype=float)
+		if shift is None: shift = values[:, :1].copy()
+		values -= shift
+		count += values.shape[1]
+		sums += values.sum(axis=1)
+		sumSqs += (values ** 2).sum(axis=1)
+
+		numIndependent = count / samplesPerIndependent
+		if count < 2 or numIndependent < ADAPTIVE_MIN_INDEPENDENT_SAMPLES: continue
+		mean = sums / count
+		var = np.maximum(sumSqs / count - mean ** 2, 0) * count / (count - 1)
+		stdErr = np.sqrt(var / numIndependent)
+		magnitude = np.hypot(*(mean + shift[:, 0]))
+		achievedError = stdErr.max() / magnitude if magnitude > 0 else np.inf
+		if t[-1] >= minTime and achievedError <= relError: break
+
+	t, x, y = concatenateChunks(chunks)
+	if printSwitch: print("%d data points acquired in %.1f secs, relative error: %.2e" % (len(x), t[-1] if len(t) else 0, achievedError))
+	return t, x, y, achievedError
+
+def waitUntilSettled(lockin, tolerance=SETTLE_TOLERANCE, maxTime=None, printSwitch=True):
+	"""Waits for the outputs to settle after a change of frequency, field, etc.
+	Waits the minimum settling time of the output filter, then polls snapshots until the means
+	of two consecutive windows agree to within the tolerance (or the noise of the windows)
+
+	Arguments:
+		lockin: instance of sr830 class
+		tolerance: allowed drift between windows as a fraction of the signal magnitude
+		maxTime: longest time to wait in (sec), defaults to three times the minimum settling time
+	Return Values:
+		settled: True if the outputs settled, False if maxTime ran out first
+	"""
+
+	tau = lockin.getTimeConstant(printSwitch=False)
+	minTime = sr830.settleTime(tau, lockin.getLowPassFilterSlope(printSwitch=False))
+	if maxTime is None: maxTime = 3 * minTime
+	startTime = time.time()
+	if printSwitch: print("Waiting at least %.3f secs for lockin to settle ..." % minTime)
+	time.sleep(minTime)
+
+	snapshots = []
+	while True:
+		snapshots.append(lockin.readSnapshot(printSwitch=False))
+		if len(snapshots) >= 2 * SETTLE_WINDOW:
+			previous = np.array(snapshots[-2 * SETTLE_WINDOW:-SETTLE_WINDOW])
+			latest = np.array(snapshots[-SETTLE_WINDOW:])
+			drift = np.abs(latest.mean(axis=0) - previous.mean(axis=0)).max()
+			noise = 2 * latest.std(axis=0, ddof=1).max() / np.sqrt(SETTLE_WINDOW)
+			if drift <= max(tolerance * np.hypot(*latest.mean(axis=0)), noise):
+				if printSwitch: print("Lockin settled after %.3f secs." % (time.time() - startTime))
+				return True
+		if time.time() - startTime >= maxTime:
+			if printSwitch: print("WARNING: Lockin did not settle within %.3f secs" % maxTime)
+			return False
+		time.sleep(SETTLE_POLL_TIME_CONSTANTS * tau)
+##################################################################################################
+def takeDataMulti(lockins, sampleTime, t0=None, stopEvent=None, printSwitch=True):
+	"""Takes data on several lock-ins at once for a given time
+	Each lock-in is started, stopped and read from its own thread, and the traces are
+	interpolated onto the time grid of the last lock-in to start, over the span they share
+
+	Arguments:
+		lockins: list of instances of sr830 class
+		sampleTime: time to take data
+		t0: reference time (as from time.time()) for the returned time array, None for the call
+		stopEvent: optional threading.Event that ends the run early once set, sampleTime is then the longest run
+	Return Values:
+		t: common time array with units of (sec), measured from t0
+		x: in-phase amplitude array of shape (len(lockins), len(t)) with units of (Volt)
+		y: out-of-phase amplitude array of shape (len(lockins), len(t)) with units of (Volt)
+	"""
+
+	if printSwitch: print("Now taking data on %d lockins for %d secs\nCurrent time:" % (len(lockins), sampleTime))
+	if printSwitch: print(time.asctime( time.localtime(time.time()) ))
+
+	if t0 is None: t0 = time.time()
+	startBarrier = threading.Barrier(len(lockins), timeout=MULTI_START_TIMEOUT)
+	def acquire(lockin):
+		return concatenateChunks(list(streamData(lockin, sampleTime, t0=t0, startBarrier=startBarrier, stopEvent=stopEvent, printSwitch=False)))
+	with ThreadPoolExecutor(max_workers=len(lockins)) as executor:
+		traces = list(executor.map(acquire, lockins))
+
+	t, x, y = alignTraces(traces)
+	if printSwitch: print("Start skew between lockins: %.1f ms" % (1e3 * (max(tr[0][0] for tr in traces) - min(tr[0][0] for tr in traces))))
+	if printSwitch: print("%d time-aligned data points acquired." % len(t))
+	return t, x, y
+
+def takeDataTriggered(lockins, fnGen, sampleTime, sampleRate, printSwitch=True):
+	"""Takes data on several lock-ins started together by one edge of the function generator sync
+	Every lock-in stores one point per sync edge, so the traces share the same time grid
+	Note, the sync output must be wired to the trigger input of every lock-in
+
+	Arguments:
+		lockins: list of instances of sr830 class
+		fnGen: instance of Agilent33500 class
+		sampleTime: time to take data, at most sr830.BUFFER_SIZE / sampleRate
+		sampleRate: frequency of the channel driving the sync output in (Hz)
+	Return Values:
+		t: common time array with units of (sec), measured from the starting edge
+		x: in-phase amplitude array of shape (len(lockins), len(t)) with units of (Volt)
+		y: out-of-phase amplitude array of shape (len(lockins), len(t)) with units of (Volt)
+	"""
+
+	if sampleTime * sampleRate > sr830.BUFFER_SIZE: raise ValueError("sampleTime passed to lockinData.takeDataTriggered() does not fit in the buffer")
+	if printSwitch: print("Now taking triggered data on %d lockins for %d secs\nCurrent time:" % (len(lockins), sampleTime))
+	if printSwitch: print(time.asctime( time.localtime(time.time()) ))
+
+	# Hold the sync output low while arming so that no edge arrives before every lock-in is ready
+	fnGen.setSyncState(False, printSwitch=False)
+	sampleIndices = [lockin.armTriggeredStorage(printSwitch=False) for lockin in lockins]
+	startBarrier = threading.Barrier(len(lockins) + 1, timeout=MULTI_START_TIMEOUT)
+	def acquire(lockin):
+		return concatenateChunks(list(streamData(lockin, sampleTime, startBarrier=startBarrier, rate=sampleRate, triggered=True, printSwitch=False)))
+	try:
+		with ThreadPoolExecutor(max_workers=len(lockins)) as executor:
+			futures = [executor.submit(acquire, lockin) for lockin in lockins]
+			startBarrier.wait()
+			fnGen.setSyncState(True, printSwitch=False)
+			traces = [future.result() for future in futures]
+	finally:
+		for lockin, sampleIndex in zip(lockins, sampleIndices): lockin.disarmTriggeredStorage(sampleIndex, printSwitch=False)
+
+	numPts = min(len(tr[1]) for tr in traces)
+	t = np.arange(numPts) / sampleRate
+	x = np.array([tr[1][:numPts] for tr in traces])
+	y = np.array([tr[2][:numPts] for tr in traces])
+	if printSwitch: print("%d triggered data points acquired." % numPts)
+	return t, x, y
+
+def alignTraces(traces):
+	"""Interpolates several (t, x, y) traces onto a common time grid
+	The grid is that of the trace that starts last, cut to the span covered by every trace
+
+	Arguments:
+		traces: list of (t, x, y) tuples sharing the same time reference
+	Return Values:
+		t: common time array with units of (sec)
+		x: in-phase amplitude array of shape (len(traces), len(t)) with units of (Volt)
+		y: out-of-phase amplitude array of shape (len(traces), len(t)) with units of (Volt)
+	"""
+
+	if any(len(tr[0]) == 0 for tr in traces): return np.zeros(0), np.zeros((len(traces), 0)), np.zeros((len(traces), 0))
+	refT = max(traces, key=lambda tr: tr[0][0])[0]
+	t = refT[refT <= min(tr[0][-1] for tr in traces)]
+	x = np.array([np.interp(t, trT, trX) for trT, trX, trY in traces])
+	y = np.array([np.interp(t, trT, trY) for trT, trX, trY in traces])
+	return t, x, y
+
+def readSnapshotMulti(lockins):
+	"""Reads the instantaneous value of x and y in (Volt) on several lock-ins at once
+
+	Arguments:
+		lockins: list of instances of sr830 class
+	Return Values:
+		snapshots: list of (x, y) tuples, one per lock-in
+	"""
+
+	with ThreadPoolExecutor(max_workers=len(lockins)) as executor:
+		return list(executor.map(lambda lockin: lockin.readSnapshot(printSwitch=False), lockins))
+##################################################################################################
+def concatenateChunks(chunks):
+	"""Joins a list of (t, x, y) chunks, as yielded by streamData(), into single arrays
+
+	Arguments:
+		chunks: list of (t, x, y) tuples
+	Return Values:
+		t: time array with units of (sec)
+		x: in-phase amplitude array with units of (Volt)
+		y: out-of-phase amplitude array with units of (Volt)
+	"""
+
+	if len(chunks) == 0: return np.zeros(0), np.zeros(0, dtype='<f4'), np.zeros(0, dtype='<f4')
+	t, x, y = zip(*chunks)
+	return np.concatenate(t), np.concatenate(x), np.concatenate(y)
+##################################################################################################
 ##################################################################################################
 ##################################################################################################
-##################################################################################################
\ No newline at end of file
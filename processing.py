@@ -0,0 +1,243 @@
+# Chris Tang
+# processing.py
+
+import os
+import time
+import h5py
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import fileio
+import catalog
+import bulkLoad
+import traceStore
+import resultCache
+
+# Complex susceptibility from the raw pickup-, drive- and empty-coil traces:
+#	chi = calibration * ((pickup - empty) / (drive / shuntResistance)) * exp(-i * phaseOffset)
+# where each coil signal is X + iY from its lock-in. The phase offset absorbs the 90 deg of the
+# inductive pickup and any lock-in/transformer phase, so that chi' and chi'' come out as real/imag.
+# The raw traces of a trial are read from the trace store of its parameter directory (see
+# traceStore.py), or from a .csv trial (dddd_xxx.csv) holding the CSV_COLUMNS, e.g. as written by
+#	np.savetxt(fileio.trialPath(...), np.column_stack((t, x[0], y[0], x[1], y[1], x[2], y[2])), delimiter=",")
+# from lockinData.takeDataMulti([pickupLockin, driveLockin, emptyLockin], ...). Files with other
+# layouts are skipped. Each parameter directory is reduced to one Processed_Data/ffff_AAAA_HHHH.npz
+# with one entry per trial:
+#	keys, probeDeltaFreq (Hz), trialNum, numPts, chi (mean), chiStd (std of real + i * std of imag)
+
+##################################################################################################
+# Processing Parameters
+
+# Trace store columns holding the raw lock-in outputs
+RAW_COLUMNS = ("pickupX", "pickupY", "driveX", "driveY", "emptyX", "emptyY")
+# Columns of a processable .csv trial, in order
+CSV_COLUMNS = ("t",) + RAW_COLUMNS
+# Version of the processing code, bump it whenever a change alters the results so cached ones are recomputed
+PROCESSING_VERSION = 1
+# Default processing configuration, override any entry by passing a dict
+DEFAULT_CONFIG = {
+	"shuntResistance": 1.,		# Shunt resistor of the drive coil in (Ohm)
+	"phaseOffset": 0.,			# Phase rotation in (deg)
+	"calibration": 1.,			# Pickup coil calibration, chi per (Volt / Amp)
+}
+# Points processed together per batch of trials, bounds the memory per worker
+BATCH_POINTS = 2 ** 22
+# Worker processes, None uses one per core
+NUM_WORKERS = None
+##################################################################################################
+def susceptibility(pickupX, pickupY, driveX, driveY, emptyX, emptyY, config=None):
+	"""Computes the complex susceptibility point by point from raw lock-in outputs in (Volt)
+	Arrays of any (matching) shape are accepted; points with zero drive give NaN
+
+	Arguments:
+		pickupX, pickupY, driveX, driveY, emptyX, emptyY: lock-in outputs in (Volt)
+		config: dict overriding entries of DEFAULT_CONFIG
+	Return Values:
+		chi: complex array of the susceptibility
+	"""
+
+	config = dict(DEFAULT_CONFIG, **(config or {}))
+	pickup = np.asarray(pickupX, dtype=float) + 1j * np.asarray(pickupY, dtype=float)
+	empty = np.asarray(emptyX, dtype=float) + 1j * np.asarray(emptyY, dtype=float)
+	current = (np.asarray(driveX, dtype=float) + 1j * np.asarray(driveY, dtype=float)) / config["shuntResistance"]
+	rotation = config["calibration"] * np.exp(-1j * np.radians(config["phaseOffset"]))
+	with np.errstate(divide="ignore", invalid="ignore"):
+		chi = (pickup - empty) / current * rotation
+	chi[current == 0] = np.nan
+	return chi
+
+def trialStatistics(traces, config=None):
+	"""Reduces a batch of traces to per-trial statistics of the susceptibility in one pass
+	The traces are concatenated so that chi is computed by a single vectorized call
+
+	Arguments:
+		traces: list of dicts holding the RAW_COLUMNS of each trial
+		config: dict overriding entries of DEFAULT_CONFIG
+	Return Values:
+		numPts: valid (non-NaN) points per trial
+		chi: mean susceptibility per trial
+		chiStd: standard deviation per trial, of the real part + i * of the imaginary part
+	"""
+
+	lengths = np.array([len(trace[RAW_COLUMNS[0]]) for trace in traces])
+	columns = [np.concatenate([trace[name] for trace in traces]) for name in RAW_COLUMNS]
+	chi = susceptibility(*columns, config=config)
+
+	# Segmented sums over the concatenation
+	valid = ~np.isnan(chi)
+	chi[~valid] = 0
+	starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+	numPts = np.add.reduceat(valid, starts).astype(int)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		mean = np.add.reduceat(chi, starts) / numPts
+		deviation = np.where(valid, chi - np.repeat(mean, lengths), 0)
+		variance = np.add.reduceat(deviation.real ** 2, starts) / numPts + 1j * np.add.reduceat(deviation.imag ** 2, starts) / numPts
+	return numPts, mean, np.sqrt(variance.real) + 1j * np.sqrt(variance.imag)
+##################################################################################################
+def processDir(parameterDir, config=None, useCache=False, printSwitch=False):
+	"""Processes every trial of one parameter directory, from its trace store and .csv trials, and saves the results
+
+	Arguments:
+		parameterDir: parameter directory string (ffff_AAAA_HHHH/) or path ending in one
+		config: dict overriding entries of DEFAULT_CONFIG
+		useCache: only recomputes trials missing from the result cache (see resultCache.py) if True
+		printSwitch: prints the number of processed trials if True
+	Return Values:
+		path: path of the saved results, None if the directory has no processable trials
+	"""
+
+	pumpFreq, pumpAmp, transverseField = fileio.dirToParameters(parameterDir)
+	rawDir = fileio.RAW_DATA_FOLDER + fileio.parametersToDir(pumpFreq, pumpAmp, transverseField)
+	storePath = rawDir + fileio.TRACE_STORE_FILENAME
+	hasStore = os.path.exists(storePath)
+	csvKeys, csvPaths = csvTrials(rawDir)
+	if not hasStore and not csvKeys: return None
+	path = fileio.processedPath(pumpFreq, pumpAmp, transverseField)
+
+	if useCache:
+		configKey = resultCache.configHash(dict(DEFAULT_CONFIG, **(config or {}), processingVersion=PROCESSING_VERSION))
+		# Only a store can be skipped whole, .csv trials are checked one by one
+		if not csvKeys and resultCache.isProcessed(storePath, configKey, path):
+			if printSwitch: print("%s: Unchanged" % parameterDir)
+			return path
+		stat = os.stat(storePath) if hasStore else None
+
+	# Only trials holding every raw column with at least one point can be processed
+	storeKeys, lengths = processableTrials(storePath) if hasStore else ([], np.zeros(0, dtype=int))
+	csvPaths = [csvPath for key, csvPath in zip(csvKeys, csvPaths) if key not in storeKeys]
+	keys = storeKeys + [key for key in csvKeys if key not in storeKeys]
+	if not keys: return None
+
+	def compute(indices):
+		"""Statistics of the trials at indices (ascending) into keys"""
+		results = [(np.zeros(0, dtype=int), np.zeros(0, dtype=complex), np.zeros(0, dtype=complex))]
+		storeIndices = [i for i in indices if i < len(storeKeys)]
+		csvIndices = [i - len(storeKeys) for i in indices if i >= len(storeKeys)]
+		if storeIndices: results.append(computeStatistics(storePath, [storeKeys[i] for i in storeIndices], lengths[storeIndices], config))
+		if csvIndices: results.append(computeCsvStatistics([csvPaths[i] for i in csvIndices], config))
+		return [np.concatenate(result) for result in zip(*results)]
+
+	if useCache:
+		contentHashes = (resultCache.trialHashes(storePath, storeKeys, RAW_COLUMNS) if storeKeys else []) + resultCache.fileHashes(csvPaths)
+		entryKeys = [resultCache.entryKey(contentHash, configKey) for contentHash in contentHashes]
+		entries = [resultCache.get(entryKey) for entryKey in entryKeys]
+		missing = [i for i, entry in enumerate(entries) if entry is None]
+		for i, numPts, chi, chiStd in zip(missing, *compute(missing)):
+			entries[i] = {"numPts": numPts, "chi": chi, "chiStd": chiStd}
+			resultCache.put(entryKeys[i], **entries[i])
+		numPts, chi, chiStd = [np.array([entry[name] for entry in entries]) for name in ["numPts", "chi", "chiStd"]]
+	else:
+		missing = keys
+		numPts, chi, chiStd = compute(list(range(len(keys))))
+
+	np.savez(path, keys=np.array(keys), probeDeltaFreq=np.array([fileio.strToDeltaFreq(key.split("_")[0]) for key in keys]), trialNum=np.array([fileio.strToTrialNum(key) for key in keys]),
+		numPts=numPts, chi=chi, chiStd=chiStd, pumpFreq=pumpFreq, pumpAmp=pumpAmp, transverseField=transverseField)
+	if useCache and hasStore and not csvKeys: resultCache.markProcessed(storePath, configKey, path, stat)
+	if printSwitch: print("%s: Computed %d of %d trials" % (parameterDir, len(missing), len(keys)))
+	return path
+
+def computeStatistics(storePath, keys, lengths, config=None):
+	"""Reads trials from a store in batches of about BATCH_POINTS points and reduces them with trialStatistics()"""
+
+	results = [(np.zeros(0, dtype=int), np.zeros(0, dtype=complex), np.zeros(0, dtype=complex))]
+	batchStart = 0
+	while batchStart < len(keys):
+		batchEnd = batchStart + max(1, np.searchsorted(np.cumsum(lengths[batchStart:]), BATCH_POINTS, side="right"))
+		traces = traceStore.readTraces(storePath, keys[batchStart:batchEnd], RAW_COLUMNS)
+		results.append(trialStatistics(traces, config))
+		batchStart = batchEnd
+	return [np.concatenate(result) for result in zip(*results)]
+
+def computeCsvStatistics(paths, config=None):
+	"""Reads .csv trials in batches of about BATCH_POINTS points and reduces them with trialStatistics()"""
+
+	results = [(np.zeros(0, dtype=int), np.zeros(0, dtype=complex), np.zeros(0, dtype=complex))]
+	traces = []
+	numPts = 0
+	for i, path in enumerate(paths):
+		arr = bulkLoad.parseTrialFile(path).reshape(-1, len(CSV_COLUMNS))
+		traces.append({name: arr[:, CSV_COLUMNS.index(name)] for name in RAW_COLUMNS})
+		numPts += len(arr)
+		if numPts >= BATCH_POINTS or i == len(paths) - 1:
+			results.append(trialStatistics(traces, config))
+			traces = []
+			numPts = 0
+	return [np.concatenate(result) for result in zip(*results)]
+
+def csvTrials(rawDir):
+	"""Returns the names and paths of the .csv trials of a parameter directory whose rows hold the CSV_COLUMNS
+	Only the first line of each file is read; empty files (reserved but not yet written) are skipped
+	"""
+
+	keys, paths = [], []
+	if not os.path.isdir(rawDir): return keys, paths
+	for fileName in sorted(os.listdir(rawDir)):
+		if not catalog.TRIAL_FILE_PATTERN.match(fileName): continue
+		with open(rawDir + fileName) as trialFile:
+			firstLine = next((line for line in trialFile if line.strip() and not line.startswith("#")), None)
+		if firstLine is None or firstLine.count(",") + 1 != len(CSV_COLUMNS): continue
+		keys.append(fileName[:-len(".csv")])
+		paths.append(rawDir + fileName)
+	return keys, paths
+
+def processableTrials(storePath):
+	"""Returns the trials of a store holding every RAW_COLUMNS dataset with at least one point, and their lengths"""
+
+	validKeys, lengths = [], []
+	with h5py.File(storePath, "r") as store:
+		for key in sorted(store.keys()):
+			if not all(name in store[key] for name in RAW_COLUMNS): continue
+			numPts = len(store[key][RAW_COLUMNS[0]])
+			if numPts == 0: continue
+			validKeys.append(key)
+			lengths.append(numPts)
+	return validKeys, np.array(lengths)
+
+def processAll(config=None, useCache=False, numWorkers=NUM_WORKERS, printSwitch=True):
+	"""Processes every parameter directory under fileio.RAW_DATA_FOLDER on a process pool
+
+	Arguments:
+		config: dict overriding entries of DEFAULT_CONFIG
+		useCache: only recomputes changed trials and evicts old cache entries afterwards if True
+		numWorkers: worker processes, None uses one per core, 1 processes in this process
+		printSwitch: prints the throughput if True
+	Return Values:
+		paths: paths of the saved results
+	"""
+
+	startTime = time.time()
+	parameterDirs = sorted(entry.name for entry in os.scandir(fileio.RAW_DATA_FOLDER) if entry.is_dir() and catalog.PARAMETER_DIR_PATTERN.match(entry.name))
+
+	process = partial(processDir, config=config, useCache=useCache)
+	if numWorkers == 1 or len(parameterDirs) <= 1:
+		paths = [process(parameterDir) for parameterDir in parameterDirs]
+	else:
+		with ProcessPoolExecutor(numWorkers) as executor:
+			paths = list(executor.map(process, parameterDirs))
+	paths = [path for path in paths if path is not None]
+	if useCache: resultCache.evict(printSwitch=printSwitch)
+
+	if printSwitch: print("Processed %d directories in %.2f sec" % (len(paths), time.time() - startTime))
+	return paths
+##################################################################################################
@@ -35,7 +35,7 @@ def setProbeFreq(fnGen, freq, printSwitch=True):
 		freq: frequency in (Hz)
 	"""
 
-	fnGen.setFreq(chan=PROBE_CHAN)
+	fnGen.setFreq(chan=PROBE_CHAN, freq=freq)
 ##################################################################################################
 def setPumpAmp(fnGen, amp):
 	"""Sets the peak-to-peak amplitude of the pump in (Volt)
@@ -0,0 +1,188 @@
+# Chris Tang
+# resultCache.py
+
+import os
+import json
+import hashlib
+import sqlite3
+import h5py
+import numpy as np
+from contextlib import closing
+
+import fileio
+
+# Content-addressed on-disk cache of processing results, so that reprocessing only recomputes
+# trials whose raw data or processing configuration changed:
+#	entry key = sha256(content hash of the trial's raw columns + hash of the configuration)
+#	Result_Cache/kk/<key>.npz		one entry per trial, evicted least recently used first
+#	Result_Cache/index.sqlite		memo of content hashes, and of the stores already processed
+# Hashing a trial means reading it, so content hashes are memoised on (store, trial, timeStamp),
+# or (.csv trial, mtime), and a store whose size and mtime are unchanged since it was last
+# processed is skipped entirely
+
+##################################################################################################
+# Cache Parameters
+
+# Name of the index inside fileio.RESULT_CACHE_FOLDER
+INDEX_FILENAME = "index.sqlite"
+# Size limit of the cached entries in (bytes)
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+# Seconds to wait for another process holding the index
+INDEX_TIMEOUT = 60.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trialHashes (
+	storePath TEXT,
+	key TEXT,
+	timeStamp REAL,
+	hash TEXT,
+	PRIMARY KEY (storePath, key)
+);
+CREATE TABLE IF NOT EXISTS processedStores (
+	storePath TEXT,
+	configHash TEXT,
+	size INTEGER,
+	mtime INTEGER,
+	outputPath TEXT,
+	PRIMARY KEY (storePath)
+);
+"""
+##################################################################################################
+def connect():
+	"""Opens the cache index, creating the cache folder and tables if needed"""
+
+	os.makedirs(fileio.RESULT_CACHE_FOLDER, exist_ok=True)
+	connection = sqlite3.connect(os.path.join(fileio.RESULT_CACHE_FOLDER, INDEX_FILENAME), timeout=INDEX_TIMEOUT)
+	connection.executescript(SCHEMA)
+	return connection
+
+def configHash(config):
+	"""Returns the hash of a (JSON-serializable) processing configuration"""
+
+	return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def entryKey(contentHash, configKey):
+	"""Returns the cache key of one trial processed with one configuration"""
+
+	return hashlib.sha256((contentHash + configKey).encode()).hexdigest()
+
+def trialHashes(storePath, keys, columns):
+	"""Returns the content hashes of trials in a trace store, hashing only trials not seen before
+
+	Arguments:
+		storePath: path of the trace store
+		keys: names of the trials
+		columns: names of the columns that make up the content
+	Return Values:
+		hashes: list of hex digests in the order of keys
+	"""
+
+	with closing(connect()) as connection, connection:
+		known = {key: (timeStamp, hash) for key, timeStamp, hash in connection.execute("SELECT key, timeStamp, hash FROM trialHashes WHERE storePath = ?", (storePath,))}
+		hashes = []
+		with h5py.File(storePath, "r") as store:
+			for key in keys:
+				group = store[key]
+				timeStamp = float(group.attrs["timeStamp"])
+				if key in known and known[key][0] == timeStamp:
+					hashes.append(known[key][1])
+					continue
+				digest = hashlib.sha256()
+				for name in columns:
+					digest.update(name.encode())
+					digest.update(np.ascontiguousarray(group[name][()]).tobytes())
+				hashes.append(digest.hexdigest())
+				connection.execute("INSERT OR REPLACE INTO trialHashes VALUES (?, ?, ?, ?)", (storePath, key, timeStamp, hashes[-1]))
+	return hashes
+
+def fileHashes(paths):
+	"""Returns the content hashes of whole files (e.g. .csv trials), hashing only files changed since they were last seen
+
+	Arguments:
+		paths: paths of the files
+	Return Values:
+		hashes: list of hex digests in the order of paths
+	"""
+
+	if not paths: return []
+	with closing(connect()) as connection, connection:
+		hashes = []
+		for path in paths:
+			timeStamp = float(os.stat(path).st_mtime_ns)
+			row = connection.execute("SELECT timeStamp, hash FROM trialHashes WHERE storePath = ? AND key = ''", (path,)).fetchone()
+			if row is not None and row[0] == timeStamp:
+				hashes.append(row[1])
+				continue
+			with open(path, "rb") as trialFile:
+				hashes.append(hashlib.sha256(trialFile.read()).hexdigest())
+			connection.execute("INSERT OR REPLACE INTO trialHashes VALUES (?, ?, ?, ?)", (path, "", timeStamp, hashes[-1]))
+	return hashes
+##################################################################################################
+def entryPath(key):
+	"""Returns the path of a cache entry"""
+
+	return os.path.join(fileio.RESULT_CACHE_FOLDER, key[:2], key + ".npz")
+
+def get(key):
+	"""Returns the arrays of a cache entry as a dict, or None on a miss
+	A hit refreshes the entry's mtime, which orders the LRU eviction
+	"""
+
+	path = entryPath(key)
+	try:
+		with np.load(path) as entry:
+			arrays = dict(entry)
+	except (FileNotFoundError, ValueError, OSError):
+		return None
+	os.utime(path)
+	return arrays
+
+def put(key, **arrays):
+	"""Stores arrays as a cache entry; the entry appears atomically, so readers never see a partial one"""
+
+	path = entryPath(key)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	tempPath = "%s.%d.tmp.npz" % (path[:-len(".npz")], os.getpid())
+	np.savez(tempPath, **arrays)
+	os.replace(tempPath, path)
+
+def evict(maxBytes=MAX_CACHE_BYTES, printSwitch=False):
+	"""Deletes the least recently used entries until the cache fits in maxBytes
+
+	Return Values:
+		numEvicted: number of deleted entries
+	"""
+
+	entries = []
+	for root, dirs, files in os.walk(fileio.RESULT_CACHE_FOLDER):
+		for file in files:
+			if not file.endswith(".npz") or file.endswith(".tmp.npz"): continue
+			stat = os.stat(os.path.join(root, file))
+			entries.append((stat.st_mtime, stat.st_size, os.path.join(root, file)))
+	entries.sort()
+
+	totalBytes = sum(entry[1] for entry in entries)
+	numEvicted = 0
+	for mtime, size, path in entries:
+		if totalBytes <= maxBytes: break
+		os.remove(path)
+		totalBytes -= size
+		numEvicted += 1
+	if printSwitch: print("Result cache: %.1f MB after evicting %d entries" % (totalBytes / 1e6, numEvicted))
+	return numEvicted
+##################################################################################################
+def isProcessed(storePath, configKey, outputPath):
+	"""Returns True if the store is unchanged since it was processed with this configuration into outputPath"""
+
+	if not os.path.exists(outputPath): return False
+	stat = os.stat(storePath)
+	with closing(connect()) as connection:
+		row = connection.execute("SELECT configHash, size, mtime, outputPath FROM processedStores WHERE storePath = ?", (storePath,)).fetchone()
+	return row == (configKey, stat.st_size, stat.st_mtime_ns, outputPath)
+
+def markProcessed(storePath, configKey, outputPath, stat):
+	"""Records that the store, as it was at stat, has been processed with this configuration into outputPath"""
+
+	with closing(connect()) as connection, connection:
+		connection.execute("INSERT OR REPLACE INTO processedStores VALUES (?, ?, ?, ?, ?)", (storePath, configKey, stat.st_size, stat.st_mtime_ns, outputPath))
+##################################################################################################
@@ -0,0 +1,149 @@
+# Chris Tang
+# scheduler.py
+
+import ips12010
+import sr830
+import transverseField
+
+# Execution order for a campaign over the grid pumpFreq x pumpAmp x transverseField x probeDeltaFreq
+# (the axes of fileio.parametersToDir / deltaFreqToStr), from a cost model of every transition:
+#	field: magnet ramps at ips12010.acceptableRampRate (split at the 57 A boundary) plus, in persistent
+#		mode, the switch heater times and lead ramps of transverseField.setTransverseField
+#	pumpFreq, pumpAmp, probeDeltaFreq: function generator update, then lock-in settling
+# Fields are visited once each, in a single monotonic sweep, so the magnet never backtracks (nor
+# re-crosses the 57 A boundary); both directions are costed with estimateTime() and the cheaper one
+# is kept. Within each field the other axes are traversed in serpentine order, so consecutive points
+# differ in one axis only, with the costliest of them changing least often. That nesting needs no
+# search: swapping two adjacent nested axes a, b (n values, change time c each) changes the total time by
+# (n_a - 1)(n_b - 1)(c_b - c_a), so costliest outermost is always best under this cost model.
+# Whether fields are changed in driven or persistent mode is left to the caller, since driven mode
+# is never slower by this estimate and the choice is one of magnet safety:
+#	order, totalTime = scheduler.scheduleGrid(pumpFreqs, pumpAmps, fields, deltaFreqs, sampleTime=60, tau=1, slope=24)
+
+##################################################################################################
+# Cost Parameters
+
+# Time in (sec) to update the function generator for a change of each axis
+AXIS_CHANGE_TIME = {"pumpFreq": 0.1, "pumpAmp": 0.05, "probeDeltaFreq": 0.1}
+# Order of the axes within the tuples of a schedule
+AXES = ("pumpFreq", "pumpAmp", "transverseField", "probeDeltaFreq")
+##################################################################################################
+def fieldRampTime(startField, endField):
+	"""Returns the time in (sec) to ramp the magnet between two fields in (Tesla) at the acceptable rates"""
+
+	segments = transverseField.rampSegments(startField / transverseField.AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT, endField / transverseField.AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT)
+	return sum(ips12010.rampTime(start, end, ips12010.acceptableRampRate(0.5 * (start + end))) for start, end in segments)
+
+def fieldChangeTime(startField, endField, driven=False):
+	"""Returns the time in (sec) to change the transverse field
+
+	Arguments:
+		startField, endField: transverse field strengths in (Tesla)
+		driven: True for a driven-mode sweep (transverseField.sweepTransverseField()), where only the ramp counts;
+			False for persistent mode (transverseField.setTransverseField()), starting and ending with the leads at zero
+	Return Values:
+		time: time in (sec)
+	"""
+
+	if startField == endField: return 0.
+	rampTime = fieldRampTime(startField, endField) + ips12010.RAMP_START_DELAY
+	if driven: return rampTime
+
+	# Leads up to the persistent current, heater on, ramp, heater off, leads back to zero
+	matchTime = fieldRampTime(0., startField) + ips12010.RAMP_START_DELAY if startField != 0 else 0.
+	zeroTime = fieldRampTime(endField, 0.) + ips12010.RAMP_START_DELAY
+	heaterTime = transverseField.MAGNET_HEAT_TIME + transverseField.MAGNET_HEATER_CHECK_TIME + transverseField.MAGNET_COOL_TIME
+	return matchTime + heaterTime + rampTime + zeroTime
+
+def transitionTime(previous, point, tau, slope, driven=False):
+	"""Returns the time in (sec) to move from one grid point to the next, ready to measure
+
+	Arguments:
+		previous, point: (pumpFreq, pumpAmp, transverseField, probeDeltaFreq) tuples
+		tau: lock-in time constant in (sec)
+		slope: lock-in low-pass filter slope (6,12,18,24) in (dB/oct)
+		driven: True if fields are changed in driven mode
+	Return Values:
+		time: time in (sec)
+	"""
+
+	changed = [axis for axis, old, new in zip(AXES, previous, point) if old != new]
+	if not changed: return 0.
+	time = sum(AXIS_CHANGE_TIME.get(axis, 0.) for axis in changed)
+	if "transverseField" in changed: time += fieldChangeTime(previous[2], point[2], driven)
+	return time + sr830.settleTime(tau, slope)
+##################################################################################################
+def serpentine(axes):
+	"""Returns every combination of the values of several axes, ordered so that consecutive
+	combinations differ in exactly one axis (the first axis changes least often)
+
+	Arguments:
+		axes: list of lists of values
+	Return Values:
+		combinations: list of tuples
+	"""
+
+	combinations = [()]
+	for values in axes:
+		combinations = [combination + (value,) for i, combination in enumerate(combinations) for value in (values if i % 2 == 0 else values[::-1])]
+	return combinations
+
+def scheduleGrid(pumpFreqs, pumpAmps, transverseFields, probeDeltaFreqs, sampleTime, tau, slope, currentField=0., driven=False, printSwitch=True):
+	"""Orders a parameter grid to minimize the total wall time estimated by estimateTime(), over serpentine
+	orders with one monotonic field sweep (see the notes at the top of this file)
+
+	Arguments:
+		pumpFreqs: pump frequencies in (Hz)
+		pumpAmps: pump amplitudes in (Tesla)
+		transverseFields: transverse field strengths in (Tesla)
+		probeDeltaFreqs: probe delta frequencies in (Hz)
+		sampleTime: measuring time per point in (sec)
+		tau: lock-in time constant in (sec)
+		slope: lock-in low-pass filter slope (6,12,18,24) in (dB/oct)
+		currentField: transverse field in (Tesla) the magnet is at now
+		driven: True if fields are changed in driven mode
+		printSwitch: prints the estimate if True
+	Return Values:
+		order: list of (pumpFreq, pumpAmp, transverseField, probeDeltaFreq) tuples in execution order
+		totalTime: estimated wall time in (sec)
+	"""
+
+	# The remaining axes nested by cost of change, costliest outermost
+	innerAxes = {"pumpFreq": sorted(set(pumpFreqs)), "pumpAmp": sorted(set(pumpAmps)), "probeDeltaFreq": sorted(set(probeDeltaFreqs))}
+	innerNames = sorted(innerAxes, key=lambda axis: -AXIS_CHANGE_TIME[axis])
+	innerPoints = serpentine([innerAxes[axis] for axis in innerNames])
+
+	# One monotonic sweep over the fields in the cheaper direction, the one from the end nearest the present field on a tie
+	fields = sorted(set(transverseFields))
+	if fields and abs(fields[-1] - currentField) < abs(fields[0] - currentField): fields = fields[::-1]
+	candidates = []
+	for sweep in (fields, fields[::-1]):
+		order = []
+		for i, field in enumerate(sweep):
+			for combination in (innerPoints if i % 2 == 0 else innerPoints[::-1]):
+				values = dict(zip(innerNames, combination), transverseField=field)
+				order.append(tuple(values[axis] for axis in AXES))
+		candidates.append((estimateTime(order, sampleTime, tau, slope, currentField, driven), order))
+	totalTime, order = min(candidates, key=lambda candidate: candidate[0])
+
+	if printSwitch: print("Scheduled %d points over %d fields, estimated %.2f hours" % (len(order), len(fields), totalTime / 3600.))
+	return order, totalTime
+
+def estimateTime(order, sampleTime, tau, slope, currentField=0., driven=False):
+	"""Returns the estimated wall time in (sec) of measuring the points of a schedule in order
+
+	Arguments:
+		order: list of (pumpFreq, pumpAmp, transverseField, probeDeltaFreq) tuples
+		sampleTime: measuring time per point in (sec)
+		tau: lock-in time constant in (sec)
+		slope: lock-in low-pass filter slope (6,12,18,24) in (dB/oct)
+		currentField: transverse field in (Tesla) the magnet is at now
+		driven: True if fields are changed in driven mode
+	Return Values:
+		totalTime: estimated wall time in (sec)
+	"""
+
+	if not order: return 0.
+	start = (None, None, currentField, None)
+	return len(order) * sampleTime + sum(transitionTime(previous, point, tau, slope, driven) for previous, point in zip([start] + order[:-1], order))
+##################################################################################################
@@ -0,0 +1,268 @@
+# Chris Tang
+# simVisa.py
+
+import time
+import numpy as np
+
+# Simulated stand-ins for the VISA resources of the lab instruments, for running the drivers
+# and acquisition code without hardware:
+#	rm = simVisa.SimResourceManager()
+#	fnGen = agilent33500.Agilent33500("SIM::FNGEN", resourceManager=rm)
+#	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=rm)
+#	magSupply = ips12010.IPS12010("SIM::MAGNET", resourceManager=rm)
+# Lock-ins opened on the same resource manager are wired to the sync output of the function generator
+
+##################################################################################################
+class SimResourceManager():
+	def __init__(self):
+		self.resources = {}
+		self.fnGen = None
+
+	def open_resource(self, port):
+		"""Returns the simulated instrument at port, creating it from the port name if needed
+		Ports containing "FNGEN" are function generators, "MAGNET" magnet power supplies, everything else is a lock-in
+		"""
+
+		if port not in self.resources:
+			if "FNGEN" in port:
+				self.fnGen = SimAgilent33500()
+				self.resources[port] = self.fnGen
+			elif "MAGNET" in port:
+				self.resources[port] = SimIPS12010()
+			else:
+				self.resources[port] = SimSR830(self)
+		return self.resources[port]
+##################################################################################################
+class SimInstrument():
+	def __init__(self, idn, separator, settings):
+		self.idn = idn
+		self.separator = separator
+		self.settings = dict(settings)
+		self.response = b""
+
+	def write(self, cmdStr):
+		"""Executes a (possibly separator-joined) command string"""
+
+		responses = [self.execute(cmd.strip().lstrip(":")) for cmd in cmdStr.split(self.separator) if cmd.strip()]
+		responses = [response for response in responses if response is not None]
+		if responses:
+			if all(isinstance(response, str) for response in responses):
+				self.response = (";".join(responses) + "\n").encode()
+			else:
+				self.response = b"".join(response if isinstance(response, bytes) else response.encode() for response in responses)
+
+	def query(self, cmdStr):
+		self.write(cmdStr)
+		return self.read()
+
+	def read(self):
+		response = self.response.decode().strip()
+		self.response = b""
+		return response
+
+	def read_raw(self):
+		response = self.response
+		self.response = b""
+		return response
+
+	def read_bytes(self, count):
+		response = self.response[:count]
+		self.response = self.response[count:]
+		return response
+
+	def execute(self, cmd):
+		"""Executes a single command, returning the response string (or bytes) for queries"""
+
+		name, _, args = cmd.partition(" ")
+		if name == "*IDN?": return self.idn
+		if name == "*OPC?": return "1"
+		if name.endswith("?"): return self.settings.get(name[:-1], "0")
+		self.settings[name] = args
+##################################################################################################
+class SimAgilent33500(SimInstrument):
+	def __init__(self):
+		SimInstrument.__init__(self, "Agilent Technologies,33522B,SIM,0.0", ";", {"SOUR1:FREQ": "1.000000e+03", "SOUR2:FREQ": "1.000000e+03", "OUTP:SYNC:SOUR": "CH1"})
+		self.syncOnTime = None
+
+	def execute(self, cmd):
+		name, _, args = cmd.partition(" ")
+		if name == "OUTP:SYNC":
+			if args == "ON" and self.syncOnTime is None: self.syncOnTime = time.time()
+			if args == "OFF": self.syncOnTime = None
+		response = SimInstrument.execute(self, cmd)
+		# SCPI reads boolean settings back as 1/0
+		return {"ON": "1", "OFF": "0"}.get(response, response)
+
+	def syncFreq(self):
+		"""Returns the frequency in (Hz) of the channel driving the sync output"""
+
+		return float(self.settings["SOUR%s:FREQ" % self.settings["OUTP:SYNC:SOUR"][-1]])
+
+	def edgeTimes(self, after, before):
+		"""Returns the times of the sync edges in the interval (after, before]"""
+
+		if self.syncOnTime is None: return np.zeros(0)
+		freq = self.syncFreq()
+		first = max(0, int(np.floor((after - self.syncOnTime) * freq)) + 1)
+		last = int(np.floor((before - self.syncOnTime) * freq))
+		return self.syncOnTime + np.arange(first, last + 1) / freq
+##################################################################################################
+class SimSR830(SimInstrument):
+	def __init__(self, resourceManager, x=1e-3, y=0., noise=1e-5, bufferSize=16383):
+		SimInstrument.__init__(self, "Stanford_Research_Systems,SR830,SIM,0.0", ";", {"SRAT": "4", "OFLT": "10", "OFSL": "1", "SENS": "26", "TSTR": "0", "SEND": "0", "FREQ": "1000"})
+		self.resourceManager = resourceManager
+		self.noise = noise
+		self.bufferSize = bufferSize
+		self.rng = np.random.default_rng()
+
+		# Output filter: settles exponentially from (x0, y0) to (x, y) with the time constant
+		self.x, self.y = x, y
+		self.x0, self.y0 = x, y
+		self.signalTime = time.time()
+
+		# Data buffer
+		self.armed = False			# Waiting for a trigger to start storage
+		self.armTime = 0.			# Time at which the trigger was armed
+		self.storeStart = None		# Time at which the running storage started
+		self.numStored = 0			# Points stored in the buffer
+		self.resetBuffer()
+
+	def setSignal(self, x, y):
+		"""Steps the input signal to (x, y) in (Volt); the outputs follow with the time constant"""
+
+		self.x0, self.y0 = self.output(time.time())
+		self.x, self.y = x, y
+		self.signalTime = time.time()
+
+	def output(self, t):
+		"""Returns the noiseless filtered outputs at time t"""
+
+		tau = 10 ** (int(self.settings["OFLT"]) // 2 - 5) * (1 if int(self.settings["OFLT"]) % 2 == 0 else 3)
+		decay = np.exp(-(t - self.signalTime) / tau)
+		return self.x + (self.x0 - self.x) * decay, self.y + (self.y0 - self.y) * decay
+
+	def resetBuffer(self):
+		self.bufferX = np.zeros(self.bufferSize, dtype='<f4')
+		self.bufferY = np.zeros(self.bufferSize, dtype='<f4')
+		self.numStored = 0
+		self.storeStart = None
+
+	def sampleTimes(self, now):
+		"""Returns the times of the points stored by the running storage up to now"""
+
+		if self.storeStart is None: return np.zeros(0)
+		if int(self.settings["SRAT"]) == 14:
+			return self.resourceManager.fnGen.edgeTimes(self.storeStart, now)
+		rate = 2. ** (int(self.settings["SRAT"]) - 4)
+		return self.storeStart + np.arange(int((now - self.storeStart) * rate) + 1) / rate
+
+	def update(self):
+		"""Advances the trigger state and the data buffer to the present time"""
+
+		now = time.time()
+		fnGen = self.resourceManager.fnGen
+		if self.armed and fnGen is not None:
+			edges = fnGen.edgeTimes(self.armTime, now)
+			if len(edges):
+				self.armed = False
+				self.storeStart = edges[0] - 0.5 / fnGen.syncFreq()
+		times = self.sampleTimes(now)[:self.bufferSize - self.numStored]
+		if len(times):
+			x, y = self.output(times)
+			self.bufferX[self.numStored:self.numStored + len(times)] = x + self.noise * self.rng.standard_normal(len(times))
+			self.bufferY[self.numStored:self.numStored + len(times)] = y + self.noise * self.rng.standard_normal(len(times))
+			self.numStored += len(times)
+			if int(self.settings["SRAT"]) == 14:
+				self.storeStart = times[-1] + 0.5 / fnGen.syncFreq()
+			else:
+				self.storeStart = times[-1] + 2. ** (4 - int(self.settings["SRAT"]))
+		if self.numStored >= self.bufferSize and self.settings["SEND"] == "0": self.storeStart = None
+
+	def execute(self, cmd):
+		self.update()
+		name, _, args = cmd.partition(" ")
+		if name == "STRT":
+			if self.settings["TSTR"] == "1":
+				self.armed, self.armTime = True, time.time()
+			elif self.storeStart is None:
+				self.storeStart = time.time()
+		elif name == "PAUS":
+			self.storeStart = None
+			self.armed = False
+		elif name == "REST":
+			self.resetBuffer()
+			self.armed = self.settings["TSTR"] == "1"
+			self.armTime = time.time()
+		elif name == "SPTS?":
+			return str(self.numStored)
+		elif name == "TRCB?":
+			chan, start, numPts = [int(arg) for arg in args.split(",")]
+			buffer = self.bufferX if chan == 1 else self.bufferY
+			return buffer[start:start + numPts].tobytes()
+		elif name == "TRCL?":
+			chan, start, numPts = [int(arg) for arg in args.split(",")]
+			buffer = self.bufferX if chan == 1 else self.bufferY
+			mantissa, exponent = np.frexp(buffer[start:start + numPts].astype(float))
+			pairs = np.zeros((numPts, 2), dtype='<i2')
+			pairs[:, 0] = np.clip(np.round(mantissa * 2 ** 15), -32768, 32767)
+			pairs[:, 1] = exponent - 15 + 124
+			return pairs.tobytes()
+		elif name == "LIAS?":
+			# Output overload when the magnitude exceeds full scale
+			index = int(self.settings["SENS"])
+			sense = [2., 5., 10.][index % 3] * 10. ** (index // 3 - 9)
+			return "4" if np.hypot(*self.output(time.time())) > sense else "0"
+		elif name == "SNAP?":
+			x, y = self.output(time.time())
+			x += self.noise * self.rng.standard_normal()
+			y += self.noise * self.rng.standard_normal()
+			values = {1: x, 2: y, 3: np.hypot(x, y), 4: np.degrees(np.arctan2(y, x)), 9: float(self.settings["FREQ"])}
+			return ",".join("%e" % values.get(int(arg), 0.) for arg in args.split(","))
+		elif name in ["DDEF", "AUXV", "DDEF?", "AUXV?"]:
+			# Settings indexed by channel
+			chan, _, values = args.partition(",")
+			if name.endswith("?"): return self.settings.get("%s %s" % (name[:-1], chan), "0")
+			self.settings["%s %s" % (name, chan)] = values
+		else:
+			return SimInstrument.execute(self, cmd)
+##################################################################################################
+class SimIPS12010(SimInstrument):
+	def __init__(self, persistentCurrent=0.):
+		SimInstrument.__init__(self, "IPS120-10 Version 3.07 (c) OXFORD 1996 SIM", "\r", {"I": "0", "S": "1", "A": "0", "H": "0", "C": "0", "Q": "0"})
+		self.outputCurrent = 0.				# Output current in (Amp) at outputTime
+		self.outputTime = time.time()
+		self.persistentCurrent = persistentCurrent
+
+	def target(self):
+		"""Returns the current in (Amp) towards which the output is ramping, None when holding"""
+
+		activity = self.settings["A"]
+		if activity == "1": return float(self.settings["I"])
+		if activity == "2": return 0.
+		return None
+
+	def update(self):
+		"""Advances the output current at the sweep rate; the magnet follows it while the switch heater is on"""
+
+		now = time.time()
+		target = self.target()
+		if target is not None:
+			step = float(self.settings["S"]) / 60. * (now - self.outputTime)
+			self.outputCurrent = target if abs(target - self.outputCurrent) <= step else self.outputCurrent + step * np.sign(target - self.outputCurrent)
+		self.outputTime = now
+		if self.settings["H"] == "1": self.persistentCurrent = self.outputCurrent
+
+	def execute(self, cmd):
+		self.update()
+		if cmd.startswith("$"):
+			# $-prefixed commands: one letter followed by the argument, without a reply
+			self.settings[cmd[1]] = cmd[2:]
+			return None
+		if cmd == "X":
+			sweeping = self.target() is not None and self.outputCurrent != self.target()
+			return "X00A%sC%sH%sM0%dP00" % (self.settings["A"], self.settings["C"], self.settings["H"], sweeping)
+		if cmd.startswith("R "):
+			values = {2: self.outputCurrent, 5: float(self.settings["I"]), 6: float(self.settings["S"]), 7: self.outputCurrent * 0.10411, 16: self.persistentCurrent}
+			return "%.4f" % values[int(cmd[2:])]
+		return SimInstrument.execute(self, cmd)
+##################################################################################################
@@ -1,25 +1,73 @@
 # Chris Tang
 # sr830.py
 
-import visa
+import instrument
+import time
 import numpy as np
 
 ##################################################################################################
-class SR830():
-	def __init__(self, port):
-		self.port = port
-		self.inst = visa.ResourceManager().open_resource(port)
-
-		self.inst.write("LOCL 1")		# Set remote and unlocked
-		self.inst.write("OUTX 1")		# Output to GPIB 
-		self.inst.write("SEND 0")		# 1-shot buffer mode
-		self.inst.write("TSTR 0")		# Turn off trigger-start feature
-		self.inst.write("DDEF 1,0,0")	# Set Channel 1 to display X
-		self.inst.write("DDEF 2,0,0")	# Set Channel 2 to display Y
+# Number of points the data buffer can hold on each display channel
+BUFFER_SIZE = 16383
+# Sample rate index for sampling on each edge at the rear-panel trigger input
+TRIGGER_SAMPLE_RATE_INDEX = 14
+# Internal sample rate index (512 Hz) restored after a triggered run if the lock-in was already sampling on the trigger input
+DEFAULT_SAMPLE_RATE_INDEX = 13
+# Equivalent noise bandwidth of the low-pass filter in units of (1 / time constant) for each slope in (dB/oct)
+LOW_PASS_FILTER_ENBW = {6: 1/4, 12: 1/8, 18: 3/32, 24: 5/64}
+# Time for the outputs to settle to 99% of a step in units of (time constant) for each slope in (dB/oct)
+LOW_PASS_FILTER_SETTLE_TIME = {6: 5, 12: 7, 18: 9, 24: 10}
+# Allowed sample rates in (Hz), indexed by programming index (0 -> 13)
+SAMPLE_RATES = 2. ** (np.arange(14) - 4)
+# Allowed time constants in (sec), indexed by programming index (0 -> 19): 10 us, 30 us, ..., 30 ks
+TIME_CONSTANTS = np.array([[1., 3.][index % 2] * 10. ** (index // 2 - 5) for index in range(20)])
+# Allowed sensitivities in (V), indexed by programming index (0 -> 26): 2 nV, 5 nV, 10 nV, ..., 1 V
+SENSITIVITIES = np.array([[2., 5., 10.][index % 3] * 10. ** (index // 3 - 9) for index in range(27)])
+for table in [SAMPLE_RATES, TIME_CONSTANTS, SENSITIVITIES]: table.flags.writeable = False
+# Autorange: a range is kept while the magnitude stays between LOW and HIGH fractions of full scale;
+# otherwise the most sensitive range keeping the magnitude below HIGH of full scale is selected,
+# which puts it above HIGH / 2.5 (the largest step between ranges) > LOW of full scale
+AUTORANGE_LOW = 0.25
+AUTORANGE_HIGH = 0.9
+# Time to wait in units of (time constant) after a range change before reading the magnitude again
+AUTORANGE_SETTLE_TIME_CONSTANTS = 3
+# Bits of the LIA status byte (LIAS?) flagging input, filter and output overloads
+OVERLOAD_STATUS_BITS = 0b111
+# SNAP? codes of the quantities that can be read together in one snapshot (at most 6 at a time)
+SNAPSHOT_PARAMETERS = {"x": 1, "y": 2, "r": 3, "theta": 4, "aux1": 5, "aux2": 6, "aux3": 7, "aux4": 8, "freq": 9, "ch1": 10, "ch2": 11}
+##################################################################################################
+class SR830(instrument.Instrument):
+	BATCH_SEPARATOR = ";"
+	BATCH_CONFIRM_QUERY = "*STB?"
+	BATCH_MAX_LENGTH = 256			# Size of the SR 830 input queue
+
+	def __init__(self, port, resourceManager=None, useCache=False):
+		instrument.Instrument.__init__(self, port, resourceManager, useCache)
+
+		with self.batch():
+			self.writeSetting("LOCL", "LOCL 1")			# Set remote and unlocked
+			self.writeSetting("OUTX", "OUTX 1")			# Output to GPIB 
+			self.writeSetting("SEND", "SEND 0")			# 1-shot buffer mode
+			self.writeSetting("TSTR", "TSTR 0")			# Turn off trigger-start feature
+			self.writeSetting("DDEF 1", "DDEF 1,0,0")	# Set Channel 1 to display X
+			self.writeSetting("DDEF 2", "DDEF 2,0,0")	# Set Channel 2 to display Y
+
+		self.bufferPool = None			# Reused by readDataBuffers(), allocated on first use
 
 		# Optional printing
 		print("\nConnecting SR 830 through address:\n%s" % port)
-		print("Querying IDN:\n%s" % self.inst.query("*IDN?"))
+		print("Querying IDN:\n%s" % self.query("*IDN?"))
+	######################################################################################
+	def resyncCache(self, printSwitch=True):
+		"""Rebuilds the setting cache by reading the settings back from the lock-in"""
+
+		self.invalidateCache()
+		for key in ["OUTX", "SEND", "TSTR", "IRSC", "IGND", "ICPL", "FMOD", "SENS", "RMOD", "OFLT", "OFSL", "SRAT"]:
+			self.settingCache[key] = "%s %d" % (key, int(self.query("%s?" % key)))
+		for chan in [1, 2]:
+			self.settingCache["DDEF %d" % chan] = "DDEF %d,%s" % (chan, self.query("DDEF? %d" % chan).strip())
+		for chan in [1, 2, 3, 4]:
+			self.settingCache["AUXV %d" % chan] = "AUXV %d,%f" % (chan, float(self.query("AUXV? %d" % chan)))
+		if printSwitch: print("SR 830: Setting cache resynced from instrument")
 	######################################################################################
 	def setInputMode(self, mode, printSwitch=True):
 		"""Sets the input mode to single-ended (A) or differential (A-B)
@@ -31,10 +79,10 @@ class SR830():
 		"""
 
 		if mode == "single":
-			self.inst.write("IRSC 0")
+			self.writeSetting("IRSC", "IRSC 0")
 			if printSwitch: print("SR 830: Input mode: SINGLE-ENDED")
 		elif mode == "differential":
-			self.inst.write("IRSC 1")
+			self.writeSetting("IRSC", "IRSC 1")
 			if printSwitch: print("SR 830: Input mode: DIFFERENTIAL")
 		else:
 			raise ValueError("Invalid mode passed to sr830.setInputMode()")
@@ -47,10 +95,10 @@ class SR830():
 		"""
 
 		if state:
-			self.inst.write("IGND 1")
+			self.writeSetting("IGND", "IGND 1")
 			if printSwitch: print("SR 830: Input shield: GROUNDED")
 		else:
-			self.inst.write("IGND 0")
+			self.writeSetting("IGND", "IGND 0")
 			if printSwitch: print("SR 830: Input shield: GROUNDED")
 		
 	def setInputCoupling(self, coupling, printSwitch=True):
@@ -61,10 +109,10 @@ class SR830():
 		"""
 
 		if coupling == "ac":
-			self.inst.write("ICPL 0")
+			self.writeSetting("ICPL", "ICPL 0")
 			if printSwitch: print("SR 830: Input coupling: AC")
 		elif coupling == "dc":
-			self.inst.write("ICPL 1")
+			self.writeSetting("ICPL", "ICPL 1")
 			if printSwitch: print("SR 830: Input coupling: DC")
 		else:
 			raise ValueError("Invalid coupling passed to sr830.setInputCoupling()")
@@ -77,7 +125,7 @@ class SR830():
 			volt: desired voltage to output
 		"""
 
-		self.inst.write("AUXV %d,%f" % (chan, volt))
+		self.writeSetting("AUXV %d" % chan, "AUXV %d,%f" % (chan, volt))
 		if printSwitch: print("SR 830: Aux channel %d outputting: %e V" % (chan, volt))
 
 	def setReferenceSource(self, source, printSwitch=True):
@@ -90,10 +138,10 @@ class SR830():
 		"""
 
 		if source == "ext":
-			self.inst.write("FMOD 0")
+			self.writeSetting("FMOD", "FMOD 0")
 			if printSwitch: print("SR 830: Reference source: EXTERNAL")
 		elif source == "int":
-			self.inst.write("FMOD 1")
+			self.writeSetting("FMOD", "FMOD 1")
 			if printSwitch: print("SR 830: Reference source: INTERNAL")
 		else:
 			raise ValueError("Invalid source passed to sr830.setReferenceSource()")
@@ -106,9 +154,45 @@ class SR830():
 			sense: desired sensitivity in (V)
 		"""
 
-		senseIndex = sensitivityToIndex(sense)
-		self.inst.write("SENS %d" % senseIndex)
-		if printSwitch: print("SR 830: Sensitivity set to: %e uV" % 1e6*indexToSensitivity(senseIndex))
+		senseIndex, sense = nearestSensitivity(sense)
+		self.writeSetting("SENS", "SENS %d" % senseIndex)
+		if printSwitch: print("SR 830: Sensitivity set to: %e uV" % (1e6 * sense))
+
+	def autoRange(self, maxSteps=10, printSwitch=True):
+		"""Selects the sensitivity from the measured magnitude instead of the slow AGAN command
+		Jumps straight to the most sensitive range that keeps R below AUTORANGE_HIGH of full scale, going up a
+		decade whenever an overload is flagged, and returns once the range is confirmed
+
+		Arguments:
+			maxSteps: largest number of range changes to try
+		Return Values:
+			sense: selected sensitivity in (V)
+		"""
+
+		index = int(self.query("SENS?"))
+		tau = self.getTimeConstant(printSwitch=False)
+		self.query("LIAS?")			# Reading the status byte clears latched overloads
+		for step in range(maxSteps + 1):
+			r = self.readSnapshotParams(("r",), printSwitch=False)["r"]
+			overloaded = int(self.query("LIAS?")) & OVERLOAD_STATUS_BITS
+			sense = SENSITIVITIES[index]
+			targetIndex = min(int(np.searchsorted(SENSITIVITIES, r / AUTORANGE_HIGH)), len(SENSITIVITIES) - 1)
+			if overloaded:
+				# The magnitude read while overloaded is clipped, so go up at least a decade
+				newIndex = min(max(index + 3, targetIndex), len(SENSITIVITIES) - 1)
+			elif r > AUTORANGE_HIGH * sense or r < AUTORANGE_LOW * sense:
+				newIndex = targetIndex
+			else:
+				break
+			if newIndex == index or step == maxSteps: break
+			index = newIndex
+			self.writeSetting("SENS", "SENS %d" % index)
+			time.sleep(AUTORANGE_SETTLE_TIME_CONSTANTS * tau)
+			self.query("LIAS?")
+
+		sense = indexToSensitivity(index)
+		if printSwitch: print("SR 830: Autoranged sensitivity to: %e uV" % (1e6 * sense))
+		return sense
 
 	def setReserve(self, mode, printSwitch=True):
 		"""Sets the reserve mode to high/normal/low noise
@@ -118,13 +202,13 @@ class SR830():
 		"""
 
 		if mode == "high":
-			self.inst.write("RMOD 0")
+			self.writeSetting("RMOD", "RMOD 0")
 			if printSwitch: print("SR 830: Reserve mode set to: HIGH")
-		if mode == "normal":
-			self.inst.write("RMOD 1")
+		elif mode == "normal":
+			self.writeSetting("RMOD", "RMOD 1")
 			if printSwitch: print("SR 830: Reserve mode set to: NORMAL")
-		if mode == "low":
-			self.inst.write("RMOD 2")
+		elif mode == "low":
+			self.writeSetting("RMOD", "RMOD 2")
 			if printSwitch: print("SR 830: Reserve mode set to: LOW NOISE")
 		else:
 			raise ValueError("Invalid mode passed to sr830.setReserve()")
@@ -137,9 +221,9 @@ class SR830():
 			tau: time constant in (sec)
 		"""
 
-		tauIndex = timeConstantToIndex(tau)
-		self.inst.write("OFLT %d" % tauIndex)
-		if printSwitch: print("SR 830: Sensitivity set to: %e sec" % indexToTimeConstant(tauIndex))
+		tauIndex, tau = nearestTimeConstant(tau)
+		self.writeSetting("OFLT", "OFLT %d" % tauIndex)
+		if printSwitch: print("SR 830: Time constant set to: %e sec" % tau)
 
 	def setLowPassFilterSlope(self, slope, printSwitch=True):
 		"""Sets the slope of the low-pass filter in (dB/oct)
@@ -149,15 +233,38 @@ class SR830():
 		"""
 
 		if slope in [6,12,18,24]:
-			self.inst.write("OFSL %d" % (slope // 6 - 1))
+			self.writeSetting("OFSL", "OFSL %d" % (slope // 6 - 1))
 			if printSwitch: print("SR 830: Low-Pass Filter Slope: %d dB/oct" % slope)
 		else:
 			raise ValueError("Invalid slope passed to sr830.setLowPassFilterSlope()")
 	
+	def getTimeConstant(self, printSwitch=True):
+		"""Reads the time constant
+
+		Return Values:
+			tau: current time constant in (sec)
+		"""
+
+		tau = indexToTimeConstant(int(self.query("OFLT?")))
+		if printSwitch: print("SR 830: Time constant is currently: %e sec" % tau)
+		return tau
+
+	def getLowPassFilterSlope(self, printSwitch=True):
+		"""Reads the slope of the low-pass filter
+
+		Return Values:
+			slope: current slope (6,12,18,24) of low-pass filter in (dB/oct)
+		"""
+
+		slope = 6 * (int(self.query("OFSL?")) + 1)
+		if printSwitch: print("SR 830: Low-Pass Filter Slope is currently: %d dB/oct" % slope)
+		return slope
+
 	def setAutoGain(self, printSwitch=True):
 		"""Turns on the auto-gain function"""
 
-		self.inst.write("AGAN")
+		self.write("AGAN")
+		self.invalidateCache("SENS")
 		if printSwitch: print("SR 830: Auto-Gain turned ON")
 	
 	def setSampleRate(self, rate, printSwitch=True):
@@ -168,37 +275,85 @@ class SR830():
 			rate: sample rate in (Hz)
 		"""
 
-		sampleIndex = sampleRateToIndex(rate)
-		self.inst.write("SRAT %d" % sampleIndex)
-		if printSwitch: print("SR 830: Sample rate set to: %.4f Hz" % indexToSampleRate(sampleIndex))
+		sampleIndex, rate = nearestSampleRate(rate)
+		self.writeSetting("SRAT", "SRAT %d" % sampleIndex)
+		if printSwitch: print("SR 830: Sample rate set to: %.4f Hz" % rate)
 
 	def getSampleRate(self, printSwitch=True):
 		"""Reads the sample rate
 
 		Return Values:
-			rate: current sample rate in (Hz)
+			rate: current sample rate in (Hz), None if sampling on the trigger input
 		"""
 
-		rate = indexToSampleRate(int(self.inst.query("SRAT?")))
+		index = int(self.query("SRAT?"))
+		if index == TRIGGER_SAMPLE_RATE_INDEX:
+			if printSwitch: print("SR 830: Sample Rate is currently: TRIGGER")
+			return None
+		rate = indexToSampleRate(index)
 		if printSwitch: print("SR 830: Sample Rate is currently: %e Hz" % rate)
 		return rate
 
+	def setTriggerStart(self, state, printSwitch=True):
+		"""Turns the trigger-start feature on (True) or off (False)
+		When on, storage is started by a rising edge at the rear-panel trigger input
+
+		Arguments:
+			state: determines whether a trigger starts storage (True) or not (False)
+		"""
+
+		if state:
+			self.writeSetting("TSTR", "TSTR 1")
+			if printSwitch: print("SR 830: Trigger-start: ON")
+		else:
+			self.writeSetting("TSTR", "TSTR 0")
+			if printSwitch: print("SR 830: Trigger-start: OFF")
+
+	def armTriggeredStorage(self, printSwitch=True):
+		"""Arms the buffer to start on the next trigger edge and to store one point per edge
+
+		Return Values:
+			index: sample rate index before arming, to pass to disarmTriggeredStorage()
+		"""
+
+		index = int(self.query("SRAT?"))
+		self.stopDataStorage(printSwitch=False)
+		self.writeSetting("SRAT", "SRAT %d" % TRIGGER_SAMPLE_RATE_INDEX)
+		self.setTriggerStart(True, printSwitch=False)
+		self.resetDataBuffer(printSwitch=False)
+		if printSwitch: print("SR 830: Data storage armed, waiting for trigger.")
+		return index
+
+	def disarmTriggeredStorage(self, index, printSwitch=True):
+		"""Pauses storage, turns off trigger-start and restores the internal sample rate
+
+		Arguments:
+			index: sr 830 sample rate index to restore (0 -> 13); DEFAULT_SAMPLE_RATE_INDEX is restored instead
+				of TRIGGER_SAMPLE_RATE_INDEX, left behind by an earlier run that was never disarmed
+		"""
+
+		if index == TRIGGER_SAMPLE_RATE_INDEX: index = DEFAULT_SAMPLE_RATE_INDEX
+		self.stopDataStorage(printSwitch=False)
+		self.setTriggerStart(False, printSwitch=False)
+		self.writeSetting("SRAT", "SRAT %d" % index)
+		if printSwitch: print("SR 830: Data storage disarmed, sample rate set to: %.4f Hz" % indexToSampleRate(index))
+
 	def startDataStorage(self, printSwitch=True):
 		"""Starts data storage"""
 
-		self.inst.write("STRT")
+		self.write("STRT")
 		if printSwitch: print("SR 830: Data storage started.")
 
 	def stopDataStorage(self, printSwitch=True):
 		"""Pauses data storage"""
 
-		self.inst.write("PAUS")
+		self.write("PAUS")
 		if printSwitch: print("SR 830: Data storage paused.")
 
 	def resetDataBuffer(self, printSwitch=True):
 		"""Resets the data buffer"""
 
-		self.inst.write("REST")
+		self.write("REST")
 		if printSwitch: print("SR 830: Data buffer reset.")
 
 	def readSnapshot(self, printSwitch=True):
@@ -209,12 +364,53 @@ class SR830():
 			y: out-of-phase amplitude in (Volt)
 		"""
 
-		valList = self.inst.query("SNAP? 1,2")
+		valList = self.query("SNAP? 1,2").split(",")
 		x = float(valList[0])
 		y = float(valList[1])
 		if printSwitch: print("SR 830: Reading instantaneous measurement\nX: %e V\nY: %e V" % (x, y))
 		return x, y
 
+	def readSnapshotParams(self, params=("x", "y"), printSwitch=True):
+		"""Reads up to six quantities at the same instant with one SNAP? query
+
+		Arguments:
+			params: names of the quantities to read, keys of SNAPSHOT_PARAMETERS
+				x, y, r: amplitudes in (Volt)
+				theta: phase in (Deg)
+				aux1 -> aux4: aux input voltages in (Volt)
+				freq: reference frequency in (Hz)
+				ch1, ch2: display channel values
+		Return Values:
+			snapshot: numpy record with one field per quantity
+		"""
+
+		values = np.array(self.query(snapshotQuery(params)).split(","), dtype=float)[:len(params)]
+		snapshot = np.array(tuple(values), dtype=snapshotDtype(params))[()]
+		if printSwitch: print("SR 830: Reading instantaneous measurement\n" + "\n".join("%s: %e" % (param, snapshot[param]) for param in params))
+		return snapshot
+
+	def sampleSnapshots(self, numSamples, params=("x", "y"), out=None, printSwitch=True):
+		"""Reads snapshots back to back into a structured array, for polling at the highest rate
+
+		Arguments:
+			numSamples: number of snapshots to read
+			params: names of the quantities to read, keys of SNAPSHOT_PARAMETERS
+			out: optional preallocated array of dtype snapshotDtype(params, timeStamps=True), reused between calls
+		Return Values:
+			samples: structured array with field "t" (time of each query in (sec) from the first) and one field per quantity
+		"""
+
+		dtype = snapshotDtype(params, timeStamps=True)
+		if out is None: out = np.zeros(numSamples, dtype=dtype)
+		if out.dtype != dtype or len(out) < numSamples: raise ValueError("Invalid out array passed to sr830.sampleSnapshots()")
+		query = snapshotQuery(params)
+		if printSwitch: print("SR 830: Reading %d snapshots of %s" % (numSamples, ", ".join(params)))
+		startTime = time.time()
+		for i in range(numSamples):
+			t = time.time() - startTime
+			out[i] = (t,) + tuple(np.array(self.query(query).split(","), dtype=float)[:len(params)])
+		return out[:numSamples]
+
 	def readDataBuffer(self, chan, printSwitch=True):
 		"""Reads the buffer of a given display channel
 
@@ -226,10 +422,75 @@ class SR830():
 
 		if chan != 1 and chan != 2: raise ValueError("Invalid channel passed to sr830.readBuffer()")
 		if printSwitch: print("SR 830: Reading buffer on display channel %d" % chan)
-		numDataPts = int(self.inst.query("SPTS?"))
-		self.inst.write("TRCB? %d,%d,%d" % (chan, 0, numDataPts))
-		data = np.fromstring(self.inst.read_raw(), dtype='<f4')
-		return data
+		return self.readDataBufferRange(chan, 0, self.getNumStoredPoints())
+
+	def readDataBufferRange(self, chan, start, numPts, printSwitch=False):
+		"""Reads numPts points, beginning at point start, from the buffer of a given display channel
+		Can be called while storage is running to read out the points stored so far
+
+		Arguments:
+			chan: channel to read (1=x, 2=y)
+			start: index of the first point to read
+			numPts: number of points to read
+		Return Values:
+			arr: array of 4-byte IEEE binary floating point numbers
+		"""
+
+		if chan != 1 and chan != 2: raise ValueError("Invalid channel passed to sr830.readDataBufferRange()")
+		if numPts <= 0: return np.zeros(0, dtype='<f4')
+		if printSwitch: print("SR 830: Reading points %d -> %d on display channel %d" % (start, start + numPts - 1, chan))
+		self.flushBatch(confirm=False)
+		self.inst.write("TRCB? %d,%d,%d" % (chan, start, numPts))
+		# frombuffer() views the immutable reply, copy it so that callers get a writable array as before
+		return np.frombuffer(self.inst.read_raw(), dtype='<f4').copy()
+
+	def readDataBuffers(self, start=0, numPts=None, out=None, fmt="ieee", printSwitch=True):
+		"""Reads the buffers of both display channels in one transaction
+		Unless out is given, the points are read into a buffer owned by this instance that is
+		overwritten by the next call, so copy them to keep them across calls
+
+		Arguments:
+			start: index of the first point to read
+			numPts: number of points to read, defaults to all stored points from start
+			out: optional float32 array of shape (2, >= numPts) to read into
+			fmt: transfer format
+				"ieee": 4-byte IEEE floats (TRCB?)
+				"lia": 4-byte non-IEEE mantissa/exponent pairs converted by the lock-in faster (TRCL?)
+		Return Values:
+			x: in-phase amplitude array (display channel 1) with units of (Volt)
+			y: out-of-phase amplitude array (display channel 2) with units of (Volt)
+		"""
+
+		if fmt not in ["ieee", "lia"]: raise ValueError("Invalid fmt passed to sr830.readDataBuffers()")
+		if numPts is None: numPts = self.getNumStoredPoints() - start
+		if out is None:
+			if self.bufferPool is None: self.bufferPool = np.empty((2, BUFFER_SIZE), dtype='<f4')
+			out = self.bufferPool
+		if out.dtype != np.float32 or out.shape[0] != 2 or out.shape[1] < numPts: raise ValueError("Invalid out array passed to sr830.readDataBuffers()")
+		if numPts <= 0: return out[0, :0], out[1, :0]
+		if printSwitch: print("SR 830: Reading points %d -> %d on both display channels" % (start, start + numPts - 1))
+
+		cmd = "TRCB?" if fmt == "ieee" else "TRCL?"
+		self.flushBatch(confirm=False)
+		self.inst.write("%s 1,%d,%d;%s 2,%d,%d" % (cmd, start, numPts, cmd, start, numPts))
+		raw = np.frombuffer(self.inst.read_bytes(8 * numPts), dtype='<f4' if fmt == "ieee" else '<i2')
+		if fmt == "ieee":
+			out[:, :numPts] = raw.reshape(2, numPts)
+		else:
+			pairs = raw.reshape(2, numPts, 2)
+			np.ldexp(pairs[:, :, 0], pairs[:, :, 1] - 124, out=out[:, :numPts], casting='unsafe')
+		return out[0, :numPts], out[1, :numPts]
+
+	def getNumStoredPoints(self, printSwitch=False):
+		"""Reads the number of points currently stored in the data buffer
+
+		Return Values:
+			numPts: number of points stored on each display channel
+		"""
+
+		numPts = int(self.query("SPTS?"))
+		if printSwitch: print("SR 830: %d points stored in data buffer" % numPts)
+		return numPts
 
 	######################################################################################
 	######################################################################################
@@ -243,9 +504,73 @@ class SR830():
 	######################################################################################
 
 ##################################################################################################
+def snapshotQuery(params):
+	"""Returns the SNAP? query string for a list of quantity names
+
+	Arguments:
+		params: names of the quantities (1 -> 6 of them), keys of SNAPSHOT_PARAMETERS
+	Return Values:
+		query: SNAP? query string
+	"""
+
+	if len(params) < 1 or len(params) > 6 or len(set(params)) != len(params): raise ValueError("Invalid number of params passed to sr830.snapshotQuery()")
+	for param in params:
+		if param not in SNAPSHOT_PARAMETERS: raise ValueError("Invalid param passed to sr830.snapshotQuery(): %s" % param)
+	# SNAP? needs at least two parameters, so a single quantity is read twice
+	codes = [SNAPSHOT_PARAMETERS[param] for param in params]
+	if len(codes) == 1: codes = codes * 2
+	return "SNAP? " + ",".join("%d" % code for code in codes)
+
+def snapshotDtype(params, timeStamps=False):
+	"""Returns the numpy dtype of a snapshot of the given quantities
+
+	Arguments:
+		params: names of the quantities, keys of SNAPSHOT_PARAMETERS
+		timeStamps: prepends a time field "t" if True
+	Return Values:
+		dtype: structured numpy dtype with one float field per quantity
+	"""
+
+	return np.dtype(([("t", "f8")] if timeStamps else []) + [(param, "f8") for param in params])
+##################################################################################################
+def nearestIndex(table, value):
+	"""Finds the entry of a sorted table nearest to value with a binary search
+
+	Arguments:
+		table: sorted array of allowed values
+		value: scalar or array of desired values
+	Return Values:
+		index: index (or array of indices) of the nearest table entries
+	"""
+
+	value = np.asarray(value, dtype=float)
+	upper = np.clip(np.searchsorted(table, value), 1, len(table) - 1)
+	lower = upper - 1
+	index = np.where(value - table[lower] <= table[upper] - value, lower, upper)
+	return int(index) if index.ndim == 0 else index
+
+def tableValue(table, index, funcName):
+	"""Looks up the table entries at a scalar or array index, checking that every index is valid
+
+	Arguments:
+		table: array of allowed values
+		index: scalar or array of indices
+		funcName: name of the calling function for error messages
+	Return Values:
+		value: table entry (or array of entries)
+	"""
+
+	index = np.asarray(index)
+	if index.dtype.kind not in "iu":
+		if index.dtype.kind != "f" or np.any(index != np.round(index)): raise ValueError("Invalid index passed to sr830.%s()" % funcName)
+		index = index.astype(int)
+	if np.any((index < 0) | (index >= len(table))): raise ValueError("Invalid index passed to sr830.%s()" % funcName)
+	value = table[index]
+	return float(value) if value.ndim == 0 else value
+##################################################################################################
 def indexToSampleRate(index):
-	"""Converts an index to the corresponding sample rate in (Hz)
-	Note, does not support external triggering as of yet (14)
+	"""Converts an index (or array of indices) to the corresponding sample rate in (Hz)
+	Note, sampling on the trigger input (14) has no fixed rate, see TRIGGER_SAMPLE_RATE_INDEX
 
 	Arguments:
 		index: sr 830 sample rate index (0 -> 13)
@@ -253,10 +578,7 @@ def indexToSampleRate(index):
 		rate: sample rate in (Hz)
 	"""
 
-	if index in np.arange(14):
-		return 2 ** (index - 4)
-	else:
-		raise ValueError("Invalid index passed to sr830.indexToSampleRate()")
+	return tableValue(SAMPLE_RATES, index, "indexToSampleRate")
 
 def sampleRateToIndex(rate):
 	"""Converts a sample rate in (Hz) to the corresponding programming index command
@@ -267,10 +589,23 @@ def sampleRateToIndex(rate):
 		index: sr 830 sample rate index
 	"""
 
-	return np.abs(np.array([indexToSampleRate(index) for index in np.arange(14)]) - rate).argmin()
+	return nearestIndex(SAMPLE_RATES, rate)
+
+def nearestSampleRate(rate):
+	"""Finds the allowed sample rate nearest to rate (scalar or array) in (Hz)
+
+	Arguments:
+		rate: sample rate in (Hz)
+	Return Values:
+		index: sr 830 sample rate index
+		rate: allowed sample rate in (Hz)
+	"""
+
+	index = nearestIndex(SAMPLE_RATES, rate)
+	return index, indexToSampleRate(index)
 ##################################################################################################
 def indexToTimeConstant(index):
-	"""Converts an index to the corresponding time constant in (sec)
+	"""Converts an index (or array of indices) to the corresponding time constant in (sec)
 
 	Arguments:
 		index: sr 830 time constant int (0 -> 19)
@@ -278,11 +613,7 @@ def indexToTimeConstant(index):
 		tau: time constant in (sec)
 	"""
 
-	if index in np.arange(20):
-		if index % 2 == 0: return 1 * 10**(index // 2 - 5)
-		if index % 2 == 1: return 3 * 10**(index // 2 - 5)
-	else:
-		raise ValueError("Invalid index passed to sr830.indexTotimeConstant()")
+	return tableValue(TIME_CONSTANTS, index, "indexToTimeConstant")
 
 def timeConstantToIndex(tau):
 	"""Converts a time constant in (sec) to the corresponding programming index command
@@ -293,33 +624,83 @@ def timeConstantToIndex(tau):
 		index: sr 830 time constant index
 	"""
 
-	return np.abs(np.array([indexToTimeConstant(index) for index in np.arange(20)]) - tau).argmin()
+	return nearestIndex(TIME_CONSTANTS, tau)
+
+def nearestTimeConstant(tau):
+	"""Finds the allowed time constant nearest to tau (scalar or array) in (sec)
+
+	Arguments:
+		tau: time constant in (sec)
+	Return Values:
+		index: sr 830 time constant index
+		tau: allowed time constant in (sec)
+	"""
+
+	index = nearestIndex(TIME_CONSTANTS, tau)
+	return index, indexToTimeConstant(index)
+
+def correlationTime(tau, slope):
+	"""Returns the integrated autocorrelation time in (sec) of the low-pass filtered outputs
+	For white input noise this is 1 / (2 * equivalent noise bandwidth) of the output filter,
+	so a record of length T holds about T / correlationTime independent samples
+
+	Arguments:
+		tau: time constant in (sec)
+		slope: slope (6,12,18,24) of low-pass filter in (dB/oct)
+	Return Values:
+		tauCorr: integrated autocorrelation time in (sec)
+	"""
+
+	if slope not in LOW_PASS_FILTER_ENBW: raise ValueError("Invalid slope passed to sr830.correlationTime()")
+	return 1 / (2 * LOW_PASS_FILTER_ENBW[slope] / tau)
+
+def settleTime(tau, slope):
+	"""Returns the time in (sec) for the outputs to settle to 99% of a step at the input
+
+	Arguments:
+		tau: time constant in (sec)
+		slope: slope (6,12,18,24) of low-pass filter in (dB/oct)
+	Return Values:
+		time: settling time in (sec)
+	"""
+
+	if slope not in LOW_PASS_FILTER_SETTLE_TIME: raise ValueError("Invalid slope passed to sr830.settleTime()")
+	return LOW_PASS_FILTER_SETTLE_TIME[slope] * tau
 ##################################################################################################
 def indexToSensitivity(index):
-	"""Converts a sensitivity switch index to a physical sensitivity in (V)
+	"""Converts a sensitivity switch index (or array of indices) to a physical sensitivity in (V)
 
 	Arguments:
 		index: sr 830 sensitivity index (0 -> 26)
 	Return Values:
 		sensitivity: physical sensitivity of the lock-in in (V)
 	"""
-	if index in np.arange(27):
-		if index % 3 == 0: return 2 * (10**(index // 3 - 9))
-		if index % 3 == 1: return 5 * (10**(index // 3 - 9))
-		if index % 3 == 2: return 10 * (10**(index // 3 - 9))
-	else:
-		raise ValueError("Invalid index passed to sr830.indexToSensitivity()")
+
+	return tableValue(SENSITIVITIES, index, "indexToSensitivity")
 
 def sensitivityToIndex(sense):
 	"""Takes a sensitivity in (V) and returns the corresponding programming index
 
 	Arguments:
-		sense: sensitivity in (V), needs a specific allowed value
+		sense: sensitivity in (V), finds the nearest allowed value
 	Return Values:
 		index: int that corresponds to the desired sensitivity
 	"""
 
-	return np.abs(np.array([indexToSensitivity(index) for index in np.arange(27)]) - sense).argmin()
+	return nearestIndex(SENSITIVITIES, sense)
+
+def nearestSensitivity(sense):
+	"""Finds the allowed sensitivity nearest to sense (scalar or array) in (V)
+
+	Arguments:
+		sense: sensitivity in (V)
+	Return Values:
+		index: sr 830 sensitivity index
+		sense: allowed sensitivity in (V)
+	"""
+
+	index = nearestIndex(SENSITIVITIES, sense)
+	return index, indexToSensitivity(index)
 ##################################################################################################
 # def checkValidAuxChan(chan):
 # 	"""Checks validity of auxiliary channel (1,2,3,4)"""
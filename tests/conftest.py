@@ -0,0 +1,45 @@
+# Chris Tang
+# conftest.py
+
+import os
+import sys
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fileio
+
+##################################################################################################
+@pytest.fixture
+def dataFolders(tmp_path, monkeypatch):
+	"""Points the data folders of fileio at a temporary directory"""
+
+	monkeypatch.setattr(fileio, "PROGRAM_HOME_FOLDER", str(tmp_path) + "/")
+	monkeypatch.setattr(fileio, "RAW_DATA_FOLDER", str(tmp_path) + "/Raw_Data/")
+	monkeypatch.setattr(fileio, "PROCESSED_DATA_FOLDER", str(tmp_path) + "/Processed_Data/")
+	monkeypatch.setattr(fileio, "RESULT_CACHE_FOLDER", str(tmp_path) + "/Result_Cache/")
+	os.makedirs(fileio.RAW_DATA_FOLDER)
+	return tmp_path
+
+@pytest.fixture
+def recordWrites():
+	"""Returns a function that records every message a driver sends to its VISA resource into a list"""
+
+	def record(driver):
+		messages = []
+		write = driver.inst.write
+		def recordingWrite(message):
+			messages.append(message)
+			write(message)
+		driver.inst.write = recordingWrite
+		return messages
+	return record
+
+@pytest.fixture
+def resourceManager():
+	"""Simulated VISA resource manager, see simVisa.py"""
+
+	import simVisa
+	return simVisa.SimResourceManager()
+##################################################################################################
@@ -0,0 +1,79 @@
+# Chris Tang
+# test_aggregate.py
+
+import numpy as np
+import pytest
+
+import aggregate
+import fileio
+
+##################################################################################################
+POINTS = [(202., 0.6e-4, 0.4, 3e-3), (202., 0.6e-4, 0.4, 1e-2), (101., 1e-4, 0.1, 3e-3)]
+
+def writeTrials(parameters, numTrials, rng):
+	"""Writes numTrials trials of random (t, x, y) rows, returning their arrays"""
+
+	trials = []
+	for i in range(numTrials):
+		arr = np.column_stack((np.arange(50) * 0.1, rng.normal(1e-3, 1e-4, 50), rng.normal(0., 1e-4, 50)))
+		np.savetxt(fileio.trialPath(*parameters), arr, delimiter=",")
+		trials.append(arr)
+	return trials
+
+def countFolds(monkeypatch):
+	folds = []
+	foldTrial = aggregate.foldTrial
+	def countingFoldTrial(point, trialNum, arr):
+		folds.append(trialNum)
+		foldTrial(point, trialNum, arr)
+	monkeypatch.setattr(aggregate, "foldTrial", countingFoldTrial)
+	return folds
+
+def assertMatches(summary, trials):
+	for record in summary:
+		key = (record["pumpFreq"], record["pumpAmp"], record["transverseField"], record["probeDeltaFreq"])
+		means = np.array([arr.mean(axis=0) for arr in trials[min(trials, key=lambda point: np.abs(np.subtract(point, key)).max())]])
+		assert record["numTrials"] == len(means)
+		np.testing.assert_allclose(record["mean"], means.mean(axis=0), rtol=1e-12, atol=1e-18)
+		np.testing.assert_allclose(record["std"], means.std(axis=0, ddof=1), rtol=1e-9, atol=1e-18)
+		np.testing.assert_allclose(record["sem"], means.std(axis=0, ddof=1) / np.sqrt(len(means)), rtol=1e-9, atol=1e-18)
+##################################################################################################
+def test_running_statistics_match_numpy(dataFolders, monkeypatch):
+	rng = np.random.default_rng(0)
+	trials = {point: writeTrials(point, numTrials, rng) for point, numTrials in zip(POINTS, [5, 3, 2])}
+	folds = countFolds(monkeypatch)
+
+	state = aggregate.updateAggregate(printSwitch=False)
+	assert len(folds) == 10
+	summary = aggregate.summaryTable(state)
+	assert len(summary) == 3
+	assert list(summary["numPts"]) == [100, 250, 150]
+	assertMatches(summary, trials)
+
+	# Nothing new: the saved state is reused and no trial is folded again
+	del folds[:]
+	state = aggregate.updateAggregate(printSwitch=False)
+	assert folds == []
+	assertMatches(aggregate.summaryTable(aggregate.loadState()), trials)
+
+	# One more trial folds in on its own
+	trials[POINTS[1]] += writeTrials(POINTS[1], 1, rng)
+	state = aggregate.updateAggregate(printSwitch=False)
+	assert folds == [3]
+	assertMatches(aggregate.summaryTable(state), trials)
+	assert state["points"][fileio.parametersToDir(*POINTS[1][:3]) + fileio.deltaFreqToStr(POINTS[1][3])]["folded"] == [[0, 3]]
+
+def test_single_trial_has_nan_std(dataFolders):
+	writeTrials(POINTS[0], 1, np.random.default_rng(0))
+	summary = aggregate.summaryTable(aggregate.updateAggregate(printSwitch=False))
+	assert np.isnan(summary["std"]).all() and np.isnan(summary["sem"]).all()
+
+def test_reserved_empty_trial_folded_later(dataFolders, monkeypatch):
+	path = fileio.trialPath(*POINTS[0])
+	folds = countFolds(monkeypatch)
+	assert aggregate.updateAggregate(printSwitch=False)["points"] == {}
+	np.savetxt(path, np.ones((4, 3)), delimiter=",")
+	state = aggregate.updateAggregate(printSwitch=False)
+	assert folds == [0]
+	assert aggregate.summaryTable(state)["mean"][0] == pytest.approx([1., 1., 1.])
+##################################################################################################
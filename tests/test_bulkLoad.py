@@ -0,0 +1,33 @@
+# Chris Tang
+# test_bulkLoad.py
+
+import numpy as np
+import pytest
+
+import fileio
+import bulkLoad
+
+##################################################################################################
+def writeTrial(probeDeltaFreq, arr):
+	path = fileio.trialPath(202., 0.6e-4, 0.4, probeDeltaFreq)
+	np.savetxt(path, arr, delimiter=",")
+	return path
+
+def test_parseTrialFile(dataFolders, tmp_path):
+	arr = np.random.default_rng(0).standard_normal((50, 3))
+	np.testing.assert_allclose(bulkLoad.parseTrialFile(writeTrial(3e-3, arr)), arr)
+	path = tmp_path / "empty.csv"
+	path.write_text("")
+	assert bulkLoad.parseTrialFile(str(path)).shape == (0, 0)
+	path.write_text("1,2\n3\n")
+	with pytest.raises(ValueError):
+		bulkLoad.parseTrialFile(str(path))
+
+def test_loadTrials_tags_rows(dataFolders):
+	paths = [writeTrial(3e-3, np.ones((4, 2))), writeTrial(5e-3, 2 * np.ones((6, 2)))]
+	trials, loadedPaths = bulkLoad.loadTrials(paths, numWorkers=1, printSwitch=False)
+	assert len(trials) == 10
+	assert trials["values"].shape == (10, 2)
+	np.testing.assert_allclose(trials["probeDeltaFreq"], [3e-3] * 4 + [5e-3] * 6)
+	np.testing.assert_array_equal(trials["row"][4:], np.arange(6))
+##################################################################################################
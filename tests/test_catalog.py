@@ -0,0 +1,112 @@
+# Chris Tang
+# test_catalog.py
+
+import os
+import shutil
+import pytest
+from contextlib import closing
+
+import catalog
+import fileio
+
+##################################################################################################
+PUMP_FREQ, PUMP_AMP = 202., 0.6e-4
+
+def writeTrial(path, numRows=3):
+	with open(path, "w") as trialFile:
+		for i in range(numRows):
+			trialFile.write("%f,%e,%e\n" % (i * 0.1, 1e-3, 0.))
+
+def newTrial(transverseField, probeDeltaFreq=3e-3, pumpFreq=PUMP_FREQ, pumpAmp=PUMP_AMP):
+	path = fileio.trialPath(pumpFreq, pumpAmp, transverseField, probeDeltaFreq)
+	writeTrial(path)
+	return path
+
+def cataloguedSizes():
+	with closing(catalog.connect()) as connection:
+		return dict(connection.execute("SELECT path, size FROM trials"))
+
+def cataloguedDirs():
+	with closing(catalog.connect()) as connection:
+		return sorted(dir for dir, in connection.execute("SELECT dir FROM dirs"))
+##################################################################################################
+def test_unchanged_directory_not_rescanned(dataFolders):
+	newTrial(0.4)
+	newTrial(0.1)
+	assert catalog.updateCatalog() == 2
+	assert catalog.updateCatalog() == 0
+	assert len(catalog.queryTrials(update=False)) == 2
+
+def test_new_trial_rescans_its_directory(dataFolders):
+	newTrial(0.4)
+	newTrial(0.1)
+	catalog.updateCatalog()
+	path = newTrial(0.4, probeDeltaFreq=1e-2)
+	assert catalog.updateCatalog() == 1
+	assert path in catalog.queryTrials(update=False)
+
+def test_pending_empty_file_picked_up_later(dataFolders):
+	path = fileio.trialPath(PUMP_FREQ, PUMP_AMP, 0.4, 3e-3)		# Reserved, data not written yet
+	assert catalog.updateCatalog() == 1
+	relPath = os.path.relpath(path, fileio.RAW_DATA_FOLDER)
+	assert cataloguedSizes()[relPath] == 0
+
+	# Writing the data leaves the directory mtime alone, the pending flag still brings it back
+	parameterDir = os.path.dirname(path)
+	mtime = os.stat(parameterDir).st_mtime_ns
+	writeTrial(path)
+	assert os.stat(parameterDir).st_mtime_ns == mtime
+	assert catalog.updateCatalog() == 1
+	assert cataloguedSizes()[relPath] == os.path.getsize(path) > 0
+	assert catalog.updateCatalog() == 0
+
+def test_removed_directory_pruned(dataFolders):
+	kept = newTrial(0.1)
+	removed = newTrial(0.4)
+	catalog.updateCatalog()
+	shutil.rmtree(os.path.dirname(removed))
+	assert catalog.queryTrials() == [kept]
+	assert cataloguedDirs() == [fileio.parametersToDir(PUMP_FREQ, PUMP_AMP, 0.1)[:-1]]
+
+def test_ignores_other_files_and_directories(dataFolders):
+	path = newTrial(0.4)
+	os.makedirs(fileio.RAW_DATA_FOLDER + "notes")
+	open(os.path.dirname(path) + "/readme.txt", "w").close()
+	catalog.updateCatalog()
+	assert catalog.queryTrials() == [path]
+##################################################################################################
+@pytest.fixture
+def grid(dataFolders):
+	"""Trials over values whose parsed names are not exactly the floats they were formatted from"""
+
+	paths = {}
+	for pumpAmp in [0.3e-4, 0.6e-4, 1e-4]:
+		for transverseField in [0.1, 0.4, 0.7, 2.3]:
+			for probeDeltaFreq in [0.7e-3, 3e-3]:
+				paths[pumpAmp, transverseField, probeDeltaFreq] = newTrial(transverseField, probeDeltaFreq, pumpAmp=pumpAmp)
+	return paths
+
+def selected(paths, condition):
+	return sorted(path for key, path in paths.items() if condition(*key))
+
+def test_queryTrials_single_values_within_tolerance(grid):
+	assert catalog.queryTrials(transverseField=0.7) == selected(grid, lambda amp, field, delta: field == 0.7)
+	assert catalog.queryTrials(pumpAmp=0.6e-4, transverseField=2.3, probeDeltaFreq=3e-3) == [grid[0.6e-4, 2.3, 3e-3]]
+	assert catalog.queryTrials(transverseField=0.4004) == selected(grid, lambda amp, field, delta: field == 0.4)
+	assert catalog.queryTrials(transverseField=0.5) == []
+	assert catalog.queryTrials(pumpFreq=PUMP_FREQ, trialNum=0) == sorted(grid.values())
+
+def test_queryTrials_ranges_include_their_ends(grid):
+	assert catalog.queryTrials(pumpAmp=(0.6e-4, None)) == selected(grid, lambda amp, field, delta: amp >= 0.6e-4)
+	assert catalog.queryTrials(pumpAmp=(None, 0.6e-4)) == selected(grid, lambda amp, field, delta: amp <= 0.6e-4)
+	assert catalog.queryTrials(transverseField=(0.4, 2.3), probeDeltaFreq=(None, 0.7e-3)) == selected(grid, lambda amp, field, delta: 0.4 <= field and delta == 0.7e-3)
+
+def test_queryTrials_ordered_by_parameters(grid):
+	paths = catalog.queryTrials()
+	keys = [fileio.trialPathToParameters(path) for path in paths]
+	assert keys == sorted(keys)
+
+def test_queryTrials_unknown_parameter(grid):
+	with pytest.raises(ValueError):
+		catalog.queryTrials(field=0.4)
+##################################################################################################
@@ -0,0 +1,76 @@
+# Chris Tang
+# test_demodulation.py
+
+import warnings
+import numpy as np
+import pytest
+
+import demodulation
+
+##################################################################################################
+SAMPLE_RATE = 512.
+AMP = 1e-3 * np.exp(1j * np.pi / 3)
+PUMP = 5e-3 - 2e-3j
+
+def beat(deltaFreq, sampleTime, amp=AMP, noise=0., t0=0., seed=0):
+	"""Lock-in outputs for a probe beat at deltaFreq on top of a constant pump response"""
+
+	t = t0 + np.arange(int(round(sampleTime * SAMPLE_RATE))) / SAMPLE_RATE
+	rng = np.random.default_rng(seed)
+	z = amp * np.exp(2j * np.pi * deltaFreq * t) + PUMP + noise * (rng.standard_normal(len(t)) + 1j * rng.standard_normal(len(t)))
+	return t, z.real, z.imag
+##################################################################################################
+def test_recovers_amplitude_and_phase():
+	traces = [beat(2., 5.), beat(3., 3.5, t0=10.), beat(0.7, 6., noise=1e-4)]
+	amp, numPeriods = demodulation.demodulateTraces(traces, [2., 3., 0.7])
+	assert list(numPeriods) == [10, 10, 4]
+	# Whole periods of 3 Hz are not a whole number of samples, which leaks a little of the pump response
+	np.testing.assert_allclose(amp, AMP, atol=1e-5)
+	assert amp[0] == pytest.approx(AMP, abs=1e-12)
+	np.testing.assert_allclose(np.angle(amp), np.pi / 3, atol=1e-2)
+
+def test_zero_deltaFreq_averages_whole_trace():
+	t, x, y = beat(1., 2., amp=0.)
+	amp, numPeriods = demodulation.demodulate(t, x, y, 0.)
+	assert amp[0] == pytest.approx(PUMP)
+
+def test_shorter_than_one_period_is_nan():
+	t, x, y = beat(0.5, 1.5)
+	with warnings.catch_warnings():
+		warnings.simplefilter("error")
+		amp, numPeriods = demodulation.demodulate(t, x, y, 0.5)
+	assert numPeriods[0] == 0
+	assert np.isnan(amp[0])
+
+def test_stream_matches_traces_period_by_period():
+	deltaFreq = 2.
+	t, x, y = beat(deltaFreq, 5.25, noise=1e-4)
+	# Chunks of irregular lengths, with boundaries inside periods
+	bounds = [0, 100, 101, 700, 1500, 2000, len(t)]
+	chunks = [(t[start:stop], x[start:stop], y[start:stop]) for start, stop in zip(bounds[:-1], bounds[1:])]
+	tPeriod, ampPeriod = map(np.array, zip(*demodulation.demodulateStream(chunks, deltaFreq)))
+
+	perPeriod = int(SAMPLE_RATE / deltaFreq)
+	assert len(ampPeriod) == 10		# The trailing quarter period is dropped
+	traces = [(t[i * perPeriod:(i + 1) * perPeriod], x[i * perPeriod:(i + 1) * perPeriod], y[i * perPeriod:(i + 1) * perPeriod]) for i in range(len(ampPeriod))]
+	amp, numPeriods = demodulation.demodulateTraces(traces, deltaFreq)
+	assert (numPeriods == 1).all()
+	np.testing.assert_allclose(ampPeriod, amp, atol=1e-12)
+	np.testing.assert_allclose(tPeriod, (np.arange(10) + 0.5) / deltaFreq)
+
+def test_stream_rejects_nonpositive_deltaFreq():
+	with pytest.raises(ValueError):
+		list(demodulation.demodulateStream([beat(1., 1.)], 0.))
+
+def test_spectra_peak_at_deltaFreq():
+	deltaFreqs = [20., -35.]
+	traces = [beat(deltaFreq, 16., noise=1e-4, seed=i) for i, deltaFreq in enumerate(deltaFreqs)]
+	t = traces[0][0]
+	freq, psd = demodulation.spectra(t, [trace[1] for trace in traces], [trace[2] for trace in traces])
+	assert psd.shape == (2, demodulation.WELCH_SEGMENT_LENGTH)
+	resolution = SAMPLE_RATE / demodulation.WELCH_SEGMENT_LENGTH
+	for deltaFreq, row in zip(deltaFreqs, psd):
+		# Strongest line away from the pump response at zero frequency
+		away = np.abs(freq) > 2 * resolution
+		assert freq[away][np.argmax(row[away])] == pytest.approx(deltaFreq, abs=resolution)
+##################################################################################################
@@ -0,0 +1,55 @@
+# Chris Tang
+# test_fileio.py
+
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import fileio
+
+##################################################################################################
+PARAMETERS = (202., 0.6e-4, 0.4, 3e-3)
+
+def claimPaths(rawDataFolder, numPaths):
+	"""Claims numPaths trial paths, for running in a worker process"""
+
+	fileio.RAW_DATA_FOLDER = rawDataFolder
+	return [fileio.trialPath(*PARAMETERS) for i in range(numPaths)]
+##################################################################################################
+def test_trialPath_numbers_sequentially(dataFolders):
+	paths = [fileio.trialPath(*PARAMETERS) for i in range(3)]
+	assert [fileio.strToTrialNum(path) for path in paths] == [0, 1, 2]
+	assert all(os.path.exists(path) and os.path.getsize(path) == 0 for path in paths)
+	assert fileio.trialPathToParameters(paths[2]) == pytest.approx((202., 0.6e-4, 0.4, 3e-3, 2))
+
+def test_trialPath_continues_legacy_directory(dataFolders):
+	parameterDir = fileio.RAW_DATA_FOLDER + fileio.parametersToDir(*PARAMETERS[:3])
+	os.makedirs(parameterDir)
+	for trialNum in [0, 1, 7]:
+		open(fileio.trialNumToPath(parameterDir, fileio.deltaFreqToStr(PARAMETERS[3]), trialNum), "w").close()
+	assert fileio.strToTrialNum(fileio.trialPath(*PARAMETERS)) == 8
+
+def test_trialPath_skips_names_taken_behind_the_counter(dataFolders):
+	path = fileio.trialPath(*PARAMETERS)
+	open(path.replace("_000.csv", "_001.csv"), "w").close()
+	assert fileio.strToTrialNum(fileio.trialPath(*PARAMETERS)) == 2
+
+def test_trialPath_lost_counter_continues_trace_store(dataFolders):
+	import traceStore
+	for i in range(3):
+		traceStore.appendTrace(*PARAMETERS, {"x": [0., 1.]}, 1e-3)
+	parameterDir = fileio.RAW_DATA_FOLDER + fileio.parametersToDir(*PARAMETERS[:3])
+	os.remove(parameterDir + "." + fileio.deltaFreqToStr(PARAMETERS[3]) + fileio.TRIAL_COUNTER_EXT)
+	assert fileio.strToTrialNum(fileio.trialPath(*PARAMETERS)) == 3
+
+def test_trialPath_concurrent_threads(dataFolders):
+	with ThreadPoolExecutor(max_workers=8) as executor:
+		paths = [path for paths in executor.map(lambda i: [fileio.trialPath(*PARAMETERS) for j in range(25)], range(8)) for path in paths]
+	assert len(set(paths)) == 200
+	assert sorted(fileio.strToTrialNum(path) for path in paths) == list(range(200))
+
+def test_trialPath_concurrent_processes(dataFolders):
+	with ProcessPoolExecutor(max_workers=4) as executor:
+		paths = [path for paths in executor.map(claimPaths, [fileio.RAW_DATA_FOLDER] * 4, [25] * 4) for path in paths]
+	assert sorted(fileio.strToTrialNum(path) for path in paths) == list(range(100))
+##################################################################################################
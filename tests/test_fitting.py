@@ -0,0 +1,89 @@
+# Chris Tang
+# test_fitting.py
+
+import numpy as np
+import pytest
+
+import fitting
+
+##################################################################################################
+FREQ = np.logspace(-3, 1, 30)
+NOISE = 1e-4
+
+def debye(chiT, chiS, tau, freq):
+	return chiS + (chiT - chiS) / (1 + 2j * np.pi * freq * tau)
+
+def coleCole(chiT, chiS, tau, alpha, freq):
+	return chiS + (chiT - chiS) / (1 + (2j * np.pi * freq * tau) ** (1 - alpha))
+
+def noisy(chi, seed=0):
+	rng = np.random.default_rng(seed)
+	return chi + NOISE * (rng.standard_normal(chi.shape) + 1j * rng.standard_normal(chi.shape))
+##################################################################################################
+def test_recovers_debye_parameters():
+	taus = [0.01, 0.1, 1, 10]
+	chi = noisy(np.array([debye(1., 0.1, tau, FREQ) for tau in taus]))
+	table = fitting.fitSpectra("debye", FREQ, chi, printSwitch=False)
+	assert table["converged"].all()
+	np.testing.assert_allclose(table["chiT"], 1., atol=1e-3)
+	np.testing.assert_allclose(table["chiS"], 0.1, atol=1e-3)
+	np.testing.assert_allclose(table["logTau"], np.log10(taus), atol=1e-3)
+	assert (table["logTauErr"] > 0).all() and (table["logTauErr"] < 1e-2).all()
+	assert (table["numPts"] == len(FREQ)).all()
+
+def test_recovers_coleCole_parameters():
+	alphas = [0., 0.2, 0.4]
+	chi = noisy(np.array([coleCole(2., 0.5, 0.3, alpha, FREQ) for alpha in alphas]))
+	table = fitting.fitSpectra("coleCole", FREQ, chi, printSwitch=False)
+	assert table["converged"].all()
+	np.testing.assert_allclose(table["chiT"], 2., atol=1e-2)
+	np.testing.assert_allclose(table["chiS"], 0.5, atol=1e-2)
+	np.testing.assert_allclose(table["logTau"], np.log10(0.3), atol=1e-2)
+	np.testing.assert_allclose(table["alpha"], alphas, atol=1e-2)
+
+def test_nan_padded_spectra():
+	chi = noisy(np.array([debye(1., 0.1, tau, FREQ) for tau in [0.1, 1.]]))
+	full = fitting.fitSpectra("debye", FREQ, chi, printSwitch=False)
+
+	# Spectra of different lengths, padded, and a missing point inside the second
+	freq = np.tile(FREQ, (2, 1))
+	freq[0, 20:], chi[0, 20:] = np.nan, np.nan
+	chi[1, 5] = np.nan
+	padded = fitting.fitSpectra("debye", freq, chi, printSwitch=False)
+	assert padded["converged"].all()
+	assert list(padded["numPts"]) == [20, len(FREQ) - 1]
+	np.testing.assert_allclose(padded["logTau"], full["logTau"], atol=1e-2)
+	np.testing.assert_allclose(padded["chiT"], full["chiT"], atol=1e-2)
+
+def test_warm_start_from_neighbours():
+	taus = [0.5, 0.6, 0.7]
+	chi = np.array([debye(1., 0.1, tau, FREQ) for tau in taus])
+	initialParams = fitting.initialGuess("debye", np.tile(FREQ, (3, 1)), chi)
+	initialParams[1] = [1., 0.1, -8.]		# Starts far outside the band and runs off
+
+	alone = fitting.fitSpectra("debye", FREQ, chi, initialParams=initialParams, printSwitch=False)
+	assert list(alone["converged"]) == [True, False, True]
+
+	coordinates = [[1e3, 1e-4, 0.1], [1e3, 1e-4, 0.2], [1e3, 1e-4, 0.3]]
+	table = fitting.fitSpectra("debye", FREQ, chi, coordinates=coordinates, initialParams=initialParams, printSwitch=False)
+	assert table["converged"].all()
+	np.testing.assert_allclose(table["logTau"], np.log10(taus), atol=1e-6)
+	np.testing.assert_allclose(table["transverseField"], [0.1, 0.2, 0.3])
+
+def test_damping_limit_is_not_convergence():
+	# Wrong-sign chi'' from a start at short tau: logTau runs off until no damped step decreases the cost
+	chi = np.conj(debye(1., 0.1, 1e-3, FREQ))[None]
+	freq = np.tile(FREQ, (1, 1))
+	params = fitting.initialGuess("debye", freq, chi)
+	params[:, 2] = -6.
+	# Far more iterations than needed, so the fit can only stop on the damping limit
+	params, cost, converged = fitting.levenbergMarquardt("debye", params, freq, chi, np.ones(chi.shape), maxIterations=100000)
+	assert abs(params[0, 2]) > 100
+	assert not converged[0]
+	assert not fitting.fitSpectra("debye", freq, chi, initialParams=params, printSwitch=False)["converged"][0]
+
+def test_exact_fit_converges():
+	chi = np.array([debye(1., 0.1, 1., FREQ)])
+	params, cost, converged = fitting.levenbergMarquardt("debye", [[1., 0.1, 0.]], np.tile(FREQ, (1, 1)), chi, np.ones(chi.shape))
+	assert converged[0]
+##################################################################################################
@@ -0,0 +1,83 @@
+# Chris Tang
+# test_instrument.py
+
+import pytest
+
+import sr830
+
+##################################################################################################
+def test_cache_skips_repeated_setting(resourceManager, recordWrites):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager, useCache=True)
+	messages = recordWrites(lockin)
+	lockin.setSensitivity(1e-3, printSwitch=False)
+	lockin.setSensitivity(1e-3, printSwitch=False)
+	assert len(messages) == 1
+	lockin.setSensitivity(2e-3, printSwitch=False)
+	assert len(messages) == 2
+
+def test_cache_off_by_default(resourceManager, recordWrites):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	messages = recordWrites(lockin)
+	lockin.setSensitivity(1e-3, printSwitch=False)
+	lockin.setSensitivity(1e-3, printSwitch=False)
+	assert len(messages) == 2
+
+def test_invalidateCache_resends(resourceManager, recordWrites):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager, useCache=True)
+	messages = recordWrites(lockin)
+	lockin.setTimeConstant(0.1, printSwitch=False)
+	lockin.invalidateCache("OFLT")
+	lockin.setTimeConstant(0.1, printSwitch=False)
+	assert len(messages) == 2
+
+def test_autoGain_invalidates_sensitivity(resourceManager, recordWrites):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager, useCache=True)
+	lockin.setSensitivity(1e-3, printSwitch=False)
+	lockin.setAutoGain(printSwitch=False)
+	messages = recordWrites(lockin)
+	lockin.setSensitivity(1e-3, printSwitch=False)
+	assert len(messages) == 1
+
+def test_resyncCache_reads_settings_back(resourceManager):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager, useCache=True)
+	lockin.inst.write("SENS 20")		# Changed behind the driver's back
+	lockin.resyncCache(printSwitch=False)
+	assert lockin.settingCache["SENS"] == "SENS 20"
+##################################################################################################
+def test_batch_sends_one_message(resourceManager, recordWrites):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	messages = recordWrites(lockin)
+	with lockin.batch(confirm=False):
+		lockin.setSensitivity(1e-3, printSwitch=False)
+		lockin.setTimeConstant(0.1, printSwitch=False)
+		lockin.setLowPassFilterSlope(24, printSwitch=False)
+		assert messages == []
+	assert messages == ["SENS %d;OFLT %d;OFSL 3" % (sr830.sensitivityToIndex(1e-3), sr830.timeConstantToIndex(0.1))]
+	assert lockin.getTimeConstant(printSwitch=False) == pytest.approx(0.1)
+
+def test_batch_flushed_before_query(resourceManager):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	with lockin.batch():
+		lockin.setTimeConstant(0.3, printSwitch=False)
+		assert lockin.getTimeConstant(printSwitch=False) == pytest.approx(0.3)
+
+def test_batch_split_at_max_length(resourceManager, recordWrites):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	messages = recordWrites(lockin)
+	with lockin.batch(confirm=False):
+		for volt in range(100):
+			lockin.setAuxOutput(1, volt * 1e-3, printSwitch=False)
+	assert len(messages) > 1
+	assert all(len(message) <= sr830.SR830.BATCH_MAX_LENGTH for message in messages)
+	assert float(lockin.query("AUXV? 1")) == pytest.approx(0.099)
+
+def test_nested_batches_join(resourceManager, recordWrites):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	messages = recordWrites(lockin)
+	with lockin.batch(confirm=False):
+		lockin.setTimeConstant(0.1, printSwitch=False)
+		with lockin.batch(confirm=False):
+			lockin.setLowPassFilterSlope(12, printSwitch=False)
+		assert messages == []
+	assert len(messages) == 1
+##################################################################################################
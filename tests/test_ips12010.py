@@ -0,0 +1,71 @@
+# Chris Tang
+# test_ips12010.py
+
+import time
+import pytest
+
+import ips12010
+import simVisa
+
+##################################################################################################
+class FakeClock():
+	"""Stands in for the time module of the driver and the simulator, so that ramps take no real time"""
+
+	def __init__(self):
+		self.now = time.time()
+		self.sleeps = []
+
+	def time(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+	clock = FakeClock()
+	monkeypatch.setattr(ips12010, "time", clock)
+	monkeypatch.setattr(simVisa, "time", clock)
+	monkeypatch.setattr(ips12010, "RAMP_START_DELAY", 0.1)
+	return clock
+
+@pytest.fixture
+def magSupply(resourceManager, clock):
+	return ips12010.IPS12010("SIM::MAGNET", resourceManager=resourceManager)
+##################################################################################################
+def test_returns_soon_after_ramp_ends(magSupply, clock):
+	# 2 Amp at 60 Amp/min: a 2 sec ramp
+	magSupply.startRamp(2., rate=60., printSwitch=False)
+	startTime = clock.now
+	assert magSupply.waitUntilStable(refreshTime=0.05, target=2., printSwitch=False)
+	assert 2. <= clock.now - startTime < 2.2
+	assert magSupply.getOutputCurrent(printSwitch=False) == 2.
+	# Sleeps through most of the ramp on the predicted time instead of polling throughout
+	assert clock.sleeps[0] == pytest.approx(ips12010.RAMP_WAIT_FRACTION * 2.)
+	assert len(clock.sleeps) <= 6
+
+def test_poll_interval_doubles_up_to_limit(magSupply, clock, monkeypatch):
+	monkeypatch.setattr(ips12010, "RAMP_MAX_POLL_TIME", 0.8)
+	monkeypatch.setattr(magSupply, "isAtRest", lambda: False)		# Never settles, although at the target
+	with pytest.raises(TimeoutError):
+		magSupply.waitUntilStable(refreshTime=0.05, target=0., timeout=3., printSwitch=False)
+	assert clock.sleeps[:7] == pytest.approx([0.1, 0.05, 0.1, 0.2, 0.4, 0.8, 0.8])
+
+def test_short_timeout_raises(magSupply, clock):
+	magSupply.startRamp(2., rate=60., printSwitch=False)
+	startTime = clock.now
+	with pytest.raises(TimeoutError):
+		magSupply.waitUntilStable(refreshTime=0.05, target=2., timeout=0.5, printSwitch=False)
+	# The sleeps are cut short at the deadline
+	assert clock.now - startTime == pytest.approx(0.5)
+
+def test_default_timeout_from_predicted_time(magSupply, clock, monkeypatch):
+	monkeypatch.setattr(ips12010, "RAMP_TIMEOUT_MARGIN", 1.)
+	magSupply.startRamp(2., rate=60., printSwitch=False)
+	monkeypatch.setattr(magSupply, "isAtRest", lambda: False)
+	startTime = clock.now
+	with pytest.raises(TimeoutError):
+		magSupply.waitUntilStable(refreshTime=0.05, target=2., printSwitch=False)
+	assert clock.now - startTime == pytest.approx(ips12010.RAMP_TIMEOUT_FACTOR * 2. + 1.)
+##################################################################################################
@@ -0,0 +1,77 @@
+# Chris Tang
+# test_lockinData.py
+
+import time
+import numpy as np
+import pytest
+
+import sr830
+import agilent33500
+import lockinData
+
+##################################################################################################
+def test_triggered_run_filling_most_of_buffer(resourceManager):
+	"""A triggered run ending inside the last poll margin of the buffer is read in one piece"""
+
+	fnGen = agilent33500.Agilent33500("SIM::FNGEN", resourceManager=resourceManager)
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	sampleRate = 8000.
+	fnGen.setFreq(1, sampleRate, printSwitch=False)
+	numTarget = sr830.BUFFER_SIZE - 10
+	sampleTime = numTarget / sampleRate
+
+	startTime = time.time()
+	t, x, y = lockinData.takeDataTriggered([lockin], fnGen, sampleTime, sampleRate, printSwitch=False)
+	assert len(t) == numTarget
+	assert x.shape == y.shape == (1, numTarget)
+	assert time.time() - startTime < sampleTime + lockinData.MULTI_START_TIMEOUT / 2
+	np.testing.assert_allclose(x, 1e-3, atol=1e-4)
+
+def test_triggered_run_longer_than_buffer_rejected(resourceManager):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	with pytest.raises(ValueError):
+		list(lockinData.streamData(lockin, 2 * sr830.BUFFER_SIZE / 100., rate=100., triggered=True, printSwitch=False))
+
+def test_untriggered_run_is_segmented(resourceManager, monkeypatch):
+	"""Runs longer than the buffer are read in segments without losing time order"""
+
+	bufferSize = 1000
+	monkeypatch.setattr(sr830, "BUFFER_SIZE", bufferSize)
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	lockin.inst.bufferSize = bufferSize
+	lockin.inst.resetBuffer()
+	lockin.setSampleRate(512, printSwitch=False)
+
+	sampleTime = 4.
+	chunks = list(lockinData.streamData(lockin, sampleTime, pollTime=0.25, printSwitch=False))
+	# Chunks of one segment share its buffer, later segments do not overwrite it
+	assert chunks[1][1].base is chunks[2][1].base
+	assert chunks[0][1].base is not chunks[-1][1].base
+	t, x, y = lockinData.concatenateChunks(chunks)
+	assert len(t) > bufferSize
+	assert t[-1] < sampleTime + 0.1
+	# Segments follow each other in time, to within the one-sample uncertainty of a software start
+	assert np.diff(t).min() > -1. / 512
+	np.testing.assert_allclose(x, 1e-3, atol=1e-4)
+
+def test_takeDataAdaptive_stops_at_target_error(resourceManager):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	lockin.setTimeConstant(1e-3, printSwitch=False)
+	lockin.setSampleRate(512, printSwitch=False)
+	relError, maxTime = 1e-3, 10.
+
+	startTime = time.time()
+	t, x, y, achievedError = lockinData.takeDataAdaptive(lockin, relError, maxTime, pollTime=0.05, printSwitch=False)
+	assert achievedError <= relError
+	assert time.time() - startTime < maxTime / 2
+	assert len(x) == len(y) == len(t) and t[-1] < maxTime / 2
+	assert abs(x.mean() - 1e-3) < 5 * relError * 1e-3
+
+def test_waitUntilSettled_after_step(resourceManager):
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	lockin.setTimeConstant(0.01, printSwitch=False)
+	lockin.inst.setSignal(2e-3, 1e-3)
+	assert lockinData.waitUntilSettled(lockin, maxTime=5, printSwitch=False)
+	x, y = lockin.readSnapshot(printSwitch=False)
+	assert abs(x - 2e-3) < 1e-4 and abs(y - 1e-3) < 1e-4
+##################################################################################################
@@ -0,0 +1,70 @@
+# Chris Tang
+# test_processing.py
+
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+
+import fileio
+import traceStore
+import processing
+
+##################################################################################################
+PARAMETERS = (202., 0.6e-4, 0.4)
+CHI = 0.5 - 0.2j
+
+def rawColumns(numPts, chi=CHI, seed=0):
+	"""Raw lock-in columns of a sample with susceptibility chi, plus a little noise"""
+
+	rng = np.random.default_rng(seed)
+	drive = np.full(numPts, 1e-3 + 0j)
+	empty = np.full(numPts, 1e-5 + 2e-6j)
+	pickup = empty + chi * drive + 1e-8 * (rng.standard_normal(numPts) + 1j * rng.standard_normal(numPts))
+	return {"pickupX": pickup.real, "pickupY": pickup.imag, "driveX": drive.real, "driveY": drive.imag, "emptyX": empty.real, "emptyY": empty.imag}
+
+def writeCsvTrial(probeDeltaFreq, numPts, chi=CHI, seed=0):
+	columns = rawColumns(numPts, chi, seed)
+	path = fileio.trialPath(*PARAMETERS, probeDeltaFreq)
+	np.savetxt(path, np.column_stack([np.arange(numPts) / 512.] + [columns[name] for name in processing.RAW_COLUMNS]), delimiter=",")
+	return path
+##################################################################################################
+def test_susceptibility():
+	columns = rawColumns(10)
+	chi = processing.susceptibility(*[columns[name] for name in processing.RAW_COLUMNS])
+	np.testing.assert_allclose(chi, CHI, atol=1e-4)
+	chi = processing.susceptibility(*[columns[name] for name in processing.RAW_COLUMNS], config={"phaseOffset": 90.})
+	np.testing.assert_allclose(chi, -1j * CHI, atol=1e-4)
+
+def test_processDir_reads_store_and_csv_trials(dataFolders):
+	traceStore.appendTrace(*PARAMETERS, 3e-3, rawColumns(1000), dt=1. / 512)
+	writeCsvTrial(3e-3, 500, chi=0.25 + 0j)
+	np.savetxt(fileio.trialPath(*PARAMETERS, 3e-3), np.zeros(2), delimiter=",")		# Other layout, skipped
+
+	path = processing.processDir(fileio.parametersToDir(*PARAMETERS))
+	with np.load(path) as results:
+		assert list(results["trialNum"]) == [0, 1]
+		np.testing.assert_array_equal(results["numPts"], [1000, 500])
+		np.testing.assert_allclose(results["chi"], [CHI, 0.25], atol=1e-4)
+		np.testing.assert_allclose(results["probeDeltaFreq"], 3e-3)
+
+def test_processDir_without_trials(dataFolders):
+	fileio.trialPath(*PARAMETERS, 3e-3)		# Reserved but never written
+	assert processing.processDir(fileio.parametersToDir(*PARAMETERS)) is None
+
+def test_processDir_cache_recomputes_changed_trials(dataFolders, capsys):
+	paths = [writeCsvTrial(3e-3, 200, seed=seed) for seed in range(3)]
+	parameterDir = fileio.parametersToDir(*PARAMETERS)
+	processing.processDir(parameterDir, useCache=True, printSwitch=True)
+	processing.processDir(parameterDir, useCache=True, printSwitch=True)
+	np.savetxt(paths[1], np.column_stack([np.zeros(200)] + [column for column in rawColumns(200, chi=1j).values()]), delimiter=",")
+	path = processing.processDir(parameterDir, useCache=True, printSwitch=True)
+	assert capsys.readouterr().out.splitlines() == ["%s: Computed %d of 3 trials" % (parameterDir, numComputed) for numComputed in [3, 0, 1]]
+	with np.load(path) as results:
+		np.testing.assert_allclose(results["chi"], [CHI, 1j, CHI], atol=1e-4)
+
+def test_processAll(dataFolders):
+	writeCsvTrial(3e-3, 100)
+	paths = processing.processAll(numWorkers=1, printSwitch=False)
+	assert paths == [fileio.processedPath(*PARAMETERS)]
+##################################################################################################
@@ -0,0 +1,79 @@
+# Chris Tang
+# test_scheduler.py
+
+import os
+import sys
+import itertools
+import subprocess
+
+import pytest
+
+import scheduler
+
+##################################################################################################
+PUMP_FREQS = [1e3, 2e3, 3e3]
+PUMP_AMPS = [1e-4, 2e-4]
+FIELDS = [0.1, 0.3, 0.2, 0.4]
+DELTA_FREQS = [1e-3, 3e-3, 1e-2]
+
+def schedule(currentField=0., driven=False):
+	return scheduler.scheduleGrid(PUMP_FREQS, PUMP_AMPS, FIELDS, DELTA_FREQS, sampleTime=60, tau=1, slope=24, currentField=currentField, driven=driven, printSwitch=False)
+##################################################################################################
+def test_serpentine_changes_one_axis_at_a_time():
+	combinations = scheduler.serpentine([[1, 2, 3], ["a", "b"], [10, 20, 30, 40]])
+	assert sorted(combinations) == sorted(itertools.product([1, 2, 3], ["a", "b"], [10, 20, 30, 40]))
+	for previous, combination in zip(combinations[:-1], combinations[1:]):
+		assert sum(old != new for old, new in zip(previous, combination)) == 1
+
+def test_schedule_covers_grid_changing_one_axis_at_a_time():
+	order, totalTime = schedule()
+	assert sorted(order) == sorted(itertools.product(PUMP_FREQS, PUMP_AMPS, sorted(FIELDS), DELTA_FREQS))
+	for previous, point in zip(order[:-1], order[1:]):
+		assert sum(old != new for old, new in zip(previous, point)) == 1
+
+def sweptFields(order):
+	return [field for field, group in itertools.groupby(point[2] for point in order)]
+
+@pytest.mark.parametrize("currentField, expected", [(0., sorted(FIELDS)), (0.5, sorted(FIELDS, reverse=True))])
+def test_driven_fields_swept_once_from_nearest_end(currentField, expected):
+	order, totalTime = schedule(currentField=currentField, driven=True)
+	assert sweptFields(order) == expected
+
+def test_sweep_direction_chosen_by_estimated_time():
+	# Persistent from 3 T the leads must come back to zero after the first field, which favours the low end
+	# even though 4.9 T is nearer; driven, the nearer end wins
+	fields = [1., 2., 4.9]
+	for driven, expected in [(False, fields), (True, fields[::-1])]:
+		order, totalTime = scheduler.scheduleGrid([1e3], [1e-4], fields, [1e-2], sampleTime=60, tau=1, slope=24, currentField=3., driven=driven, printSwitch=False)
+		assert sweptFields(order) == expected
+		assert totalTime < scheduler.estimateTime(order[::-1], 60, 1, 24, currentField=3., driven=driven)
+
+def test_costliest_axis_outermost_is_cheapest():
+	order, totalTime = schedule()
+	# Every other nesting of the inner axes, in serpentine order within the same field sweep
+	for names in itertools.permutations(["pumpFreq", "pumpAmp", "probeDeltaFreq"]):
+		values = {"pumpFreq": PUMP_FREQS, "pumpAmp": PUMP_AMPS, "probeDeltaFreq": DELTA_FREQS}
+		points = scheduler.serpentine([sorted(values[name]) for name in names])
+		other = []
+		for i, field in enumerate(sorted(FIELDS)):
+			for combination in (points if i % 2 == 0 else points[::-1]):
+				point = dict(zip(names, combination), transverseField=field)
+				other.append(tuple(point[axis] for axis in scheduler.AXES))
+		assert totalTime <= scheduler.estimateTime(other, 60, 1, 24) + 1e-9
+
+def test_schedule_beats_naive_order():
+	order, totalTime = schedule()
+	naive = list(itertools.product(PUMP_FREQS, PUMP_AMPS, FIELDS, DELTA_FREQS))
+	assert totalTime == pytest.approx(scheduler.estimateTime(order, 60, 1, 24))
+	assert totalTime < scheduler.estimateTime(naive, 60, 1, 24)
+
+def test_driven_fields_cheaper_than_persistent():
+	assert scheduler.fieldChangeTime(0.1, 0.2, driven=True) < scheduler.fieldChangeTime(0.1, 0.2)
+	assert scheduler.fieldChangeTime(0.2, 0.2) == 0.
+	assert schedule(driven=True)[1] < schedule()[1]
+
+def test_imports_without_visa():
+	# Blocks visa in a fresh interpreter, as on an analysis machine without it
+	code = "import sys; sys.modules['visa'] = None; import scheduler; scheduler.scheduleGrid([1e3], [1e-4], [0.1, 0.2], [1e-2], 60, 1, 24, printSwitch=False)"
+	subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True)
+##################################################################################################
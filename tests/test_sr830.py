@@ -0,0 +1,101 @@
+# Chris Tang
+# test_sr830.py
+
+import time
+import numpy as np
+import pytest
+
+import sr830
+
+##################################################################################################
+@pytest.fixture
+def lockin(resourceManager):
+	return sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+
+@pytest.mark.parametrize("table, indexToValue, nearest", [
+	(sr830.SAMPLE_RATES, sr830.indexToSampleRate, sr830.nearestSampleRate),
+	(sr830.TIME_CONSTANTS, sr830.indexToTimeConstant, sr830.nearestTimeConstant),
+	(sr830.SENSITIVITIES, sr830.indexToSensitivity, sr830.nearestSensitivity),
+])
+def test_table_lookups_round_trip(table, indexToValue, nearest):
+	indices = np.arange(len(table))
+	assert [sr830.nearestIndex(table, indexToValue(index)) for index in indices] == list(indices)
+	np.testing.assert_array_equal(sr830.nearestIndex(table, indexToValue(indices)), indices)
+	assert nearest(table[3] * 1.1) == (3, table[3])
+	# Below the first and above the last entry clamp to the ends
+	assert sr830.nearestIndex(table, table[0] / 10) == 0
+	assert sr830.nearestIndex(table, table[-1] * 10) == len(table) - 1
+	assert isinstance(indexToValue(2.), float)
+
+@pytest.mark.parametrize("index", [-1, 27, 2.5, [0, 27], "5"])
+def test_tableValue_rejects_bad_indices(index):
+	with pytest.raises(ValueError):
+		sr830.indexToSensitivity(index)
+
+def test_indexToSampleRate_rejects_trigger_index():
+	with pytest.raises(ValueError):
+		sr830.indexToSampleRate(sr830.TRIGGER_SAMPLE_RATE_INDEX)
+
+def test_readSnapshotParams(lockin):
+	snapshot = lockin.readSnapshotParams(("x", "y", "freq"), printSwitch=False)
+	assert snapshot.dtype.names == ("x", "y", "freq")
+	assert abs(snapshot["x"] - 1e-3) < 1e-4
+	assert snapshot["freq"] == 1000.
+
+def test_sampleSnapshots_reuses_out(lockin):
+	out = np.zeros(8, dtype=sr830.snapshotDtype(("x", "y"), timeStamps=True))
+	samples = lockin.sampleSnapshots(5, out=out, printSwitch=False)
+	assert np.shares_memory(samples, out)
+	assert np.all(np.diff(samples["t"]) >= 0)
+	np.testing.assert_allclose(samples["x"], 1e-3, atol=1e-4)
+
+def test_autoRange_from_full_scale(lockin):
+	lockin.setTimeConstant(1e-3, printSwitch=False)
+	assert lockin.autoRange(printSwitch=False) == 2e-3
+	assert int(lockin.query("SENS?")) == sr830.nearestIndex(sr830.SENSITIVITIES, 2e-3)
+
+def test_autoRange_steps_up_when_overloaded(lockin, recordWrites):
+	lockin.setTimeConstant(1e-3, printSwitch=False)
+	lockin.setSensitivity(500e-6, printSwitch=False)
+	writes = recordWrites(lockin)
+	assert lockin.autoRange(printSwitch=False) == 2e-3
+	senseWrites = [write for write in writes if write.startswith("SENS ")]
+	# The overload sends it up a decade to 5 mV before it settles back on the range for the signal
+	assert senseWrites == ["SENS %d" % sr830.nearestIndex(sr830.SENSITIVITIES, sense) for sense in [5e-3, 2e-3]]
+
+def test_readDataBuffers_lia_matches_ieee(lockin):
+	lockin.inst.setSignal(1e-3, -2e-5)
+	lockin.setSampleRate(512, printSwitch=False)
+	lockin.inst.write("STRT")
+	time.sleep(0.2)
+	lockin.inst.write("PAUS")
+	x, y = [arr.copy() for arr in lockin.readDataBuffers(printSwitch=False)]
+	assert len(x) > 50
+	xLia, yLia = lockin.readDataBuffers(fmt="lia", printSwitch=False)
+	# TRCL? carries a 16-bit signed mantissa
+	np.testing.assert_allclose(xLia, x, rtol=2. ** -15)
+	np.testing.assert_allclose(yLia, y, rtol=2. ** -15)
+	with pytest.raises(ValueError):
+		lockin.readDataBuffers(fmt="ascii", printSwitch=False)
+
+def test_readDataBuffer_is_writable(lockin):
+	lockin.setSampleRate(512, printSwitch=False)
+	lockin.inst.write("STRT")
+	time.sleep(0.1)
+	lockin.inst.write("PAUS")
+	arr = lockin.readDataBuffer(1, printSwitch=False)
+	assert len(arr) > 0 and arr.flags.writeable
+	arr -= arr.mean()
+
+def test_disarm_after_run_left_in_trigger_mode(lockin, capsys):
+	lockin.inst.write("SRAT %d" % sr830.TRIGGER_SAMPLE_RATE_INDEX)
+	index = lockin.armTriggeredStorage(printSwitch=False)
+	lockin.disarmTriggeredStorage(index, printSwitch=True)
+	assert lockin.getSampleRate(printSwitch=False) == sr830.indexToSampleRate(sr830.DEFAULT_SAMPLE_RATE_INDEX)
+	assert "512.0000 Hz" in capsys.readouterr().out
+
+def test_disarm_restores_previous_rate(lockin):
+	lockin.setSampleRate(64., printSwitch=False)
+	lockin.disarmTriggeredStorage(lockin.armTriggeredStorage(printSwitch=False), printSwitch=False)
+	assert lockin.getSampleRate(printSwitch=False) == 64.
+##################################################################################################
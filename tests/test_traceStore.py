@@ -0,0 +1,56 @@
+# Chris Tang
+# test_traceStore.py
+
+import os
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+
+import fileio
+import traceStore
+
+##################################################################################################
+PARAMETERS = (202., 0.6e-4, 0.4)
+
+def test_append_and_read(dataFolders):
+	x = np.linspace(0, 1, 1000, dtype='<f4')
+	key = traceStore.appendTrace(*PARAMETERS, 3e-3, {"x": x, "y": -x}, dt=0.5, t0=2.)
+	path = fileio.traceStorePath(*PARAMETERS)
+	trace = traceStore.readTrace(path, key, start=10, stop=20)
+	np.testing.assert_array_equal(trace["x"], x[10:20])
+	np.testing.assert_allclose(trace["t"], 2. + 0.5 * np.arange(10, 20))
+	traces = traceStore.readTraces(path, [key], ["y"])
+	np.testing.assert_array_equal(traces[0]["y"], -x)
+
+def test_memmap_default_store(dataFolders):
+	x = np.arange(5000, dtype='<f4')
+	key = traceStore.appendTrace(*PARAMETERS, 3e-3, {"x": x}, dt=1.)
+	arr = traceStore.memmapColumn(fileio.traceStorePath(*PARAMETERS), key, "x")
+	assert isinstance(arr, np.memmap)
+	np.testing.assert_array_equal(arr, x)
+
+def test_memmap_falls_back_for_compressed(dataFolders):
+	x = np.arange(5000, dtype='<f4')
+	key = traceStore.appendTrace(*PARAMETERS, 3e-3, {"x": x}, dt=1., compression="gzip")
+	arr = traceStore.memmapColumn(fileio.traceStorePath(*PARAMETERS), key, "x")
+	assert not isinstance(arr, np.memmap)
+	np.testing.assert_array_equal(arr, x)
+
+def test_store_and_csv_share_trial_numbers(dataFolders):
+	csvPaths = [fileio.trialPath(*PARAMETERS, 3e-3)]
+	keys = [traceStore.appendTrace(*PARAMETERS, 3e-3, {"x": np.zeros(3)}, dt=1.)]
+	csvPaths.append(fileio.trialPath(*PARAMETERS, 3e-3))
+	keys.append(traceStore.appendTrace(*PARAMETERS, 3e-3, {"x": np.zeros(3)}, dt=1.))
+	trialNums = sorted([fileio.strToTrialNum(path) for path in csvPaths] + [fileio.strToTrialNum(key) for key in keys])
+	assert trialNums == [0, 1, 2, 3]
+
+	# A different probe frequency has its own counter
+	assert traceStore.appendTrace(*PARAMETERS, 5e-3, {"x": np.zeros(3)}, dt=1.).endswith("_000")
+
+def test_store_skips_legacy_csv_trials(dataFolders):
+	parameterDir = fileio.RAW_DATA_FOLDER + fileio.parametersToDir(*PARAMETERS)
+	os.makedirs(parameterDir)
+	open(parameterDir + fileio.deltaFreqToStr(3e-3) + "_004.csv", "w").close()
+	assert fileio.strToTrialNum(traceStore.appendTrace(*PARAMETERS, 3e-3, {"x": np.zeros(3)}, dt=1.)) == 5
+##################################################################################################
@@ -0,0 +1,139 @@
+# Chris Tang
+# test_transverseField.py
+
+import time
+
+import pytest
+
+import ips12010
+import lockinData
+import sr830
+import transverseField
+
+##################################################################################################
+# Fields small enough that the simulated 1 Amp/min ramps take about a second
+FIELD = 0.002
+FIELD_PER_CURRENT = transverseField.AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT
+
+@pytest.fixture
+def magnet(resourceManager, tmp_path, monkeypatch):
+	"""Simulated power supply and compensation coil lock-in, with the switch heater waits shortened"""
+
+	for name in ["MAGNET_HEAT_TIME", "MAGNET_COOL_TIME", "MAGNET_HEATER_CHECK_TIME"]:
+		monkeypatch.setattr(transverseField, name, 0)
+	monkeypatch.setattr(transverseField, "MAGNET_REFRESH_TIME", 0.1)
+	monkeypatch.setattr(transverseField, "RAMP_FIELD_POLL_TIME", 0.1)
+	monkeypatch.setattr(transverseField, "MAGNET_STATE_PATH", str(tmp_path / "magnetState.json"))
+	monkeypatch.setattr(transverseField, "TRANSVERSE_FIELD_TILT_ANGLE", 0.01)
+	monkeypatch.setattr(transverseField, "COMP_COIL_FIELD_PER_CURRENT", 0.01)
+	monkeypatch.setattr(ips12010, "RAMP_START_DELAY", 0.1)
+	magSupply = ips12010.IPS12010("SIM::MAGNET", resourceManager=resourceManager)
+	lockin = sr830.SR830("SIM::LOCKIN", resourceManager=resourceManager)
+	return magSupply, lockin
+
+def heaterCommands(messages):
+	return [cmd for message in messages for cmd in message.split("\r") if cmd.startswith("$H")]
+##################################################################################################
+def test_readMagnetState_does_not_save(magnet):
+	magSupply, lockin = magnet
+	state = transverseField.readMagnetState(magSupply, printSwitch=False)
+	assert not state["confirmed"]
+	assert transverseField.loadMagnetState() is None
+	assert not transverseField.readMagnetState(magSupply, printSwitch=False)["confirmed"]
+
+def test_setTransverseField_full_sequence_then_skip(magnet, recordWrites):
+	magSupply, lockin = magnet
+	messages = recordWrites(magSupply)
+	transverseField.setTransverseField(magSupply, lockin, FIELD, printSwitch=False)
+	assert heaterCommands(messages) == ["$H1", "$H0"]
+	assert magSupply.getPersistentCurrent(printSwitch=False) == pytest.approx(FIELD / FIELD_PER_CURRENT, abs=1e-3)
+	assert magSupply.getOutputCurrent(printSwitch=False) == pytest.approx(0, abs=1e-3)
+	assert transverseField.loadMagnetState()["heaterOn"] is False
+
+	# Confirmed persistent at the field: no transitions
+	del messages[:]
+	transverseField.setTransverseField(magSupply, lockin, FIELD, printSwitch=False)
+	assert heaterCommands(messages) == []
+
+def test_unconfirmed_state_takes_full_sequence(magnet, recordWrites):
+	magSupply, lockin = magnet
+	transverseField.saveMagnetState(heaterOn=False, persistentCurrent=FIELD / FIELD_PER_CURRENT)
+	messages = recordWrites(magSupply)
+	# The saved state claims the field, but the supply shows no persistent current
+	transverseField.setTransverseField(magSupply, lockin, FIELD, printSwitch=False)
+	assert heaterCommands(messages) == ["$H1", "$H0"]
+	assert magSupply.getPersistentCurrent(printSwitch=False) == pytest.approx(FIELD / FIELD_PER_CURRENT, abs=1e-3)
+
+def test_sweep_break_returns_to_persistent(magnet):
+	magSupply, lockin = magnet
+	fields = [FIELD, 2 * FIELD, 3 * FIELD]
+	with transverseField.sweepTransverseField(magSupply, lockin, fields, printSwitch=False) as steps:
+		for field in steps:
+			assert magSupply.heaterIsOn(printSwitch=False)
+			assert magSupply.getOutputCurrent(printSwitch=False) == pytest.approx(field / FIELD_PER_CURRENT, abs=1e-3)
+			if field == 2 * FIELD: break
+		assert magSupply.heaterIsOn(printSwitch=False)
+	# Persistent at the last field reached as soon as the block exits, even though steps is still referenced
+	assert not magSupply.heaterIsOn(printSwitch=False)
+	assert magSupply.getPersistentCurrent(printSwitch=False) == pytest.approx(2 * FIELD / FIELD_PER_CURRENT, abs=1e-3)
+	assert magSupply.getOutputCurrent(printSwitch=False) == pytest.approx(0, abs=1e-3)
+	assert transverseField.loadMagnetState()["heaterOn"] is False
+	assert list(steps) == []
+
+def test_sweep_error_returns_to_persistent(magnet):
+	magSupply, lockin = magnet
+	with pytest.raises(RuntimeError):
+		with transverseField.sweepTransverseField(magSupply, lockin, [FIELD, 2 * FIELD], printSwitch=False) as steps:
+			for field in steps:
+				raise RuntimeError("measurement failed")
+	assert not magSupply.heaterIsOn(printSwitch=False)
+	assert magSupply.getPersistentCurrent(printSwitch=False) == pytest.approx(FIELD / FIELD_PER_CURRENT, abs=1e-3)
+	assert magSupply.getOutputCurrent(printSwitch=False) == pytest.approx(0, abs=1e-3)
+
+def test_sweep_checkpoints(magnet, recordWrites):
+	magSupply, lockin = magnet
+	messages = recordWrites(magSupply)
+	with transverseField.sweepTransverseField(magSupply, lockin, [FIELD, 2 * FIELD], checkpointInterval=1, printSwitch=False) as steps:
+		assert list(steps) == [FIELD, 2 * FIELD]
+	assert heaterCommands(messages) == ["$H1", "$H0", "$H1", "$H0"]
+##################################################################################################
+def test_measureDuringRamp_ends_persistent(magnet, resourceManager):
+	magSupply, lockin = magnet
+	dataLockin = sr830.SR830("SIM::DATA", resourceManager=resourceManager)
+	t, field, x, y = transverseField.measureDuringRamp(magSupply, [dataLockin], FIELD, 2 * FIELD, pollTime=0.1, compCoilLockin=lockin, printSwitch=False)
+	assert len(t) == len(field) == x.shape[1]
+	assert field[0] == pytest.approx(FIELD, abs=2e-4)
+	assert field[-1] == pytest.approx(2 * FIELD, abs=2e-4)
+	assert float(lockin.query("AUXV? 1")) == pytest.approx(transverseField.transverseFieldToCompCoilVolt(FIELD, 0.01, 0.01, transverseField.COMP_COIL_CURRENT_PER_VOLTAGE), abs=1e-3)
+	assert not magSupply.heaterIsOn(printSwitch=False)
+	assert magSupply.getPersistentCurrent(printSwitch=False) == pytest.approx(2 * FIELD / FIELD_PER_CURRENT, abs=1e-3)
+	assert magSupply.getOutputCurrent(printSwitch=False) == pytest.approx(0, abs=1e-3)
+
+def test_measureDuringRamp_error_returns_to_persistent(magnet, monkeypatch):
+	magSupply, lockin = magnet
+	def failingTakeData(*args, **kwargs):
+		time.sleep(0.5)
+		raise RuntimeError("lock-in failed")
+	monkeypatch.setattr(lockinData, "takeDataMulti", failingTakeData)
+	with pytest.raises(RuntimeError):
+		transverseField.measureDuringRamp(magSupply, [lockin], 0., 2 * FIELD, pollTime=0.1, goPersistent=False, printSwitch=False)
+	# Held part way through the ramp and left persistent there, even with goPersistent=False
+	persistentCurrent = magSupply.getPersistentCurrent(printSwitch=False)
+	assert 0 < persistentCurrent < 2 * FIELD / FIELD_PER_CURRENT
+	assert not magSupply.heaterIsOn(printSwitch=False)
+	assert magSupply.getOutputCurrent(printSwitch=False) == pytest.approx(0, abs=1e-3)
+	state = transverseField.loadMagnetState()
+	assert state["heaterOn"] is False
+	assert state["persistentCurrent"] == pytest.approx(persistentCurrent, abs=1e-3)
+
+def test_measureDuringRamp_stalled_ramp_times_out(magnet, monkeypatch):
+	magSupply, lockin = magnet
+	monkeypatch.setattr(ips12010, "RAMP_TIMEOUT_MARGIN", 0.5)
+	# The supply ramps a hundred times slower than asked
+	startRamp = magSupply.startRamp
+	monkeypatch.setattr(magSupply, "startRamp", lambda current, rate=None, printSwitch=True: startRamp(current, rate=(rate or 1.) / 100, printSwitch=printSwitch))
+	with pytest.raises(TimeoutError):
+		transverseField.measureDuringRamp(magSupply, [lockin], 0., FIELD, pollTime=0.1, printSwitch=False)
+	assert not magSupply.heaterIsOn(printSwitch=False)
+	assert magSupply.getOutputCurrent(printSwitch=False) == pytest.approx(0, abs=1e-3)
+##################################################################################################
@@ -66,9 +66,7 @@ def singleExperiment(transverseField, pumpFreq, pumpAmp, probeFreq, probeAmp, da
 
 	timeStamp = time.time()
 	temp = tempControl.readColdFingerTemp(tempController)
-	pickupX, pickupY = pickupCoilLockin.readSnapshot()
-	driveX, driveY = driveCoilLockin.readSnapshot()
-	emptyX, emptyY = emptyCoilLockin.readSnapshot()
+	(pickupX, pickupY), (driveX, driveY), (emptyX, emptyY) = lockinData.readSnapshotMulti([pickupCoilLockin, driveCoilLockin, emptyCoilLockin])
 ##################################################################################################
 def main():
 	# Create instrument class instances
@@ -0,0 +1,150 @@
+# Chris Tang
+# traceStore.py
+
+import os
+import time
+import h5py
+import numpy as np
+
+import fileio
+
+# Binary storage of raw lock-in traces, one HDF5 file per point in parameter space:
+# ffff_AAAA_HHHH/traces.h5
+#	attrs: pumpFreq (Hz), pumpAmp (Tesla), transverseField (Tesla)
+#	dddd_xxx/ (one group per trial, named and numbered like the .csv trial files, see fileio.claimTrialNum())
+#		attrs: probeDeltaFreq (Hz), trialNum, t0 (sec), dt (sec), timeStamp, plus any extra metadata
+#		one float32 dataset per column (x, y, pickupX, ...), t = t0 + dt * arange(len)
+
+##################################################################################################
+# Storage Parameters
+
+# Number of points per chunk of a stored column
+CHUNK_SIZE = 16384
+# Compression filter for stored columns ("gzip"/"lzf"), None stores them contiguous so they can be memory-mapped
+COMPRESSION = None
+# Compression level for gzip (0 -> 9)
+COMPRESSION_LEVEL = 4
+##################################################################################################
+def appendTrace(pumpFreq, pumpAmp, transverseField, probeDeltaFreq, columns, dt, t0=0., metadata=None, compression=COMPRESSION):
+	"""Appends one trial's traces to the store of its point in parameter space
+
+	Arguments:
+		pumpFreq: Pump frequency in (Hz)
+		pumpAmp: Pump amplitude in (Tesla)
+		transverseField: Transverse field in (Tesla)
+		probeDeltaFreq: Difference between pump and probe frequencies in (Hz)
+		columns: dict of equal-length 1d arrays, e.g. {"x": x, "y": y}
+		dt: time between points in (sec), i.e. 1 / lockin.getSampleRate()
+		t0: time of the first point in (sec)
+		metadata: optional dict of extra scalar attributes to store with the trial
+		compression: compression filter ("gzip"/"lzf"), None for contiguous memory-mappable columns
+	Return Values:
+		key: name of the trial in the store
+	"""
+
+	lengths = set(len(column) for column in columns.values())
+	if len(lengths) != 1: raise ValueError("Columns of unequal length passed to traceStore.appendTrace()")
+
+	path = fileio.traceStorePath(pumpFreq, pumpAmp, transverseField)
+	parameterDir = os.path.dirname(path) + "/"
+	deltaFreqStr = fileio.deltaFreqToStr(probeDeltaFreq)
+	with h5py.File(path, "a") as store:
+		store.attrs.update({"pumpFreq": pumpFreq, "pumpAmp": pumpAmp, "transverseField": transverseField})
+
+		# Trial number from the counter shared with the .csv trials (see fileio.claimTrialNum())
+		def claim(trialNum):
+			return trialKey(deltaFreqStr, trialNum) not in store and not os.path.exists(fileio.trialNumToPath(parameterDir, deltaFreqStr, trialNum))
+		trialNum = fileio.claimTrialNum(parameterDir, deltaFreqStr, claim)
+		key = trialKey(deltaFreqStr, trialNum)
+
+		group = store.create_group(key)
+		group.attrs.update({"probeDeltaFreq": probeDeltaFreq, "trialNum": trialNum, "t0": t0, "dt": dt, "timeStamp": time.time()})
+		if metadata is not None: group.attrs.update(metadata)
+		for name, column in columns.items():
+			column = np.asarray(column, dtype='<f4')
+			if compression is None:
+				group.create_dataset(name, data=column)
+			else:
+				chunks = (min(CHUNK_SIZE, len(column)),) if len(column) else None
+				options = {"compression_opts": COMPRESSION_LEVEL} if compression == "gzip" else {}
+				group.create_dataset(name, data=column, chunks=chunks, compression=compression, shuffle=True, **options)
+	return key
+
+def readTrace(path, key, columns=None, start=0, stop=None):
+	"""Reads (a slice of) one trial's traces; only the chunks covering the slice are read
+
+	Arguments:
+		path: path of the store
+		key: name of the trial, as returned by appendTrace() or listTraces()
+		columns: names of the columns to read, defaults to all
+		start, stop: range of points to read
+	Return Values:
+		trace: dict with the requested columns and the time array "t" in (sec)
+	"""
+
+	with h5py.File(path, "r") as store:
+		group = store[key]
+		if columns is None: columns = list(group.keys())
+		trace = {name: group[name][start:stop] for name in columns}
+		numPts = len(next(iter(trace.values()))) if trace else 0
+		trace["t"] = group.attrs["t0"] + group.attrs["dt"] * (start + np.arange(numPts))
+	return trace
+
+def readTraces(path, keys=None, columns=None):
+	"""Reads whole traces of many trials, opening the store only once
+
+	Arguments:
+		path: path of the store
+		keys: names of the trials, defaults to all
+		columns: names of the columns to read, defaults to all
+	Return Values:
+		traces: list of dicts as returned by readTrace(), in the order of keys
+	"""
+
+	traces = []
+	with h5py.File(path, "r") as store:
+		if keys is None: keys = sorted(store.keys())
+		for key in keys:
+			group = store[key]
+			trace = {name: group[name][()] for name in (list(group.keys()) if columns is None else columns)}
+			numPts = len(next(iter(trace.values()))) if trace else 0
+			trace["t"] = group.attrs["t0"] + group.attrs["dt"] * np.arange(numPts)
+			traces.append(trace)
+	return traces
+
+def memmapColumn(path, key, column):
+	"""Memory-maps one column of a trial stored without compression (the default)
+	Columns stored chunked or compressed cannot be mapped, and are read into memory instead
+
+	Arguments:
+		path: path of the store
+		key: name of the trial
+		column: name of the column
+	Return Values:
+		arr: read-only np.memmap of the column, or an array if the column cannot be mapped
+	"""
+
+	with h5py.File(path, "r") as store:
+		dataset = store[key][column]
+		offset = dataset.id.get_offset()
+		if dataset.compression is not None or dataset.chunks is not None or offset is None: return dataset[()]
+		shape, dtype = dataset.shape, dataset.dtype
+	return np.memmap(path, mode="r", dtype=dtype, offset=offset, shape=shape)
+
+def trialKey(deltaFreqStr, trialNum):
+	"""Returns the name of a trial in a store, dddd_xxx like its .csv counterpart"""
+
+	return deltaFreqStr + "_" + str(trialNum).zfill(3)
+
+def listTraces(path):
+	"""Returns the names of all trials in a store"""
+
+	with h5py.File(path, "r") as store:
+		return sorted(store.keys())
+
+def readMetadata(path, key=None):
+	"""Returns the attributes of a trial (key), or of the whole store (None), as a dict"""
+
+	with h5py.File(path, "r") as store:
+		return dict((store if key is None else store[key]).attrs)
+##################################################################################################
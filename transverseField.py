@@ -5,6 +5,15 @@ import ips12010
 import sr830
 import math
 import time
+import os
+import json
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import fileio
+import lockinData
 
 ##################################################################################################
 # Main Magnet Parameters
@@ -29,53 +38,282 @@ TRANSVERSE_FIELD_TILT_ANGLE = None
 MAGNET_HEAT_TIME = 30
 # Time to wait in (sec) for the S.C. switch to cool after deactivating the heater
 MAGNET_COOL_TIME = 60
+# Time to wait in (sec) after the switch heats up before confirming the heater is on
+MAGNET_HEATER_CHECK_TIME = 5
 # Time to wait in (sec) between queries for the magnet to be at rest
 MAGNET_REFRESH_TIME = 1
 # Tolerance as a fraction of output current to check whether the output and persistent currents match
 MAGNET_TOLERANCE = 0.05
+# Time to wait in (sec) between output current readings while measuring during a ramp
+RAMP_FIELD_POLL_TIME = 2
+# Number of field points after which a driven sweep passes through persistent mode as a checkpoint, None for never
+SWEEP_CHECKPOINT_INTERVAL = None
+# Difference in (Tesla) from the requested field within which a persistent magnet is left alone,
+# half the resolution of the transverse field in the data directory names
+MAGNET_TARGET_TOLERANCE = 0.0005
+##################################################################################################
+# Magnet State
+
+# File remembering the persistent current and switch heater state across runs
+MAGNET_STATE_PATH = fileio.PROGRAM_HOME_FOLDER + "magnetState.json"
 ##################################################################################################
-def setTransverseField(magSupply, lockin, field):
-	"""Sets the transverse field in (Tesla)
+def setTransverseField(magSupply, lockin, field, printSwitch=True):
+	"""Sets the transverse field in (Tesla), taking the shortest safe sequence from the confirmed magnet state:
+		- already persistent at the field: no magnet transitions at all
+		- switch heater already on (driven mode): ramp, then go persistent
+		- otherwise: match the output to the persistent current (skipped if it already matches),
+		  heater on, ramp, heater off, ramp the leads to zero
 	Also drives the compensation coil for tilt-correction
 
 	Arguments:
 		magSupply: IPS12010 instance that's connected to the power supply you're using
+		lockin: SR830 instance whose aux output drives the compensation coil
 		field: transverse field strength in (Tesla)
 	"""
 
+	targetCurrent = field / AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT
+
 	# Initialize magnet supply
-	magSupply.setInputMode(mode="remoteAndUnlocked")
-	magSupply.setResolution(resolution="normal")
+	magSupply.setInputMode(mode="remoteAndUnlocked", printSwitch=printSwitch)
+	magSupply.setResolution(resolution="normal", printSwitch=printSwitch)
+
+	state = readMagnetState(magSupply, printSwitch=printSwitch)
+	if state["confirmed"] and not state["heaterOn"] and abs(state["persistentCurrent"] - targetCurrent) * AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT <= MAGNET_TARGET_TOLERANCE:
+		if printSwitch: print("Magnet already persistent at %.4f Tesla, no transitions needed" % (state["persistentCurrent"] * AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT))
+	else:
+		if not state["heaterOn"]: enterDrivenMode(magSupply, printSwitch=printSwitch)
+
+		# Set output current to new target
+		magSupply.setOutputCurrent(current=targetCurrent, refreshTime=MAGNET_REFRESH_TIME, printSwitch=printSwitch)
+
+		# Turn heater off to go back into persistent mode
+		magSupply.setHeater(mode=False, heatTime=MAGNET_HEAT_TIME, coolTime=MAGNET_COOL_TIME, printSwitch=printSwitch)
+		saveMagnetState(heaterOn=False, persistentCurrent=targetCurrent)
+
+		# Ramp output current to zero and hold
+		magSupply.rampToZero(refreshTime=MAGNET_REFRESH_TIME, printSwitch=printSwitch)
+
+	# Output current on compensation coil to correct for tilt angle
+	lockin.setAuxOutput(chan=COMP_COIL_CHAN, volt=transverseFieldToCompCoilVolt(field, tiltAngle=TRANSVERSE_FIELD_TILT_ANGLE, compCoilFieldPerCurrent=COMP_COIL_FIELD_PER_CURRENT, compCoilCurrentPerVoltage=COMP_COIL_CURRENT_PER_VOLTAGE), printSwitch=printSwitch)
+
+@contextmanager
+def sweepTransverseField(magSupply, lockin, fields, checkpointInterval=SWEEP_CHECKPOINT_INTERVAL, printSwitch=True):
+	"""Context for stepping through a list of transverse fields in driven mode, with the switch heater kept on,
+	stopping at each plateau so that measurements can be taken there:
+		with transverseField.sweepTransverseField(magSupply, lockin, fields) as steps:
+			for field in steps:
+				... take data ...
+	The heater is turned on once at the start and off once at the end, instead of a full persistent-switch
+	cycle per point. The magnet goes back to persistent mode as soon as the with block exits, whether the
+	loop finished, broke or raised; the steps cannot be resumed after that
+
+	Arguments:
+		magSupply: IPS12010 instance that's connected to the power supply you're using
+		lockin: SR830 instance whose aux output drives the compensation coil
+		fields: transverse field strengths in (Tesla)
+		checkpointInterval: number of points after which to cool the switch (persistent at the present field)
+			and heat it again, bounding the time spent in driven mode; None never checkpoints
+	Return Values:
+		steps: iterator that ramps to each field in turn and yields it once it has been reached
+	"""
+
+	magSupply.setInputMode(mode="remoteAndUnlocked", printSwitch=printSwitch)
+	magSupply.setResolution(resolution="normal", printSwitch=printSwitch)
+	steps = drivenSteps(magSupply, lockin, fields, checkpointInterval, printSwitch)
+	try:
+		enterDrivenMode(magSupply, printSwitch=printSwitch)
+		yield steps
+	finally:
+		steps.close()
+		leaveDrivenMode(magSupply, printSwitch=printSwitch)
+
+def drivenSteps(magSupply, lockin, fields, checkpointInterval, printSwitch):
+	"""Ramps to each field in turn in driven mode and yields it once reached, see sweepTransverseField()"""
+
+	for i, field in enumerate(fields):
+		targetCurrent = field / AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT
+		magSupply.setOutputCurrent(current=targetCurrent, refreshTime=MAGNET_REFRESH_TIME, printSwitch=printSwitch)
+		saveMagnetState(heaterOn=True, persistentCurrent=targetCurrent)
+		lockin.setAuxOutput(chan=COMP_COIL_CHAN, volt=transverseFieldToCompCoilVolt(field, tiltAngle=TRANSVERSE_FIELD_TILT_ANGLE, compCoilFieldPerCurrent=COMP_COIL_FIELD_PER_CURRENT, compCoilCurrentPerVoltage=COMP_COIL_CURRENT_PER_VOLTAGE), printSwitch=printSwitch)
+		if printSwitch: print("Driven sweep: %.4f Tesla reached (%d of %d)" % (field, i + 1, len(fields)))
+
+		yield field
 
-	# Turn switch heater off
-	magSupply.setHeater(mode=False, heatTime=MAGNET_HEAT_TIME, coolTime=MAGNET_COOL_TIME)
+		if checkpointInterval is not None and (i + 1) % checkpointInterval == 0 and i + 1 < len(fields):
+			if printSwitch: print("Driven sweep: Checkpoint, passing through persistent mode")
+			magSupply.setHeater(mode=False, heatTime=MAGNET_HEAT_TIME, coolTime=MAGNET_COOL_TIME, printSwitch=printSwitch)
+			saveMagnetState(heaterOn=False, persistentCurrent=targetCurrent)
+			enterDrivenMode(magSupply, printSwitch=printSwitch)
+
+def enterDrivenMode(magSupply, printSwitch=True):
+	"""Turns the switch heater on after matching the output current to the persistent current,
+	skipping whatever the confirmed magnet state shows is already done
+	"""
+
+	state = readMagnetState(magSupply, printSwitch=printSwitch)
+	if state["heaterOn"]: return
 
 	# Match output current to persistent current
-	magSupply.setOutputCurrent(current=magSupply.getPersistentCurrent(), refreshTime=MAGNET_REFRESH_TIME)
+	if not ips12010.currentsMatch(magSupply.getOutputCurrent(printSwitch=printSwitch), state["persistentCurrent"], MAGNET_TOLERANCE):
+		magSupply.setOutputCurrent(current=state["persistentCurrent"], refreshTime=MAGNET_REFRESH_TIME, printSwitch=printSwitch)
 
 	# IF THE OUTPUT CURRENT DOESN'T MATCH THE PERSISTENT CURRENT
 	# WITH THE SWITCH HEATER ON, SOMETHING IS VERY WRONG
-	magSupply.checkOutputPersistentMatchedCurrent(tolerance=MAGNET_TOLERANCE)
+	magSupply.checkOutputPersistentMatchedCurrent(tolerance=MAGNET_TOLERANCE, printSwitch=printSwitch)
 
 	# Turn switch heater on
-	magSupply.setHeater(mode=True, heatTime=MAGNET_HEAT_TIME, coolTime=MAGNET_COOL_TIME)
+	magSupply.setHeater(mode=True, heatTime=MAGNET_HEAT_TIME, coolTime=MAGNET_COOL_TIME, printSwitch=printSwitch)
 
 	# Make sure heater is on
-	time.sleep(5)
-	if not magSupply.heaterIsOn(): raise Exception("Heater did not turn on successfully")
+	time.sleep(MAGNET_HEATER_CHECK_TIME)
+	if not magSupply.heaterIsOn(printSwitch=printSwitch): raise Exception("Heater did not turn on successfully")
+	saveMagnetState(heaterOn=True, persistentCurrent=state["persistentCurrent"])
 
-	# Set output current to new target
-	magSupply.setOutputCurrent(current=(field / AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT), refreshTime=MAGNET_REFRESH_TIME)
+def leaveDrivenMode(magSupply, printSwitch=True):
+	"""Holds the output wherever it is, even mid-ramp, leaves the magnet persistent there and ramps the leads to zero
+	Safe to call after a failure at any point: the heater is only turned off if the power supply shows it on
+	"""
 
-	# Turn heater off to go back into persistent mode
-	magSupply.setHeater(mode=False)
+	magSupply.write("$A0")
+	if magSupply.heaterIsOn(printSwitch=printSwitch):
+		persistentCurrent = magSupply.getOutputCurrent(printSwitch=printSwitch)
+		magSupply.setHeater(mode=False, heatTime=MAGNET_HEAT_TIME, coolTime=MAGNET_COOL_TIME, printSwitch=printSwitch)
+		saveMagnetState(heaterOn=False, persistentCurrent=persistentCurrent)
+	magSupply.rampToZero(refreshTime=MAGNET_REFRESH_TIME, printSwitch=printSwitch)
 
-	# Output current on compensation coil to correct for tilt angle
-	lockin.setAuxOutput(chan=COMP_COIL_CHAN, volt=transverseFieldToCompCoilVolt(transverseField, tiltAngle=TRANSVERSE_FIELD_TILT_ANGLE, compCoilFieldPerCurrent=COMP_COIL_FIELD_PER_CURRENT, compCoilCurrentPerVoltage=COMP_COIL_CURRENT_PER_VOLTAGE))
+def measureDuringRamp(magSupply, lockins, startField, endField, pollTime=RAMP_FIELD_POLL_TIME, goPersistent=True, compCoilLockin=None, printSwitch=True):
+	"""Streams the lock-in buffers continuously while the magnet ramps in driven mode from startField to endField,
+	reading the output current every pollTime in the background and interpolating the field onto every sample
+	Ramps crossing ips12010.RAMP_RATE_BOUNDARY_CURRENT are split there, each segment at its own acceptable rate
+	and given at most RAMP_TIMEOUT_FACTOR times its predicted time plus RAMP_TIMEOUT_MARGIN to finish
+	Note, the compensation coil is set for startField before the ramp and left there during it
+	If anything fails, the output is held where it is and the magnet is left persistent there with the leads at zero
 
-	# Ramp output current to zero and hold
-	magSupply.rampToZero(refreshTime=MAGNET_REFRESH_TIME)
+	Arguments:
+		magSupply: IPS12010 instance that's connected to the power supply you're using
+		lockins: list of instances of sr830 class
+		startField: transverse field strength in (Tesla) at which to start, reached before measuring
+		endField: transverse field strength in (Tesla) at which to end
+		pollTime: time to wait between output current readings in (sec)
+		goPersistent: leaves the magnet persistent at endField if True, otherwise in driven mode
+		compCoilLockin: SR830 instance whose aux output drives the compensation coil, None leaves the coil alone
+	Return Values:
+		t: common time array with units of (sec), measured from the start of the ramp
+		field: transverse field array at each sample in (Tesla)
+		x: in-phase amplitude array of shape (len(lockins), len(t)) with units of (Volt)
+		y: out-of-phase amplitude array of shape (len(lockins), len(t)) with units of (Volt)
+	"""
+
+	startCurrent = startField / AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT
+	endCurrent = endField / AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT
+	segments = rampSegments(startCurrent, endCurrent)
+	predictedTime = sum(ips12010.rampTime(start, end, ips12010.acceptableRampRate(0.5 * (start + end))) for start, end in segments)
+
+	magSupply.setInputMode(mode="remoteAndUnlocked", printSwitch=printSwitch)
+	magSupply.setResolution(resolution="normal", printSwitch=printSwitch)
+	completed = False
+	try:
+		enterDrivenMode(magSupply, printSwitch=printSwitch)
+		magSupply.setOutputCurrent(current=startCurrent, refreshTime=MAGNET_REFRESH_TIME, printSwitch=printSwitch)
+		if compCoilLockin is not None:
+			compCoilLockin.setAuxOutput(chan=COMP_COIL_CHAN, volt=transverseFieldToCompCoilVolt(startField, tiltAngle=TRANSVERSE_FIELD_TILT_ANGLE, compCoilFieldPerCurrent=COMP_COIL_FIELD_PER_CURRENT, compCoilCurrentPerVoltage=COMP_COIL_CURRENT_PER_VOLTAGE), printSwitch=printSwitch)
+		if printSwitch: print("Measuring during ramp %.4f -> %.4f Tesla, predicted %.0f sec" % (startField, endField, predictedTime))
+
+		t0 = time.time()
+		stopEvent = threading.Event()		# Set by the ramp when it ends, stops the lock-ins
+		abortEvent = threading.Event()		# Set if taking data fails, stops the ramp
+		times, currents = [], []
+		def rampMagnet():
+			try:
+				for start, end in segments:
+					rate = ips12010.acceptableRampRate(0.5 * (start + end))
+					segmentStart = time.time()
+					deadline = segmentStart + ips12010.RAMP_TIMEOUT_FACTOR * ips12010.rampTime(start, end, rate) + ips12010.RAMP_TIMEOUT_MARGIN
+					times.append(segmentStart - t0)
+					currents.append(magSupply.getOutputCurrent(printSwitch=False))
+					magSupply.startRamp(end, rate=rate, printSwitch=False)
+					abortEvent.wait(ips12010.RAMP_START_DELAY)
+					while not abortEvent.is_set() and not magSupply.isAtRest():
+						now = time.time()
+						if now >= deadline: raise TimeoutError("IPS 120-10: Power supply not at rest after %.0f sec" % (now - segmentStart))
+						times.append(now - t0)
+						currents.append(magSupply.getOutputCurrent(printSwitch=False))
+						abortEvent.wait(pollTime)
+					if abortEvent.is_set(): return
+					saveMagnetState(heaterOn=True, persistentCurrent=end)
+				magSupply.write("$A0")
+				times.append(time.time() - t0)
+				currents.append(magSupply.getOutputCurrent(printSwitch=False))
+			finally:
+				stopEvent.set()
+
+		maxTime = ips12010.RAMP_TIMEOUT_FACTOR * predictedTime + ips12010.RAMP_TIMEOUT_MARGIN
+		with ThreadPoolExecutor(max_workers=1) as executor:
+			ramp = executor.submit(rampMagnet)
+			try:
+				t, x, y = lockinData.takeDataMulti(lockins, maxTime, t0=t0, stopEvent=stopEvent, printSwitch=printSwitch)
+			except BaseException:
+				abortEvent.set()
+				raise
+			ramp.result()
+		field = np.interp(t, times, currents) * AMI_3_INCH_8_TESLA_SOLENOID_FIELD_PER_CURRENT
+		completed = True
+	finally:
+		# Leaves the magnet persistent, at endField after a completed ramp or wherever it was held otherwise
+		if goPersistent or not completed: leaveDrivenMode(magSupply, printSwitch=printSwitch)
+	if printSwitch: print("%d points over %.4f -> %.4f Tesla from %d current readings" % (len(t), startField, endField, len(times)))
+	return t, field, x, y
+
+def rampSegments(startCurrent, endCurrent):
+	"""Splits a ramp between two currents in (Amp) where it crosses +/- ips12010.RAMP_RATE_BOUNDARY_CURRENT
+
+	Return Values:
+		segments: list of (start, end) currents in (Amp), in ramp order
+	"""
+
+	boundaries = [current for current in (-ips12010.RAMP_RATE_BOUNDARY_CURRENT, ips12010.RAMP_RATE_BOUNDARY_CURRENT) if min(startCurrent, endCurrent) < current < max(startCurrent, endCurrent)]
+	points = [startCurrent] + sorted(boundaries, reverse=endCurrent < startCurrent) + [endCurrent]
+	return list(zip(points[:-1], points[1:]))
 ##################################################################################################
+def loadMagnetState():
+	"""Returns the magnet state saved by the last run as a dict, or None if there is none"""
+
+	try:
+		with open(MAGNET_STATE_PATH) as stateFile:
+			return json.load(stateFile)
+	except (FileNotFoundError, ValueError):
+		return None
+
+def saveMagnetState(heaterOn, persistentCurrent):
+	"""Atomically saves the magnet state
+
+	Arguments:
+		heaterOn: True if the switch heater is on (driven mode)
+		persistentCurrent: current in (Amp) through the magnet
+	"""
+
+	with open(MAGNET_STATE_PATH + ".tmp", "w") as stateFile:
+		json.dump({"heaterOn": heaterOn, "persistentCurrent": persistentCurrent, "timeStamp": time.time()}, stateFile)
+	os.replace(MAGNET_STATE_PATH + ".tmp", MAGNET_STATE_PATH)
+
+def readMagnetState(magSupply, printSwitch=True):
+	"""Reads the heater state and persistent current from the power supply and confirms them against the saved state
+	Only a confirmed state is trusted to skip transitions; the readings of the power supply are used either way.
+	Nothing is saved here: the saved state is only updated once a sequence has established it, so that a
+	reading that was never confirmed cannot confirm the next one
+
+	Return Values:
+		state: dict with heaterOn, persistentCurrent in (Amp) and confirmed (True if the saved state agrees)
+	"""
+
+	heaterOn = magSupply.heaterIsOn(printSwitch=printSwitch)
+	persistentCurrent = magSupply.getPersistentCurrent(printSwitch=printSwitch)
+	saved = loadMagnetState()
+
+	confirmed = saved is not None and saved["heaterOn"] == heaterOn and ips12010.currentsMatch(saved["persistentCurrent"], persistentCurrent, MAGNET_TOLERANCE)
+	if printSwitch and not confirmed: print("WARNING: Saved magnet state %s does not match the power supply, taking the full sequence" % saved)
+	return {"heaterOn": heaterOn, "persistentCurrent": persistentCurrent, "confirmed": confirmed}
+
 def transverseFieldToCompCoilVolt(transverseField, tiltAngle, compCoilFieldPerCurrent, compCoilCurrentPerVoltage):
 	"""Converts a transverse field value to a required aux drive voltage
 